@@ -1,13 +1,11 @@
-import pandas as pd 
+import argparse
 import statistics
 import time
 import threading
-import sys
 import os
 from email.message import EmailMessage
 import smtplib
 import ssl
-import certifi  # Use certifi for SSL certificates
 
 # REQUIRED PACKAGES:
 # pandas
@@ -20,12 +18,21 @@ import certifi  # Use certifi for SSL certificates
 # When running my code you can not use keyboard interupts due to the use of threads.
 # To stop the program after execution simply kill the terminal.
 
-# 1 Get File name from command line arguments.
+# Importing this module has no side effects, pandas and certifi are only
+# imported when a file is read or an email is sent. Run it from the command line:
 # e.g python algorithm.py file.xlsx or file.csv
-file = sys.argv[1]
 
-# read from either CSV or Excel
+# GET emial details
+email_sender = "email"
+email_password = "app_authentication_password"
+email_reciever = "client_email"
+
+# Seconds to wait before each value is processed (30 minutes).
+CHECK_INTERVAL = 1800
+
+# 1 read from either CSV or Excel
 def read_file(file_path):
+    import pandas as pd
     ext = os.path.splitext(file_path)[1]
     if ext == ".csv":
         return pd.read_csv(file_path)
@@ -34,94 +41,93 @@ def read_file(file_path):
     else:
         raise ValueError("Error: Please supply either excel(.xlsx) or csv(.csv) files.")
 
-# Selecting the entire file once it is confirmed to be either csv or excel.
-data1 = read_file(file)
-# Dropping the 'Date & Time' column, if you file does not have this column then comment out this line.
-data1 = data1.drop('Date & Time', axis=1)
-
-# Get the label of each column.
-cols = data1.columns.values
 # 2 CLEAN DATA
 # This current method for cleaning changes all Nan data entries to 0.
-def clean_data():
-    data1_cleaned = data1.fillna(0)
-    return data1_cleaned
+def clean_data(data):
+    # Dropping the 'Date & Time' column when the file has one.
+    if 'Date & Time' in data.columns:
+        data = data.drop('Date & Time', axis=1)
+    return data.fillna(0)
+
 # Selecting each individual column and turning the data into a list so it can be iterated over.
-def get_list():
-    store_list = []
-    values = clean_data()
-    # add the name of each column as a string into store_list.
-    for column in cols:
-        store_list.append(column)
-    # add the data of each column as a list into store_list.
-    for column in cols:
-        store_list.append(values[column].tolist())
-    return store_list
+# Returns {column name: list of values}, in column order.
+def get_columns(data):
+    values = clean_data(data)
+    return {column: values[column].tolist() for column in values.columns.values}
 
-# GET emial details
-email_sender = "email"
-email_password = "app_authentication_password"
-email_reciever = "client_email"
+def load_columns(file_path):
+    return get_columns(read_file(file_path))
+
+# Getting the mean of the values, setting the boundary, upper and lower limits.
+def get_limits(dataset):
+    mean = statistics.mean(dataset)
+    boundary = (mean * 0.15)
+    return (mean - boundary), (mean + boundary)
+
+# Works out whether a value is too high, too low or normal and the message to send.
+def check_value(value, name, lower_limit, upper_limit):
+    if value > upper_limit:
+        # Sends a notification with the title of system alert and the message of which section sent the warning.
+        return f"WARNING SECTION {name} IS ABNORMALLY HIGH: {value}"
+    elif value < lower_limit:
+        return f"WARNING SECTION {name} IS ABNORMALLY LOW: {value}"
+    # This value is not really necessary since it just lets the user know that their value is normal.
+    # It is just here for testing purposes.
+    return f"Normal for sec {name}, value = {value}"
 
-# Create SSL context for secure connection
-context_block = ssl.create_default_context(cafile=certifi.where())
+def send_email(subject, body):
+    import certifi  # Use certifi for SSL certificates
+    # Create SSL context for secure connection
+    context_block = ssl.create_default_context(cafile=certifi.where())
+    # Create the email
+    em = EmailMessage()
+    em['From'] = "SETU Technologies inc."
+    em['To'] = email_reciever
+    em['Subject'] = subject
+    em.set_content(body)
+    # Send email
+    # smpt.gmail.com (host) this defines where the sender email is coming from (in this case it has to be gmail).
+    # 465 is the port
+    # context is the SSL certificate
+    with smtplib.SMTP_SSL('smtp.gmail.com', 465, context=context_block) as smtp:
+        # This is where the app logs in.
+        smtp.login(email_sender, email_password)
+        # This is the actual contents of the email.
+        smtp.sendmail(email_sender, email_reciever, em.as_string())
 
 # Check the boundary
-def check_boundary(dataset,name):
-    # While loop will keep looking at each value and report the status 30 seconds later
-    run = True
-    while run:
-        # Getting the mean of the values, setting the boundary, upper and lower limits.
-        mean = statistics.mean(dataset)
-        boundary = (mean * 0.15)
-        upper_limit = (mean + boundary)
-        lower_limit = (mean - boundary)
-        # Iterating over each value to see if its too high, too low or normal.
-        for value in dataset:  
-            # Waiting 30 minutes (1800 seconds) before it processes the value.
-            time.sleep(1800)
-            if value > upper_limit:
-                # Sends a notification with the title of system alert and the message of which section sent the warning.
-                body = f"WARNING SECTION {name} IS ABNORMALLY HIGH: {value}"
-            elif value < lower_limit:
-                body = f"WARNING SECTION {name} IS ABNORMALLY LOW: {value}"
-            else:
-                # This value is not really necessary since it just lets the user know that their value is normal.
-                # It is just here for testing purposes.
-                body = f"Normal for sec {name}, value = {value}"
-            # Create the email
-            em = EmailMessage()
-            em['From'] = "SETU Technologies inc."
-            em['To'] = email_reciever
-            em['Subject'] = name
-            em.set_content(body)
-            # Send email
-            # smpt.gmail.com (host) this defines where the sender email is coming from (in this case it has to be gmail).
-            # 465 is the port
-            # context is the SSL certificate
-            with smtplib.SMTP_SSL('smtp.gmail.com', 465, context=context_block) as smtp:
-                # This is where the app logs in.
-                smtp.login(email_sender, email_password)
-                # This is the actual contents of the email.
-                smtp.sendmail(email_sender, email_reciever, em.as_string())
-        # This prevents the loop from running indefinetly by setting run to False.
-        run = False
-
-# main function that runs the check_boundary function on each column and its values.
-def main():
+# Looks at each value and reports the status, waiting interval seconds before each one.
+def check_boundary(dataset, name, interval=CHECK_INTERVAL, notify=send_email):
+    lower_limit, upper_limit = get_limits(dataset)
+    # Iterating over each value to see if its too high, too low or normal.
+    for value in dataset:
+        time.sleep(interval)
+        notify(name, check_value(value, name, lower_limit, upper_limit))
+
+def print_message(subject, body):
+    print(body)
+
+# runs the check_boundary function on each column and its values.
+def run(columns, interval=CHECK_INTERVAL, notify=send_email):
     # threads to run concurrrently
     threads = []
-    # get the length of the dataset
-    length = len(cols)
-    for num in range(length):
-        # data_store will be the index of the lists of data from each column.
-        data_store = (num + length)
-        data_thread = threading.Thread(target=check_boundary,args=(get_list()[data_store],get_list()[num]))
+    for name, dataset in columns.items():
+        data_thread = threading.Thread(target=check_boundary, args=(dataset, name, interval, notify))
         data_thread.start()
         threads.append(data_thread)
     # join the threads to stop them after execution.
     for thread in threads:
         thread.join()
 
+# main function, the command line entry point.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Email a status for every value of every column in a CSV or Excel file.")
+    parser.add_argument("file", help="a .csv or .xlsx file")
+    parser.add_argument("--interval", type=float, default=CHECK_INTERVAL, help="seconds to wait before each value (default: %(default)s)")
+    parser.add_argument("--print", dest="print_only", action="store_true", help="print the messages instead of emailing them")
+    args = parser.parse_args(argv)
+
+    run(load_columns(args.file), args.interval, print_message if args.print_only else send_email)
+
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
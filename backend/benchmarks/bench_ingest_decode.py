@@ -0,0 +1,98 @@
+# Before/after benchmark for the ingest decode path and list responses.
+# Run from the backend folder: python benchmarks/bench_ingest_decode.py
+import json
+import os
+import random
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from models.notification_model import Notification
+from services.sensor_service import process_sensor_data, decode_sensor_payload, build_notifications
+
+NUMBER = 20000
+
+def generate_mock_data():
+    return {
+        "sensor_id": str(uuid.uuid4()),
+        "adc": random.randint(0, 1023),
+        "position": f"{random.uniform(-90, 90)}, {random.uniform(-180, 180)}",
+        "roll": random.uniform(-180, 180),
+        "pitch": random.uniform(-90, 90),
+        "accelerometer": [random.uniform(-10, 10) for _ in range(3)],
+        "magnetometer": {"x": random.uniform(-50, 50), "y": random.uniform(-50, 50), "z": random.uniform(-50, 50)},
+        "gyroscope": {"x": random.uniform(-500, 500), "y": random.uniform(-500, 500), "z": random.uniform(-500, 500)},
+        "temperature": random.uniform(20, 30),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+body = json.dumps(generate_mock_data()).encode()
+sensor = {"sensor_id": "bench", "owner_id": "bench@example.com", "name": "bench"}
+alerts = {"temperature": "warning", "accelerometer": {"x": "danger", "y": "good", "z": "good"}}
+
+def old_ingest():
+    # FastAPI parses the body into Dict[str, Any], then the pydantic model round trip
+    data = json.loads(body)
+    sensor_data = process_sensor_data(data)
+    sensor_data_dict = sensor_data.model_dump()
+    notifications = []
+    for field, status in alerts.items():
+        if isinstance(status, dict):
+            for sub_field, sub_status in status.items():
+                if sub_status in ['warning', 'danger']:
+                    notifications.append(Notification(
+                        notification_id=str(uuid.uuid4()),
+                        user_id=sensor['owner_id'],
+                        sensor_id=sensor['sensor_id'],
+                        message=f"{sub_status.upper()}: Abnormal {field}.{sub_field} reading for sensor {sensor['name']}",
+                        alert_type=sub_status,
+                        data={'sensor_data': sensor_data_dict, 'field': field, 'sub_field': sub_field}
+                    ).dict())
+        elif status in ['warning', 'danger', 'invalid']:
+            notifications.append(Notification(
+                notification_id=str(uuid.uuid4()),
+                user_id=sensor['owner_id'],
+                sensor_id=sensor['sensor_id'],
+                message=f"{status.upper()}: Abnormal {field} reading for sensor {sensor['name']}",
+                alert_type=status,
+                data={'sensor_data': sensor_data_dict, 'field': field}
+            ).dict())
+    return sensor_data_dict, notifications
+
+def new_ingest():
+    sensor_data_dict = decode_sensor_payload(body)
+    return sensor_data_dict, build_notifications(sensor, sensor_data_dict, alerts)
+
+# A /api/sensor-data/{sensor_id} page worth of stored readings
+rows = []
+for _ in range(100):
+    row = decode_sensor_payload(json.dumps(generate_mock_data()).encode())
+    row["_id"] = uuid.uuid4().hex[:24]
+    row["alerts"] = alerts
+    rows.append(row)
+
+def old_response():
+    return JSONResponse(jsonable_encoder(rows)).body
+
+def new_response():
+    return ORJSONResponse(rows).body
+
+def report(name, before, after, number):
+    b = min(timeit.repeat(before, number=number, repeat=3)) / number * 1e6
+    a = min(timeit.repeat(after, number=number, repeat=3)) / number * 1e6
+    print(f"{name:<24} before {b:9.2f} us   after {a:9.2f} us   speedup {b / a:5.1f}x")
+
+if __name__ == "__main__":
+    new_document = new_ingest()[0]
+    # The fast path also parses position into a GeoJSON location
+    new_document.pop("location", None)
+    assert old_ingest()[0] == new_document
+    assert orjson.loads(old_response()) == orjson.loads(new_response())
+    report("ingest decode", old_ingest, new_ingest, NUMBER)
+    report("list response (100)", old_response, new_response, NUMBER // 20)
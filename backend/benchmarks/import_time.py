@@ -0,0 +1,51 @@
+# Import-time budget check for the API and the command line tools.
+# Run from the backend folder: python benchmarks/import_time.py
+# Each module is imported in a fresh interpreter with -X importtime, best of
+# IMPORT_TIME_RUNS runs. Exits with status 1 when a module is over its budget.
+import os
+import re
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds, override with e.g. IMPORT_BUDGET_MAIN_MS=1500
+BUDGETS = {
+    "main": float(os.getenv("IMPORT_BUDGET_MAIN_MS", "2000")),
+    "algorithm": float(os.getenv("IMPORT_BUDGET_ALGORITHM_MS", "150")),
+}
+RUNS = int(os.getenv("IMPORT_TIME_RUNS", "3"))
+TOP = 10
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def measure(module):
+    # Returns {module name: (self us, cumulative us)} for one fresh import
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    times = {}
+    for match in LINE.finditer(result.stderr):
+        times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return times
+
+def main():
+    over = []
+    for module, budget in BUDGETS.items():
+        runs = [measure(module) for _ in range(RUNS)]
+        best = min(runs, key=lambda times: times[module][1])
+        total = best[module][1] / 1000
+        status = "ok" if total <= budget else "OVER BUDGET"
+        print(f"{module}: {total:.1f} ms (budget {budget:.0f} ms) {status}")
+        for name, (own, cumulative) in sorted(best.items(), key=lambda item: -item[1][1])[1:TOP + 1]:
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+        if total > budget:
+            over.append(module)
+    if over:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Read/write routing check against a replica set.
+# Run from the backend folder with the same environment as the API, e.g.
+#   MONGO_DASHBOARD_READ_PREFERENCE=secondaryPreferred MONGO_URI="mongodb://localhost:27017,localhost:27018,localhost:27019/setu_routing?replicaSet=rs0" \
+#       python benchmarks/read_routing.py
+# A write and a read go through the primary collections, READS dashboard
+# reads through the dashboard ones; every command's server is recorded and
+# the script exits with status 1 when a dashboard read hit the primary while
+# a secondary was available, or an ingest/auth command didn't hit the primary.
+import os
+import sys
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient, monitoring, ReadPreference
+
+import database
+
+READS = int(os.getenv("ROUTING_READS", "50"))
+
+class Recorder(monitoring.CommandListener):
+    def __init__(self):
+        self.servers = []
+
+    def started(self, event):
+        if event.command_name in ("insert", "find", "delete"):
+            self.servers.append((event.command_name, event.connection_id))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def main():
+    recorder = Recorder()
+    # Same settings as database.client, plus the listener
+    client = MongoClient(database.MONGO_URI, event_listeners=[recorder], **database._client_options())
+    db = client.get_default_database("setu") if not database.MONGO_DB else client[database.MONGO_DB]
+    primary_db = db.with_options(read_preference=ReadPreference.PRIMARY)
+    dashboard_db = db.with_options(read_preference=database.dashboard_read_preference())
+
+    client.admin.command("ping")
+    primary = client.primary
+    secondaries = client.secondaries
+    print(f"primary {primary}, secondaries {sorted(secondaries)}")
+    print(f"dashboard reads: {dashboard_db.read_preference}")
+
+    sensor_id = f"routing-{uuid.uuid4()}"
+    collection = primary_db["routing_check"]
+    collection.insert_one({"sensor_id": sensor_id})
+    collection.find_one({"sensor_id": sensor_id})
+    for _ in range(READS):
+        dashboard_db["routing_check"].find_one({"sensor_id": sensor_id})
+    collection.delete_many({"sensor_id": sensor_id})
+
+    primary_commands = recorder.servers[:2] + recorder.servers[-1:]
+    dashboard_commands = recorder.servers[2:-1]
+    failures = [command for command, server in primary_commands if server != primary]
+    counts = Counter(server for _, server in dashboard_commands)
+    print(f"ingest/auth commands: {', '.join(f'{command} on {server}' for command, server in primary_commands)}")
+    print(f"dashboard reads: {dict(counts)}")
+
+    if database.DASHBOARD_READ_PREFERENCE in ("secondary", "secondaryPreferred") and secondaries and counts.get(primary):
+        failures.append(f"{counts[primary]} dashboard reads on the primary")
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+        sys.exit(1)
+    print("ok")
+
+if __name__ == "__main__":
+    main()
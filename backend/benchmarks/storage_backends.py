@@ -0,0 +1,129 @@
+# Ingest throughput and memory of the readings store backends.
+# Run from the backend folder: python benchmarks/storage_backends.py
+#   BENCH_READINGS=100000 BENCH_BATCH=500 BENCH_SENSORS=50
+# Each backend runs in its own process so its RSS is its own: startup (open,
+# schema/indexes), insert_many of BENCH_READINGS mock readings in batches of
+# BENCH_BATCH, then BENCH_QUERIES recent() lookups. The Mongo run writes to a
+# scratch bench_readings collection of the configured database (MONGO_URI,
+# MONGO_DB) and drops it afterwards; mongod's own resident memory comes from
+# serverStatus, the SQLite backend has no server.
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+READINGS = int(os.getenv("BENCH_READINGS", "100000"))
+BATCH = int(os.getenv("BENCH_BATCH", "500"))
+SENSORS = int(os.getenv("BENCH_SENSORS", "50"))
+QUERIES = int(os.getenv("BENCH_QUERIES", "1000"))
+
+def mock_readings(sensor_ids):
+    from services.sensor_service import build_sensor_document
+    start = datetime.now() - timedelta(seconds=READINGS)
+    for index in range(READINGS):
+        yield build_sensor_document({
+            "sensor_id": sensor_ids[index % len(sensor_ids)],
+            "adc": random.randint(0, 1023),
+            "position": f"{random.uniform(-90, 90)}, {random.uniform(-180, 180)}",
+            "roll": random.uniform(-180, 180),
+            "pitch": random.uniform(-90, 90),
+            "accelerometer": [random.uniform(-10, 10) for _ in range(3)],
+            "gyroscope": {"x": random.uniform(-500, 500), "y": random.uniform(-500, 500), "z": random.uniform(-500, 500)},
+            "temperature": random.uniform(20, 30),
+            "timestamp": start + timedelta(seconds=index),
+        })
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def open_store(backend: str, directory: str):
+    from services.readings_store import SqliteReadingStore, MongoReadingStore
+    if backend == "sqlite":
+        return SqliteReadingStore(os.path.join(directory, "bench.db"))
+
+    from pymongo import ASCENDING, DESCENDING
+    import database
+    database.client.admin.command("ping")
+    collection = database.db["bench_readings"]
+    collection.drop()
+    collection.create_index([("sensor_id", ASCENDING), ("timestamp", DESCENDING)])
+    return MongoReadingStore(collection)
+
+def size_mb(backend: str, store) -> float:
+    if backend == "sqlite":
+        return round(sum(os.path.getsize(store.path + suffix) for suffix in ("", "-wal") if os.path.exists(store.path + suffix)) / 2**20, 1)
+    stats = store.collection.database.command("collStats", store.collection.name)
+    return round((stats["storageSize"] + stats["totalIndexSize"]) / 2**20, 1)
+
+def server_rss_mb(backend: str, store):
+    if backend == "sqlite":
+        return None
+    return store.collection.database.client.admin.command("serverStatus")["mem"]["resident"]
+
+def child(backend: str):
+    directory = tempfile.mkdtemp(prefix="bench-storage-")
+    sensor_ids = [str(uuid.uuid4()) for _ in range(SENSORS)]
+    readings = list(mock_readings(sensor_ids))
+    baseline_rss = max_rss_mb()
+
+    started = time.perf_counter()
+    store = open_store(backend, directory)
+    startup_ms = (time.perf_counter() - started) * 1000
+
+    try:
+        started = time.perf_counter()
+        for offset in range(0, len(readings), BATCH):
+            store.insert_many(readings[offset:offset + BATCH])
+        ingest_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for index in range(QUERIES):
+            store.recent(sensor_ids[index % SENSORS], 10)
+        query_ms = (time.perf_counter() - started) * 1000 / QUERIES
+
+        print(json.dumps({
+            "backend": backend,
+            "startup_ms": round(startup_ms, 1),
+            "readings_per_s": round(READINGS / ingest_seconds),
+            "recent_ms": round(query_ms, 3),
+            # Growth over the process with the mock readings generated
+            "store_rss_mb": round(max_rss_mb() - baseline_rss, 1),
+            "process_rss_mb": max_rss_mb(),
+            "server_rss_mb": server_rss_mb(backend, store),
+            "size_mb": size_mb(backend, store),
+        }))
+    finally:
+        if backend == "mongo":
+            store.collection.drop()
+        store.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main():
+    env = {**os.environ, "MONGO_SERVER_SELECTION_TIMEOUT_MS": os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")}
+    print(f"{READINGS} readings of {SENSORS} sensors in batches of {BATCH}, {QUERIES} recent() lookups")
+    columns = ("startup_ms", "readings_per_s", "recent_ms", "store_rss_mb", "process_rss_mb", "server_rss_mb", "size_mb")
+    print(f"{'backend':<8} " + " ".join(f"{column:>15}" for column in columns))
+    for backend in ("sqlite", "mongo"):
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", backend], capture_output=True, text=True, env=env)
+        if result.returncode != 0:
+            error = (result.stderr.strip().splitlines() or ["failed"])[-1]
+            print(f"{backend:<8} unavailable: {error[:160]}")
+            continue
+        row = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{backend:<8} " + " ".join(f"{str(row[column]):>15}" for column in columns))
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        child(sys.argv[2])
+    else:
+        main()
@@ -1,8 +1,79 @@
-from pymongo import MongoClient, ASCENDING, DESCENDING
+import os
+from typing import Optional
+
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReadPreference
+from pymongo.read_preferences import PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+# Database name: MONGO_DB, else the one in MONGO_URI, else "setu"
+MONGO_DB = os.getenv("MONGO_DB")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))  # 0: no timeout
+# "1", "majority", ...; the server default when unset
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN")
+MONGO_WRITE_TIMEOUT_MS = int(os.getenv("MONGO_WRITE_TIMEOUT_MS", "0"))
+MONGO_JOURNAL = os.getenv("MONGO_JOURNAL")
+# Sent alert deliveries are kept this long, failed ones until retried
+DELIVERY_RETENTION_DAYS = int(os.getenv("DELIVERY_RETENTION_DAYS", "7"))
+
+# Dashboard and analytics reads may go to a secondary at most
+# MONGO_MAX_STALENESS_SECONDS behind (the driver's minimum is 90);
+# ingest, auth and everything that reads before writing stay on the primary.
+# primaryPreferred only uses a secondary while there is no primary. With
+# secondaryPreferred (opt-in) a response rebuilt right after a write can
+# come from a secondary that hasn't replicated it yet and is then cached,
+# so users may not see their own writes until it expires
+DASHBOARD_READ_PREFERENCE = os.getenv("MONGO_DASHBOARD_READ_PREFERENCE", "primaryPreferred")
+MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "90"))
+
+READ_PREFERENCES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def _client_options():
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+    }
+    if MONGO_WRITE_CONCERN:
+        options["w"] = int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+    if MONGO_WRITE_TIMEOUT_MS:
+        options["wTimeoutMS"] = MONGO_WRITE_TIMEOUT_MS
+    if MONGO_JOURNAL:
+        options["journal"] = MONGO_JOURNAL == "1"
+    return options
+
+def dashboard_read_preference():
+    if DASHBOARD_READ_PREFERENCE == "primary":
+        return ReadPreference.PRIMARY
+    if DASHBOARD_READ_PREFERENCE not in READ_PREFERENCES:
+        raise ValueError(f"MONGO_DASHBOARD_READ_PREFERENCE must be primary or one of {', '.join(READ_PREFERENCES)}")
+    return READ_PREFERENCES[DASHBOARD_READ_PREFERENCE](max_staleness=MONGO_MAX_STALENESS_SECONDS)
+
+# How long a cached dashboard response may be served without a rebuild: a
+# response built from a secondary may miss writes up to the staleness bound
+# older than it, so it must not outlive them. None when reads use the primary.
+DASHBOARD_MAX_AGE: Optional[int] = None if DASHBOARD_READ_PREFERENCE == "primary" else MONGO_MAX_STALENESS_SECONDS
+
+# connect=False: nothing touches the network until the first query, so
+# importing this module is cheap. Collections and indexes are bootstrapped
+# by setup_mongodb(), which main.py runs from the app lifespan.
+client = MongoClient(MONGO_URI, connect=False, **_client_options())
+# Primary regardless of a readPreference in MONGO_URI
+db = client.get_default_database("setu") if not MONGO_DB else client[MONGO_DB]
+db = db.with_options(read_preference=ReadPreference.PRIMARY)
+dashboard_db = db.with_options(read_preference=dashboard_read_preference())
+
 def setup_mongodb():
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client["setu"]
-    
     # Create collections with indexes
     if "users" not in db.list_collection_names():
         db.create_collection("users")
@@ -35,6 +106,62 @@ def setup_mongodb():
         db.notifications.create_index([("user_id", ASCENDING)])
         db.notifications.create_index([("timestamp", DESCENDING)])
     
+    if "delete_jobs" not in db.list_collection_names():
+        db.create_collection("delete_jobs")
+        db.delete_jobs.create_index([("job_id", ASCENDING)], unique=True)
+        db.delete_jobs.create_index([("status", ASCENDING)])  # For resuming unfinished jobs
+
+    if "delete_job_ids" not in db.list_collection_names():
+        db.create_collection("delete_job_ids")
+        # The IDs a delete job removes, in chunks so a big project stays under the document limit
+        db.delete_job_ids.create_index([("job_id", ASCENDING), ("name", ASCENDING), ("chunk", ASCENDING)], unique=True)
+    
+    if "notification_counters" not in db.list_collection_names():
+        db.create_collection("notification_counters")
+        db.notification_counters.create_index([("user_id", ASCENDING)], unique=True)
+    
+    if "acl_versions" not in db.list_collection_names():
+        db.create_collection("acl_versions")
+        # Per-user stamps bumped by deletes, see services/acl.py
+        db.acl_versions.create_index([("user_id", ASCENDING)], unique=True)
+    
+    if "asset_health" not in db.list_collection_names():
+        db.create_collection("asset_health")
+        db.asset_health.create_index([("asset_id", ASCENDING)], unique=True)
+        db.asset_health.create_index([("project_id", ASCENDING)])  # For project health views
+    
+    if "sensor_sketches" not in db.list_collection_names():
+        db.create_collection("sensor_sketches")
+        db.sensor_sketches.create_index([("sensor_id", ASCENDING), ("field", ASCENDING), ("bucket", ASCENDING)], unique=True)
+    
+    if "deliveries" not in db.list_collection_names():
+        db.create_collection("deliveries")
+        db.deliveries.create_index([("delivery_id", ASCENDING)], unique=True)
+        db.deliveries.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])  # For claiming due deliveries
+        db.deliveries.create_index([("sent_at", ASCENDING)], expireAfterSeconds=DELIVERY_RETENTION_DAYS * 86400)
+    
+    if "delivery_digests" not in db.list_collection_names():
+        db.create_collection("delivery_digests")
+        # One open digest per user
+        db.delivery_digests.create_index([("user_id", ASCENDING)], unique=True, partialFilterExpression={"open": True})
+        db.delivery_digests.create_index([("open", ASCENDING), ("due_at", ASCENDING)])
+    
+    if "analysis_jobs" not in db.list_collection_names():
+        db.create_collection("analysis_jobs")
+        db.analysis_jobs.create_index([("job_id", ASCENDING)], unique=True)
+        db.analysis_jobs.create_index([("owner_id", ASCENDING), ("created_at", DESCENDING)])  # For listing a user's jobs
+        db.analysis_jobs.create_index([("status", ASCENDING)])  # For resuming unfinished jobs
+
+    if "analysis_results" not in db.list_collection_names():
+        db.create_collection("analysis_results")
+        # One document per analysed column, a wide file stays far from the 16 MB document limit
+        db.analysis_results.create_index([("job_id", ASCENDING), ("index", ASCENDING)], unique=True)
+    
+    # Added after the first release, create_index is a no-op when they already exist
+    db.sensors.create_index([("asset_ids", ASCENDING)])  # For finding asset's sensors
+    db.notifications.create_index([("sensor_id", ASCENDING)])  # For cascade deletes
+    db.sensors.create_index([("location", "2dsphere")])  # Latest position, for map queries
+    
     return {
         "client": client,
         "db": db,
@@ -43,14 +170,43 @@ def setup_mongodb():
         "sensor_data": db["sensor_data"],
         "projects": db["projects"],
         "assets": db["assets"],
-        "notifications": db["notifications"]
+        "notifications": db["notifications"],
+        "delete_jobs": db["delete_jobs"],
+        "delete_job_ids": db["delete_job_ids"],
+        "notification_counters": db["notification_counters"],
+        "acl_versions": db["acl_versions"],
+        "asset_health": db["asset_health"],
+        "sensor_sketches": db["sensor_sketches"],
+        "deliveries": db["deliveries"],
+        "delivery_digests": db["delivery_digests"],
+        "analysis_jobs": db["analysis_jobs"],
+        "analysis_results": db["analysis_results"]
     }
 
-mongodb = setup_mongodb()
-db = mongodb["db"]
-users_collection = mongodb["users"]
-sensors_collection = mongodb["sensors"] 
-sensor_data_collection = mongodb["sensor_data"]
-projects_collection = mongodb["projects"]
-assets_collection = mongodb["assets"]
-notification_collection = mongodb["notifications"]
\ No newline at end of file
+users_collection = db["users"]
+sensors_collection = db["sensors"]
+sensor_data_collection = db["sensor_data"]
+projects_collection = db["projects"]
+assets_collection = db["assets"]
+notification_collection = db["notifications"]
+delete_jobs_collection = db["delete_jobs"]
+delete_job_ids_collection = db["delete_job_ids"]
+notification_counters_collection = db["notification_counters"]
+acl_versions_collection = db["acl_versions"]
+asset_health_collection = db["asset_health"]
+sensor_sketches_collection = db["sensor_sketches"]
+deliveries_collection = db["deliveries"]
+delivery_digests_collection = db["delivery_digests"]
+analysis_jobs_collection = db["analysis_jobs"]
+analysis_results_collection = db["analysis_results"]
+
+# Dashboard/analytics reads, see MONGO_DASHBOARD_READ_PREFERENCE
+users_reads = dashboard_db["users"]
+sensors_reads = dashboard_db["sensors"]
+sensor_data_reads = dashboard_db["sensor_data"]
+projects_reads = dashboard_db["projects"]
+assets_reads = dashboard_db["assets"]
+notification_reads = dashboard_db["notifications"]
+notification_counters_reads = dashboard_db["notification_counters"]
+asset_health_reads = dashboard_db["asset_health"]
+sensor_sketches_reads = dashboard_db["sensor_sketches"]
\ No newline at end of file
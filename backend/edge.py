@@ -0,0 +1,138 @@
+# Ingest gateway for single-box edge sites, runs without MongoDB.
+#   EDGE_DB=/var/lib/setu/edge.db EDGE_UPSTREAM_URL=https://setu.example.com \
+#   EDGE_SYNC_TOKEN=... uvicorn edge:app --host 0.0.0.0 --port 8000
+# Devices post to the same /api/receive-sensor-data and
+# /api/receive-sensor-data/binary endpoints as the API. Readings are stored
+# in a SQLite file (SqliteReadingStore in services/readings_store.py) and
+# classified against the sensor's recent readings there, the alerts come
+# back in the response like the API's. Per-minute aggregates are pushed to
+# the API's /api/edge/sync (services/edge_sync.py); without
+# EDGE_UPSTREAM_URL the gateway only keeps EDGE_RETENTION_HOURS of readings.
+#
+# The gateway has no users: the read endpoints and /api/edge/status ask for
+# the X-Edge-Token header when EDGE_SYNC_TOKEN is set. Which sensors it
+# stores is bounded instead: only those listed in EDGE_SENSORS when set, and
+# at most EDGE_MAX_SENSORS different ones; readings of other sensors are
+# refused like the API refuses unregistered sensors.
+import asyncio
+import hmac
+import os
+import struct
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set
+
+from fastapi import FastAPI, HTTPException, Depends, Request, Header, Query
+from fastapi.responses import ORJSONResponse
+
+from services.sensor_service import decode_sensor_payload, classify_alert, MissingSensorId
+from services.binary_protocol import decode_binary_payload
+from services.readings_store import SqliteReadingStore
+from services import edge_sync
+
+try:
+    import resource
+except ImportError:  # Windows dev machines, no RSS in the status
+    resource = None
+
+EDGE_DB = os.getenv("EDGE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "edge.db"))
+EDGE_CACHE_MB = int(os.getenv("EDGE_CACHE_MB", "8"))
+EDGE_SENSORS = {sensor_id.strip() for sensor_id in os.getenv("EDGE_SENSORS", "").split(",") if sensor_id.strip()}
+EDGE_MAX_SENSORS = int(os.getenv("EDGE_MAX_SENSORS", "1000"))
+HISTORY_SIZE = 10
+
+store: Optional[SqliteReadingStore] = None
+# Sensors with readings stored here
+known_sensors: Set[str] = set()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global store
+    store = SqliteReadingStore(EDGE_DB, EDGE_CACHE_MB)
+    known_sensors.update(store.sensor_ids())
+    syncer = edge_sync.Syncer(store)
+    syncer.start()
+    yield
+    await asyncio.to_thread(syncer.stop)
+    store.close()
+
+app = FastAPI(lifespan=lifespan)
+
+def require_token(x_edge_token: Optional[str] = Header(None)):
+    if edge_sync.SYNC_TOKEN and not hmac.compare_digest(x_edge_token or "", edge_sync.SYNC_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid edge token")
+
+def allowed(sensor_id: str) -> bool:
+    if EDGE_SENSORS:
+        return sensor_id in EDGE_SENSORS
+    return sensor_id in known_sensors or len(known_sensors) < EDGE_MAX_SENSORS
+
+def ingest(readings: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    """Classify a batch against each sensor's recent readings and store it in
+    one transaction. None for readings of sensors this gateway doesn't take."""
+    histories: Dict[str, List[Dict[str, Any]]] = {}
+    alerts: List[Optional[Dict[str, Any]]] = []
+    stored = []
+    for reading in readings:
+        if not allowed(reading["sensor_id"]):
+            alerts.append(None)
+            continue
+        known_sensors.add(reading["sensor_id"])
+        stored.append(reading)
+        history = histories.get(reading["sensor_id"])
+        if history is None:
+            history = histories[reading["sensor_id"]] = store.recent(reading["sensor_id"], HISTORY_SIZE)
+        alerts.append(classify_alert(reading, history))
+        history.insert(0, reading)
+        del history[HISTORY_SIZE:]
+    store.insert_many(stored)
+    return alerts
+
+@app.post("/api/receive-sensor-data")
+async def receive_sensor_data(request: Request):
+    try:
+        reading = decode_sensor_payload(await request.body())
+    except MissingSensorId:
+        raise HTTPException(status_code=404, detail="Sensor not accepted by this gateway")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    alerts = await asyncio.to_thread(ingest, [reading])
+    if alerts[0] is None:
+        raise HTTPException(status_code=404, detail="Sensor not accepted by this gateway")
+    return {"message": "Data received successfully", "alerts": alerts[0]}
+
+@app.post("/api/receive-sensor-data/binary")
+async def receive_binary_sensor_data(request: Request):
+    try:
+        readings = decode_binary_payload(request.headers.get("content-type"), await request.body())
+    except LookupError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except (ValueError, struct.error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    alerts = await asyncio.to_thread(ingest, readings)
+    accepted = sum(1 for result in alerts if result is not None)
+    return {"message": "Data received successfully", "accepted": accepted, "rejected": len(readings) - accepted, "alerts": alerts}
+
+@app.get("/api/sensor-data/{sensor_id}", dependencies=[Depends(require_token)])
+async def get_sensor_data(sensor_id: str, limit: int = 100):
+    return ORJSONResponse(await asyncio.to_thread(store.recent, sensor_id, limit))
+
+@app.get("/api/sensor-data", dependencies=[Depends(require_token)])
+async def get_sensors_data(
+    sensor_id: List[str] = Query([]),
+    limit: int = 100,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    if not sensor_id:
+        raise HTTPException(status_code=400, detail="Give sensor_id")
+    return ORJSONResponse(await asyncio.to_thread(store.latest_many, sensor_id, limit, start, end))
+
+## Stored and synced readings, push counters and the process's peak RSS
+@app.get("/api/edge/status", dependencies=[Depends(require_token)])
+async def edge_status():
+    return ORJSONResponse({
+        **edge_sync.snapshot(store),
+        # ru_maxrss is in KB on Linux
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None,
+    })
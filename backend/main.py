@@ -1,4 +1,6 @@
 # main.py
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
@@ -6,8 +8,57 @@ from routes.auth_routes import router as auth_routes
 from routes.user_routes import router as user_routes
 from routes.sensor_routes import router as sensor_routes
 from routes.project_routes import router as project_routes
+from routes.profiling_routes import router as profiling_routes
+from routes.analysis_routes import router as analysis_routes
+from routes.edge_routes import router as edge_routes
+from services import line_listener, write_behind, cascade_service, notification_service, rate_limiter, alert_shards, ingest_service, admission, baseline_service, delivery_service, profiling, analysis_service
+import database
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Importing database doesn't touch MongoDB, collections and indexes are created here
+    database.setup_mongodb()
+    # classify_alert on ALERT_SHARDS worker processes, see services/alert_shards.py
+    if alert_shards.enabled():
+        alert_shards.start(ingest_service.HISTORY_SIZE)
+    # Replay anything a previous run left in the write-behind log before taking traffic
+    if write_behind.enabled():
+        write_behind.get_log()
+    # Finish cascade deletes a previous run was in the middle of
+    cascade_service.resume_jobs()
+    # Spreadsheet analyses that were queued or running, see services/analysis_service.py
+    analysis_service.resume_jobs()
+    reconcile = asyncio.create_task(notification_service.reconcile_periodically()) if notification_service.RECONCILE_MINUTES else None
+    # Stores readings coalesced by the ingest rate limits
+    release = asyncio.create_task(rate_limiter.release_periodically())
+    # Per-sensor baselines for classify_alert, recomputed every night
+    calibrate = asyncio.create_task(baseline_service.calibrate_nightly()) if baseline_service.HOUR >= 0 else None
+    # Webhook and email alerts, see services/delivery_service.py
+    delivery_service.start()
+    digests = asyncio.create_task(delivery_service.send_digests_periodically())
+    # Optional raw TCP/UDP ingest, see services/line_listener.py
+    listener = await line_listener.LineListener().start() if line_listener.enabled() else None
+    yield
+    if listener:
+        await listener.stop()
+    if reconcile:
+        reconcile.cancel()
+    release.cancel()
+    if calibrate:
+        calibrate.cancel()
+    digests.cancel()
+    delivery_service.stop()
+    write_behind.close_log()
+    alert_shards.stop()
+    analysis_service.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Dashboard reads share the adaptive concurrency limit with ingest. Added
+# before CORS so shed responses still carry the CORS headers
+app.middleware("http")(admission.dashboard_reads)
+# X-Profile: <PROFILING_TOKEN> on PROFILING_ROUTES, see services/profiling.py
+app.middleware("http")(profiling.profile_requests)
 
 # Configure CORS
 app.add_middleware(
@@ -23,3 +74,6 @@ app.include_router(auth_routes)
 app.include_router(user_routes)
 app.include_router(sensor_routes)
 app.include_router(project_routes)
+app.include_router(profiling_routes)
+app.include_router(analysis_routes)
+app.include_router(edge_routes)
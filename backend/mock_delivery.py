@@ -0,0 +1,120 @@
+# Local stand-ins for alert delivery: a webhook receiver and an SMTP sink.
+#   python mock_delivery.py --http-port 9000 --smtp-port 1025 --fail-rate 0.3
+# then run the API with SMTP_HOST=localhost SMTP_PORT=1025 SMTP_SECURITY=none
+# and set the user's webhook_url to http://localhost:9000/alerts.
+# Both print every request and message along with how many connections they
+# saw, so connection reuse is visible: many alerts over few connections.
+# --fail-rate answers that share of webhooks with 503 and of emails with a
+# 451 to exercise the retry queue.
+import argparse
+import random
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+counts = {"http_connections": 0, "webhooks": 0, "smtp_connections": 0, "emails": 0, "failed": 0}
+lock = threading.Lock()
+fail_rate = 0.0
+
+def count(key):
+    with lock:
+        counts[key] += 1
+
+def failing():
+    if random.random() < fail_rate:
+        count("failed")
+        return True
+    return False
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the API's pooled connections stay open
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        count("http_connections")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status = 503 if failing() else 200
+        if status == 200:
+            count("webhooks")
+        print(f"webhook {status} {len(body)} bytes {self.headers.get('X-Setu-Signature', '')} {counts}")
+        self.send_response(status)
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: EHLO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        count("smtp_connections")
+        self.reply("220 localhost mock SMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "AUTH":
+                self.reply("235 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                message = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b".\r\n":
+                        break
+                    message.append(data)
+                subject = next((data.decode(errors="replace").strip() for data in message if data.startswith(b"Subject:")), "")
+                if failing():
+                    self.reply("451 Try again later")
+                else:
+                    count("emails")
+                    self.reply("250 OK")
+                print(f"email {subject} {counts}")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def main():
+    global fail_rate
+    parser = argparse.ArgumentParser(description="Local webhook and SMTP stand-ins for alert delivery")
+    parser.add_argument("--http-port", type=int, default=9000)
+    parser.add_argument("--smtp-port", type=int, default=1025)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fail_rate = args.fail_rate
+
+    http = ThreadingHTTPServer(("localhost", args.http_port), WebhookHandler)
+    smtp = SmtpServer(("localhost", args.smtp_port), SmtpHandler)
+    threading.Thread(target=smtp.serve_forever, daemon=True).start()
+    print(f"webhooks on http://localhost:{args.http_port}/, SMTP on localhost:{args.smtp_port}")
+    try:
+        http.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Dict, List
+
+# Aggregates an edge gateway syncs upstream, see services/edge_sync.py
+class EdgeFieldStats(BaseModel):
+    count: int
+    sum: float
+    min: float
+    max: float
+
+class EdgeBucket(BaseModel):
+    sensor_id: str
+    start: datetime
+    seconds: int
+    count: int
+    # "temperature", "accelerometer.x", ...
+    fields: Dict[str, EdgeFieldStats] = {}
+
+class EdgeSync(BaseModel):
+    gateway: str
+    buckets: List[EdgeBucket]
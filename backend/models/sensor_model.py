@@ -25,4 +25,5 @@ class SensorDefinition(BaseModel):
     project_ids: str
     asset_ids: str
     alerts: Optional[dict] = None
+    rate_limit: Optional[dict] = None  # {"rate", "burst", "policy"}, see services/rate_limiter.py
 
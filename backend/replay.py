@@ -0,0 +1,65 @@
+import argparse
+import sys
+
+from services.sensor_service import parse_timestamp
+from services.replay_service import WORKERS, NOTIFICATION_MODES, replay_sensors, replay_files
+from database import sensors_collection
+
+# Re-runs the alert classification over stored readings, or loads CSV/XLSX
+# files in the algorithm.py format as readings of a sensor. Run from the
+# backend folder:
+# e.g python replay.py history <sensor_id> <sensor_id> --start 2025-01-01
+#     python replay.py history --all --notifications regenerate
+#     python replay.py files data.xlsx=<sensor_id> other.csv=<sensor_id>
+
+def print_result(result):
+    if "error" in result:
+        print(f"{result['sensor_id']}: {result['error']}")
+        return
+    counts = ", ".join(f"{key} {value}" for key, value in result.items() if isinstance(value, int))
+    print(f"{result.get('file') or result['sensor_id']}: {counts}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay readings through the alert classification.")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="processes to spread the sensors over (default: %(default)s)")
+    parser.add_argument("--notifications", choices=NOTIFICATION_MODES, default="suppress",
+                        help="leave notifications alone, or replace the replayed range's with new ones (default: %(default)s)")
+    parser.add_argument("--speed", type=float, default=0, help="play back at this many times real time, 0 for as fast as possible (default)")
+    parser.add_argument("--dry-run", action="store_true", help="classify and count, write nothing")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    history = commands.add_parser("history", help="re-classify stored readings")
+    history.add_argument("sensor_ids", nargs="*")
+    history.add_argument("--all", action="store_true", help="every registered sensor")
+    history.add_argument("--owner", help="every sensor of this user")
+    history.add_argument("--start", type=parse_timestamp, help="ISO time of the first reading to replay")
+    history.add_argument("--end", type=parse_timestamp, help="ISO time of the last reading to replay")
+
+    files = commands.add_parser("files", help="load CSV/XLSX files as readings")
+    files.add_argument("files", nargs="+", metavar="PATH=SENSOR_ID")
+
+    args = parser.parse_args(argv)
+    options = {"notifications": args.notifications, "speed": args.speed, "dry_run": args.dry_run}
+
+    if args.command == "history":
+        sensor_ids = list(args.sensor_ids)
+        if args.all or args.owner:
+            query = {"owner_id": args.owner} if args.owner else {}
+            sensor_ids += [sensor["sensor_id"] for sensor in sensors_collection.find(query, {"sensor_id": 1})]
+        if not sensor_ids:
+            parser.error("give sensor ids, --owner or --all")
+        results = replay_sensors(sensor_ids, args.workers, print_result, start=args.start, end=args.end, **options)
+    else:
+        pairs = {}
+        for item in args.files:
+            path, separator, sensor_id = item.rpartition("=")
+            if not separator or not path or not sensor_id:
+                parser.error(f"expected PATH=SENSOR_ID, got {item}")
+            pairs[path] = sensor_id
+        results = replay_files(pairs, args.workers, print_result, **options)
+
+    if any("error" in result for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
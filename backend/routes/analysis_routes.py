@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi.responses import ORJSONResponse
+from services import analysis_service
+from services.auth_service import get_current_user
+import asyncio
+
+router = APIRouter()
+
+## Upload a .csv or .xlsx file in the algorithm.py format and queue its analysis
+@router.post("/api/analysis/jobs")
+async def upload_for_analysis(
+    file: UploadFile = File(...),
+    current_user: str = Depends(get_current_user)
+):
+    try:
+        upload = await asyncio.to_thread(analysis_service.save_upload, file.file, file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
+    job = analysis_service.create_job(current_user, file.filename, upload)
+    return {"message": "Analysis queued", "job_id": job["job_id"]}
+
+## The user's analysis jobs, newest first, without results
+@router.get("/api/analysis/jobs")
+async def list_analysis_jobs(limit: int = 50, current_user: str = Depends(get_current_user)):
+    return ORJSONResponse(analysis_service.list_jobs(current_user, limit))
+
+## Status, progress and per-column results of one job
+@router.get("/api/analysis/jobs/{job_id}")
+async def get_analysis_job(job_id: str, current_user: str = Depends(get_current_user)):
+    job = analysis_service.get_job(job_id)
+    if not job or job["owner_id"] != current_user:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ORJSONResponse(job)
+
+@router.delete("/api/analysis/jobs/{job_id}")
+async def delete_analysis_job(job_id: str, current_user: str = Depends(get_current_user)):
+    job = analysis_service.get_job(job_id, results=False)
+    if not job or job["owner_id"] != current_user:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("queued", "running"):
+        raise HTTPException(status_code=409, detail="The job is still running")
+    analysis_service.delete_job(job_id)
+    return {"message": "Analysis job deleted"}
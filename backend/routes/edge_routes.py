@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException, Header
+from typing import Optional
+from models.edge_model import EdgeSync
+from services import edge_sync
+import asyncio
+import hmac
+
+router = APIRouter()
+
+## Per-minute aggregates pushed by edge gateways (edge.py), authenticated with EDGE_SYNC_TOKEN
+@router.post("/api/edge/sync")
+async def receive_edge_aggregates(sync: EdgeSync, x_edge_token: Optional[str] = Header(None)):
+    if not edge_sync.SYNC_TOKEN:
+        raise HTTPException(status_code=404, detail="Edge sync is disabled, set EDGE_SYNC_TOKEN")
+    if not hmac.compare_digest(x_edge_token or "", edge_sync.SYNC_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid edge token")
+    result = await asyncio.to_thread(edge_sync.store_aggregates, sync)
+    return {"message": "Aggregates stored", **result}
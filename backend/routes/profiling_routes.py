@@ -0,0 +1,95 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
+from services import profiling
+from services.auth_service import get_admin_user
+import asyncio
+
+router = APIRouter()
+
+def require_enabled():
+    if not profiling.ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled, set PROFILING_ENABLED=1")
+
+## Sample every thread of the worker that answers for `seconds`, as collapsed stacks
+@router.post("/api/admin/profiling/sample", dependencies=[Depends(require_enabled)])
+async def sample_worker(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    current_user: str = Depends(get_admin_user)
+):
+    if not 0 < seconds <= profiling.MAX_SECONDS or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail=f"seconds must be up to {profiling.MAX_SECONDS} and interval_ms between 1 and 1000")
+    try:
+        result = await asyncio.to_thread(profiling.sample, seconds, interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        profiling.collapsed(result["stacks"]),
+        headers={"X-Profile-Pid": str(result["pid"]), "X-Profile-Samples": str(result["samples"])}
+    )
+
+## Requests profiled with the X-Profile header, newest first
+@router.get("/api/admin/profiling/requests", dependencies=[Depends(require_enabled)])
+async def list_request_profiles(current_user: str = Depends(get_admin_user)):
+    return ORJSONResponse(profiling.list_profiles())
+
+## One request's profile: format=text (pstats report), pstats (binary stats file) or collapsed
+@router.get("/api/admin/profiling/requests/{profile_id}", dependencies=[Depends(require_enabled)])
+async def get_request_profile(
+    profile_id: str,
+    format: str = "text",
+    sort: str = "cumulative",
+    limit: int = 50,
+    current_user: str = Depends(get_admin_user)
+):
+    if not 1 <= limit <= profiling.MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {profiling.MAX_LIMIT}")
+    profile = profiling.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found in this worker")
+    stats = profiling.profile_stats(profile)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="The request did no profiled work")
+
+    if format == "pstats":
+        return Response(
+            profiling.pstats_bytes(stats),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.pstats"'}
+        )
+    if format == "collapsed":
+        return PlainTextResponse(profiling.collapsed(profiling.stats_collapsed(stats)))
+    if format == "text":
+        try:
+            return PlainTextResponse(f"{profile['path']} {profile['wall_ms']} ms wall\n" + profiling.pstats_text(stats, sort, limit))
+        except KeyError:
+            raise HTTPException(status_code=400, detail=f"Unknown sort key {sort}")
+    raise HTTPException(status_code=400, detail="format must be text, pstats or collapsed")
+
+@router.post("/api/admin/profiling/tracemalloc/start", dependencies=[Depends(require_enabled)])
+async def start_tracemalloc(frames: int = 25, current_user: str = Depends(get_admin_user)):
+    if not 1 <= frames <= profiling.MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"frames must be between 1 and {profiling.MAX_FRAMES}")
+    return profiling.tracemalloc_start(frames)
+
+@router.post("/api/admin/profiling/tracemalloc/stop", dependencies=[Depends(require_enabled)])
+async def stop_tracemalloc(current_user: str = Depends(get_admin_user)):
+    return profiling.tracemalloc_stop()
+
+## Top allocation sites, compare=true gives the growth since the previous snapshot
+@router.get("/api/admin/profiling/tracemalloc", dependencies=[Depends(require_enabled)])
+async def tracemalloc_snapshot(
+    group_by: str = "lineno",
+    limit: int = 30,
+    compare: bool = False,
+    current_user: str = Depends(get_admin_user)
+):
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    if not 1 <= limit <= profiling.MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {profiling.MAX_LIMIT}")
+    try:
+        snapshot = await asyncio.to_thread(profiling.tracemalloc_snapshot, group_by, limit, compare)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return ORJSONResponse(snapshot)
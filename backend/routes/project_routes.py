@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Body
+from pydantic import TypeAdapter
+from fastapi.responses import ORJSONResponse
 from services.sensor_service import process_sensor_data
 from models.sensor_model import BaseSensorData, SensorDefinition
 from models.project_model import ProjectInDB
 from models.assets_model import BaseAssetData, AssetDefinition
 from database import sensor_data_collection, sensors_collection, users_collection, projects_collection, assets_collection
+from database import projects_reads, assets_reads, DASHBOARD_MAX_AGE
 from datetime import datetime
 import uuid
 from datetime import datetime
@@ -12,11 +15,19 @@ from services.auth_service import (
     verify_password,
     create_access_token,
     get_current_user,
+    get_admin_user,
 )
+from services.cascade_service import queue_project_delete, queue_asset_delete, queue_orphan_sweep, get_job, retry_job
+from services.response_cache import cached_json, bump
+from services import asset_health, acl
 from typing import Dict, Any, List
 
 router = APIRouter()
 
+# Built once, used to shape cached list responses like response_model would
+project_list_adapter = TypeAdapter(List[ProjectInDB])
+asset_list_adapter = TypeAdapter(List[AssetDefinition])
+
 @router.post("/api/add-projects", response_model=ProjectInDB)
 async def register_project(
     project: Dict[str, Any], 
@@ -49,56 +60,66 @@ async def register_project(
         {"email": current_user},
         {"$push": {"projects": project_uuid}}
     )
+    bump(f"projects:{current_user}")
+    acl.grant(current_user, "project", project_uuid)
 
     return ProjectInDB(**created_project)
 
-@router.get("/api/projects", response_model=List[ProjectInDB])
-async def list_projects(current_user: str = Depends(get_current_user)):
-    projects = list(projects_collection.find({"owner_id": current_user}))
+@router.get("/api/projects", response_class=ORJSONResponse)
+async def list_projects(request: Request, current_user: str = Depends(get_current_user)):
+    def build():
+        projects = list(projects_reads.find({"owner_id": current_user}))
+
+        for project in projects:
+            if project["_id"] is not None:
+                project["_id"] = str(project["_id"])
+            else:
+                project["_id"] = None
 
-    for project in projects:
-        if project["_id"] is not None:
-            project["_id"] = str(project["_id"])
-        else:
-            project["_id"] = None
+        return project_list_adapter.dump_python(project_list_adapter.validate_python(projects), mode="json"), [f"projects:{current_user}"]
 
-    return projects
+    return cached_json(request, ("list_projects", current_user), build, DASHBOARD_MAX_AGE)
 
 @router.get("/api/projects/{project_id}")
 async def get_project_by_id(
+    request: Request,
     project_id: str,
     current_user: str = Depends(get_current_user)
 ):
-    project = projects_collection.find_one({"project_id": project_id, "owner_id": current_user})
-    
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found or access denied")
+    def build():
+        project = projects_reads.find_one({"project_id": project_id, "owner_id": current_user})
+        
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    project["_id"] = str(project["_id"])
-    return project
+        project["_id"] = str(project["_id"])
+        return project, [f"project:{project_id}"]
+
+    return cached_json(request, ("get_project_by_id", current_user, project_id), build, DASHBOARD_MAX_AGE)
 
-@router.get("/api/projects/{project_id}/assets", response_model=List[AssetDefinition])
+@router.get("/api/projects/{project_id}/assets", response_class=ORJSONResponse)
 async def list_project_assets(
+    request: Request,
     project_id: str,
     limit: int = 100,
     current_user: str = Depends(get_current_user)
 ):
-    # Find the project to verify access
-    project = projects_collection.find_one({"project_id": project_id, "owner_id": current_user})
-    
-    if not project:
+    if not acl.owns(current_user, "project", project_id):
         raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-    # Query assets that belong to this project
-    query = {"project_id": project_id}
-    assets = list(assets_collection.find(query).sort("timestamp").limit(limit))
+    def build():
+        # Query assets that belong to this project
+        query = {"project_id": project_id}
+        assets = list(assets_reads.find(query).sort("timestamp").limit(limit))
 
-    # Convert MongoDB ObjectIds to strings
-    for asset in assets:
-        asset["_id"] = str(asset["_id"])
-    
-    print(assets)
-    return assets
+        # Convert MongoDB ObjectIds to strings
+        for asset in assets:
+            asset["_id"] = str(asset["_id"])
+        
+        content = asset_list_adapter.dump_python(asset_list_adapter.validate_python(assets), mode="json")
+        return content, [f"project:{project_id}"] + [f"asset:{asset['asset_id']}" for asset in assets]
+
+    return cached_json(request, ("list_project_assets", current_user, project_id, limit), build, DASHBOARD_MAX_AGE)
 
 ## Add sensor to project
 @router.post("/api/projects/{project_id}/add-assets", response_model=AssetDefinition)
@@ -115,6 +136,9 @@ async def add_asset_to_project(
 
     if not name:
         raise HTTPException(status_code=400, detail="Asset name is required")
+
+    if not acl.owns(current_user, "project", project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
     
     # Generate a unique asset UUID
     asset_uuid = str(uuid.uuid4())
@@ -141,10 +165,6 @@ async def add_asset_to_project(
     created_asset["_id"] = str(result.inserted_id)
 
     # Add asset to the project's asset_ids
-    project = projects_collection.find_one({"project_id": project_id})
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
     projects_collection.update_one(
         {"project_id": project_id},
         {"$push": {"asset_ids": asset_uuid}}
@@ -155,7 +175,9 @@ async def add_asset_to_project(
         {"email": current_user},
         {"$push": {"assets": asset_uuid}}
     )
-    
+    bump(f"projects:{current_user}", f"project:{project_id}")
+    acl.grant(current_user, "asset", asset_uuid, project_id)
+
     return AssetDefinition(**created_asset)
 
 @router.get("/api/projects/{project_id}", response_model=ProjectInDB)
@@ -197,8 +219,14 @@ async def delete_project(
         {"$pull": {"projects": project_id}}
     )
     
+    bump(f"projects:{current_user}", f"project:{project_id}")
+    acl.forget(current_user)
+    
+    # Assets, sensors, their data and notifications are removed in the background
+    job = queue_project_delete(project)
+    
     # Return success message
-    return {"message": "Project deleted successfully"}
+    return {"message": "Project deleted successfully", "job_id": job["job_id"]}
 
 @router.delete("/api/assets/{asset_id}", response_model=dict)
 async def delete_asset(
@@ -233,5 +261,82 @@ async def delete_asset(
             {"$pull": {"asset_ids": asset_id}}
         )
     
+    bump(f"projects:{current_user}", f"project:{project_id}", f"asset:{asset_id}")
+    asset_health.remove_assets([asset_id])
+    acl.forget(current_user)
+    
+    # Sensors, their data and notifications are removed in the background
+    job = queue_asset_delete(asset)
+    
     # Return success message
-    return {"message": "Asset deleted successfully"}
\ No newline at end of file
+    return {"message": "Asset deleted successfully", "job_id": job["job_id"]}
+
+## Poll a cascade delete or orphan sweep job
+@router.get("/api/delete-jobs/{job_id}")
+async def get_delete_job(
+    job_id: str,
+    current_user: str = Depends(get_current_user)
+):
+    job = get_job(job_id)
+    if not job or job["owner_id"] != current_user:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+## Clean up assets, sensors, data and notifications whose parent no longer exists
+@router.post("/api/admin/orphan-sweep")
+async def start_orphan_sweep(current_user: str = Depends(get_admin_user)):
+    job = queue_orphan_sweep(current_user)
+    return {"message": "Orphan sweep started", "job_id": job["job_id"]}
+
+## Run a delete job again after it used up its automatic retries
+@router.post("/api/admin/delete-jobs/{job_id}/retry")
+async def retry_delete_job(job_id: str, current_user: str = Depends(get_admin_user)):
+    job = retry_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No failed job with this ID")
+    return {"message": "Delete job queued again", "job_id": job_id}
+
+## Composite health of every asset in a project, one read per asset
+@router.get("/api/projects/{project_id}/health")
+async def get_project_health(
+    project_id: str,
+    current_user: str = Depends(get_current_user)
+):
+    if not acl.owns(current_user, "project", project_id):
+        raise HTTPException(status_code=404, detail="Project not found or access denied")
+    return ORJSONResponse(asset_health.get_project_health(project_id))
+
+## Composite health of one asset, with each sensor's severity
+@router.get("/api/assets/{asset_id}/health")
+async def get_asset_health(
+    asset_id: str,
+    current_user: str = Depends(get_current_user)
+):
+    if not acl.owns(current_user, "asset", asset_id):
+        raise HTTPException(status_code=404, detail="Asset not found or access denied")
+    health = asset_health.get_health(asset_id, reads=True)
+    if not health:
+        # No sensors yet
+        health = {"asset_id": asset_id, **asset_health.summarize({}, [])}
+    return ORJSONResponse(health)
+
+## Replace an asset's composite health rules, an empty list uses ASSET_HEALTH_RULES
+@router.put("/api/assets/{asset_id}/health-rules")
+async def update_asset_health_rules(
+    asset_id: str,
+    rules: List[Dict[str, Any]] = Body(...),
+    current_user: str = Depends(get_current_user)
+):
+    if not acl.owns(current_user, "asset", asset_id):
+        raise HTTPException(status_code=404, detail="Asset not found or access denied")
+    asset = {"asset_id": asset_id, "project_id": acl.asset_project(current_user, asset_id), "owner_id": current_user}
+    try:
+        rules = asset_health.validate_rules(rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse(asset_health.set_rules(asset, rules))
+
+## Recompute every asset's health from the sensors' latest alerts
+@router.post("/api/admin/asset-health/rebuild")
+async def rebuild_asset_health(current_user: str = Depends(get_admin_user)):
+    return {"message": "Asset health rebuilt", "assets": asset_health.rebuild_health()}
@@ -1,8 +1,21 @@
-from fastapi import APIRouter, HTTPException, Depends
-from services.sensor_service import process_sensor_data, classify_alert
+from fastapi import APIRouter, HTTPException, Depends, Request, Body, Query
+from fastapi.responses import ORJSONResponse, JSONResponse
+from services.sensor_service import process_sensor_data, classify_alert, decode_sensor_payload, parse_timestamp, MissingSensorId
+from services.ingest_service import ingest_reading, ingest_readings
+from services.binary_protocol import decode_binary_payload
+from services import line_listener, write_behind, alert_shards
+from services.rate_limiter import limiter, validate_rate_limit
+from services.response_cache import cached_json, bump
+from services.notification_service import count_removed, get_summary, rebuild_counters
+from services import replay_service, asset_health, sketch_service, admission, baseline_service, delivery_service, profiling, acl, readings_store
 from models.sensor_model import BaseSensorData, SensorDefinition
 from database import sensor_data_collection, sensors_collection, users_collection, assets_collection, projects_collection, notification_collection
-from datetime import datetime
+from database import sensors_reads, sensor_data_reads, assets_reads, notification_reads, DASHBOARD_MAX_AGE
+from datetime import datetime, timedelta
+import asyncio
+import os
+import struct
+import time
 import uuid
 from models.notification_model import Notification
 from services.auth_service import (
@@ -10,76 +23,147 @@ from services.auth_service import (
     verify_password,
     create_access_token,
     get_current_user,
+    get_admin_user,
 )
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 router = APIRouter()
 
 @router.post("/api/receive-sensor-data")
-async def receive_sensor_data(data: Dict[str, Any]):
+async def receive_sensor_data(request: Request):
     try:
-        sensor = sensors_collection.find_one({"sensor_id": data.get("sensor_id")})
-        if not sensor:
-            raise HTTPException(status_code=404, detail="Sensor not registered")
-        
-        sensor_id = sensor['sensor_id']
-        sensor_data = process_sensor_data(data)
-        sensor_data_dict = sensor_data.model_dump() if hasattr(sensor_data, "model_dump") else sensor_data.dict()
-        history = list(sensor_data_collection.find({"sensor_id": sensor_id}).sort("timestamp", -1).limit(10))
-        alerts = classify_alert(sensor_data_dict, history)
-        sensor_data_dict["alerts"] = alerts
-        
-        # Create notifications for alerts
-        if alerts:
-            for field, status in alerts.items():
-                if isinstance(status, dict):
-                    # Handle nested alerts (e.g., accelerometer with x,y,z)
-                    for sub_field, sub_status in status.items():
-                        if sub_status in ['warning', 'danger']:
-                            notification = Notification(
-                                notification_id=str(uuid.uuid4()),
-                                user_id=sensor['owner_id'],
-                                sensor_id=sensor_id,
-                                message=f"{sub_status.upper()}: Abnormal {field}.{sub_field} reading for sensor {sensor['name']}",
-                                alert_type=sub_status,
-                                data={
-                                    'sensor_data': sensor_data_dict,
-                                    'field': field,
-                                    'sub_field': sub_field
-                                }
-                            )
-                            notification_collection.insert_one(notification.dict())
-                elif status in ['warning', 'danger', 'invalid']:
-                    # Handle simple alerts
-                    notification = Notification(
-                        notification_id=str(uuid.uuid4()),
-                        user_id=sensor['owner_id'],
-                        sensor_id=sensor_id,
-                        message=f"{status.upper()}: Abnormal {field} reading for sensor {sensor['name']}",
-                        alert_type=status,
-                        data={
-                            'sensor_data': sensor_data_dict,
-                            'field': field
-                        }
-                    )
-                    notification_collection.insert_one(notification.dict())
-        
-        # Rest of the existing code...
-        result = sensor_data_collection.insert_one(sensor_data_dict)
-        sensor_result = sensors_collection.update_one(
-            {"sensor_id": sensor_data_dict["sensor_id"]},
-            {"$set": {"alerts": alerts}}
-        )
+        # Decode the raw body once straight into the storage dict
+        sensor_data_dict = decode_sensor_payload(await request.body())
+        # Shed routine readings first when MongoDB is slow, see services/admission.py
+        async with admission.slot(admission.is_priority([sensor_data_dict])):
+            # Off the event loop, the thread waits on MongoDB and the alert shards
+            result = await asyncio.to_thread(profiling.call, ingest_reading, sensor_data_dict)
+        if result.get("rate_limited"):
+            # Over the sensor's limit, kept and stored later as part of a coalesced reading
+            return JSONResponse(status_code=202, content={"message": "Data coalesced, sensor is over its rate limit", "rate_limited": result["rate_limited"]})
 
         return {
             "message": "Data received successfully",
-            "id": str(result.inserted_id),
-            "alerts": alerts
+            "id": result["id"],
+            "alerts": result["alerts"]
         }
 
+    except MissingSensorId:
+        raise HTTPException(status_code=404, detail="Sensor not registered")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+## Compact ingest for constrained devices: MessagePack or the fixed-layout frame
+@router.post("/api/receive-sensor-data/binary")
+async def receive_binary_sensor_data(request: Request):
+    try:
+        readings = decode_binary_payload(request.headers.get("content-type"), await request.body())
+    except LookupError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except (ValueError, struct.error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async with admission.slot(admission.is_priority(readings)):
+        results = await asyncio.to_thread(profiling.call, ingest_readings, readings)
+    accepted = [result for result in results if result is not None and "id" in result]
+    rate_limited = [result for result in results if result is not None and "rate_limited" in result]
+
+    return {
+        "message": "Data received successfully",
+        "accepted": len(accepted),
+        "rate_limited": len(rate_limited),
+        "rejected": len(results) - len(accepted) - len(rate_limited),
+        "results": results
+    }
+
+## Counters for the raw TCP/UDP line protocol listener
+@router.get("/api/admin/ingest/line-protocol")
+async def line_protocol_stats(current_user: str = Depends(get_admin_user)):
+    return {"enabled": line_listener.enabled(), **line_listener.stats}
+
+## Change a sensor's ingest rate limit ({"rate", "burst", "policy"}, null for the defaults)
+@router.put("/api/sensors/{sensor_id}/rate-limit")
+async def update_sensor_rate_limit(
+    sensor_id: str,
+    rate_limit: Optional[Dict[str, Any]] = Body(None),
+    current_user: str = Depends(get_current_user)
+):
+    try:
+        rate_limit = validate_rate_limit(rate_limit)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    result = sensors_collection.update_one(
+        {"sensor_id": sensor_id, "owner_id": current_user},
+        {"$set": {"rate_limit": rate_limit}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Sensor not found or you don't have access")
+    bump(f"sensor:{sensor_id}")
+    return {"message": "Rate limit updated", "rate_limit": rate_limit}
+
+## Recompute a sensor's baseline now instead of waiting for the nightly run
+@router.post("/api/sensors/{sensor_id}/calibrate")
+async def calibrate_sensor(
+    sensor_id: str,
+    days: int = baseline_service.DAYS,
+    current_user: str = Depends(get_current_user)
+):
+    if not acl.owns(current_user, "sensor", sensor_id):
+        raise HTTPException(status_code=404, detail="Sensor not found or you don't have access")
+    if days < 1:
+        raise HTTPException(status_code=400, detail="days must be at least 1")
+
+    await asyncio.to_thread(baseline_service.calibrate, [sensor_id], days)
+    sensor = sensors_collection.find_one({"sensor_id": sensor_id}, {"_id": 0, "baseline": 1})
+    if sensor is None:
+        # Deleted while it was being calibrated
+        raise HTTPException(status_code=404, detail="Sensor not found or you don't have access")
+    if not sensor.get("baseline"):
+        raise HTTPException(status_code=409, detail=f"Not enough readings in the last {days} days to calibrate")
+    return ORJSONResponse(sensor["baseline"])
+
+## Recalibrate every sensor's baseline in the background
+@router.post("/api/admin/baselines/calibrate")
+async def calibrate_all_sensors(current_user: str = Depends(get_admin_user)):
+    baseline_service.start_calibration()
+    return {"message": "Calibration started"}
+
+## Dropped and coalesced reading counters for the ingest rate limits
+@router.get("/api/admin/ingest/rate-limits")
+async def rate_limit_stats(current_user: str = Depends(get_admin_user)):
+    return limiter.snapshot()
+
+## Durability mode and counters for the write-behind ingest log
+@router.get("/api/admin/ingest/write-behind")
+async def write_behind_stats(current_user: str = Depends(get_admin_user)):
+    if not write_behind.enabled():
+        return {"durability": write_behind.DURABILITY}
+    return {"durability": write_behind.DURABILITY, **write_behind.get_log().stats}
+
+## Per-shard sensor counts and fallbacks for the alert evaluation processes
+@router.get("/api/admin/ingest/alert-shards")
+async def alert_shard_stats(current_user: str = Depends(get_admin_user)):
+    pool = alert_shards.get_pool()
+    if pool is None:
+        return {"shards": 0}
+    return pool.snapshot()
+
+## Current ingest concurrency limit, latencies and shed requests
+@router.get("/api/admin/ingest/admission")
+async def admission_stats(current_user: str = Depends(get_admin_user)):
+    return admission.limiter.snapshot()
+
+## Webhook/email delivery queue by channel and status, SMTP pool counters
+@router.get("/api/admin/delivery")
+async def delivery_stats(current_user: str = Depends(get_admin_user)):
+    return ORJSONResponse(delivery_service.snapshot())
+
+## Queue every failed delivery again
+@router.post("/api/admin/delivery/retry-failed")
+async def retry_failed_deliveries(current_user: str = Depends(get_admin_user)):
+    return {"message": "Failed deliveries queued", "deliveries": delivery_service.retry_failed()}
+
 # Add these new endpoints for notification handling
 @router.get("/api/notifications")
 async def get_notifications(
@@ -91,7 +175,7 @@ async def get_notifications(
     if unread_only:
         query["read"] = False
     
-    notifications = list(notification_collection.find(
+    notifications = list(notification_reads.find(
         query,
         sort=[("timestamp", -1)],
         limit=limit
@@ -101,25 +185,67 @@ async def get_notifications(
     for notification in notifications:
         notification["_id"] = str(notification["_id"])
     
-    return notifications
+    return ORJSONResponse(notifications)
 
 @router.put("/api/notifications/{notification_id}/read")
 async def mark_notification_read(
     notification_id: str,
     current_user: str = Depends(get_current_user)
 ):
-    result = notification_collection.delete_one(
+    notification = notification_collection.find_one_and_delete(
         {
             "notification_id": notification_id,
             "user_id": current_user
-        }
+        },
+        projection={"user_id": 1, "sensor_id": 1, "alert_type": 1, "read": 1}
     )
     
-    if result.deleted_count == 0:
+    if not notification:
         raise HTTPException(status_code=404, detail="Notification not found")
     
+    count_removed(notification)
     return {"message": "Notification deleted"}
 
+## Unread counts for the notification badge, no scan of the notifications
+@router.get("/api/notifications/summary")
+async def get_notification_summary(current_user: str = Depends(get_current_user)):
+    return get_summary(current_user)
+
+## Rebuild every user's unread counters from the notifications collection
+@router.post("/api/admin/notifications/reconcile")
+async def reconcile_notification_counters(current_user: str = Depends(get_admin_user)):
+    return {"message": "Notification counters rebuilt", "users": rebuild_counters()}
+
+## Re-classify stored readings after the alert thresholds changed, see services/replay_service.py
+## Body: {"sensor_ids": [...] or "all": true, "start", "end", "notifications": "suppress" | "regenerate", "workers"}
+@router.post("/api/admin/replay")
+async def start_replay(options: Dict[str, Any] = Body(...), current_user: str = Depends(get_admin_user)):
+    sensor_ids = options.get("sensor_ids") or []
+    if options.get("all"):
+        sensor_ids = [sensor["sensor_id"] for sensor in sensors_collection.find({}, {"sensor_id": 1})]
+    if not sensor_ids:
+        raise HTTPException(status_code=400, detail="Give sensor_ids or all")
+
+    try:
+        job = replay_service.start_job(
+            sensor_ids,
+            current_user,
+            workers=int(options.get("workers", replay_service.WORKERS)),
+            start=parse_timestamp(options["start"]) if options.get("start") else None,
+            end=parse_timestamp(options["end"]) if options.get("end") else None,
+            notifications=options.get("notifications", "suppress"),
+        )
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Replay started", "job_id": job["job_id"]}
+
+@router.get("/api/admin/replay/{job_id}")
+async def get_replay(job_id: str, current_user: str = Depends(get_admin_user)):
+    job = replay_service.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 
 ## Registers sensors Change this to also add sensorID to user
 @router.post("/api/add-sensors", response_model=SensorDefinition)
@@ -133,6 +259,11 @@ async def register_sensor(
     if not name:
         raise HTTPException(status_code=400, detail="Sensor name is required")
     
+    try:
+        rate_limit = validate_rate_limit(sensor.get("rateLimit"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     sensor_uuid = str(uuid.uuid4())
     
     sensor_definition = SensorDefinition(
@@ -140,7 +271,8 @@ async def register_sensor(
         name=name,
         owner_id=current_user,
         asset_ids=asset_id,
-        project_ids=project_id
+        project_ids=project_id,
+        rate_limit=rate_limit
     )
     
     document_dict = sensor_definition.dict(by_alias=True, exclude_none=True)
@@ -165,72 +297,215 @@ async def register_sensor(
         {"asset_id": asset_id},
         {"$push": {"sensors": sensor_uuid}}
     )
-    
+    bump(f"projects:{current_user}", f"project:{project_id}", f"asset:{asset_id}")
+    # Counted in its asset's health straight away, as good until it reports
+    asset_health.set_sensor(document_dict, "good")
+    acl.grant(current_user, "sensor", sensor_uuid)
+
+
     return SensorDefinition(**created_sensor)
 
+MAX_BATCH_SENSORS = 500
+# Without start only this much history is searched, the newest `limit` of
+# every reading of 500 sensors would otherwise be grouped in one pass
+BATCH_WINDOW_HOURS = float(os.getenv("SENSOR_DATA_WINDOW_HOURS", "24"))
+
+## Latest readings of many sensors at once: sensor_id (repeatable), or every sensor
+## of an asset or project, limit readings per sensor between start and end
+@router.get("/api/sensor-data")
+async def get_sensors_data(
+    request: Request,
+    sensor_id: List[str] = Query([]),
+    asset_id: Optional[str] = None,
+    project_id: Optional[str] = None,
+    limit: int = 100,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: str = Depends(get_current_user)
+):
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+
+    # Ownership of every sensor in one $in query
+    query = {"owner_id": current_user}
+    if asset_id:
+        query["asset_ids"] = asset_id
+        scopes = [f"asset:{asset_id}"]
+    elif project_id:
+        if not acl.owns(current_user, "project", project_id):
+            raise HTTPException(status_code=404, detail="Project not found or you don't have access")
+        asset_ids = assets_reads.distinct("asset_id", {"project_id": project_id, "owner_id": current_user})
+        query["asset_ids"] = {"$in": asset_ids}
+        scopes = [f"project:{project_id}"] + [f"asset:{asset}" for asset in asset_ids]
+    elif sensor_id:
+        if len(sensor_id) > MAX_BATCH_SENSORS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SENSORS} sensors per request")
+        query["sensor_id"] = {"$in": sensor_id}
+        scopes = []
+    else:
+        raise HTTPException(status_code=400, detail="Give sensor_id, asset_id or project_id")
+    # One past the maximum is enough to refuse the request
+    sensor_ids = [sensor["sensor_id"] for sensor in sensors_reads.find(query, {"sensor_id": 1}).limit(MAX_BATCH_SENSORS + 1)]
+    if sensor_id and not (asset_id or project_id) and len(sensor_ids) != len(set(sensor_id)):
+        raise HTTPException(status_code=404, detail="Sensor not found or you don't have access")
+    if len(sensor_ids) > MAX_BATCH_SENSORS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SENSORS} sensors per request")
+    sensor_ids.sort()
+
+    def build():
+        # Worked out per build, so the cache key stays the same while the window moves
+        since = start or (end or datetime.now()) - timedelta(hours=BATCH_WINDOW_HOURS)
+        readings = readings_store.get_store(reads=True).latest_many(sensor_ids, limit, since, end)
+        return readings, scopes + [f"sensor:{sensor}" for sensor in sensor_ids]
+
+    key = ("get_sensors_data", current_user, tuple(sensor_ids), limit, start, end)
+    return cached_json(request, key, build, DASHBOARD_MAX_AGE)
+
 ## Get sensors to display
 @router.get("/api/sensor-data/{sensor_id}")
 async def get_sensor_data(
+    request: Request,
     sensor_id: str,
     limit: int = 100,
     current_user: str = Depends(get_current_user)
 ):
-    print(sensor_id)
-    sensor = sensors_collection.find_one({
-        "sensor_id": sensor_id,
-        "owner_id": current_user
-    })
-    print(f"Sensor found: {sensor}")
-    if not sensor:
+    if not acl.owns(current_user, "sensor", sensor_id):
         raise HTTPException(status_code=404, detail="Sensor not found or you don't have access")
-    
-    query = {"sensor_id": sensor_id}
-    
-    results = list(sensor_data_collection.find(
-        query, 
-        sort=[("timestamp", -1)],
-        limit=limit
-    ))
-    
-    # Format results
-    formatted_results = []
-    for result in results:
-        result["_id"] = str(result["_id"])
-        formatted_results.append(result)
-    print(formatted_results)
-    return formatted_results
+
+    def build():
+        return readings_store.get_store(reads=True).recent(sensor_id, limit), [f"sensor:{sensor_id}"]
+
+    return cached_json(request, ("get_sensor_data", current_user, sensor_id, limit), build, DASHBOARD_MAX_AGE)
 
 @router.get("/api/sensors/{asset_id}")
 async def display_sensors(
+    request: Request,
     asset_id: str,
     limit: int = 100,
     current_user: str = Depends(get_current_user)
 ):
     """Fetch sensors based on asset_id while ensuring user has access."""
 
-    asset = assets_collection.find_one({
-        "asset_id": asset_id,
-        "owner_id": current_user
-    })
-
-    if not asset:
+    if not acl.owns(current_user, "asset", asset_id):
         raise HTTPException(status_code=403, detail="Asset not found or you don't have access")
 
-    project = projects_collection.find_one({
-        "project_id": asset["project_id"],
-        "owner_id": current_user
-    })
-
-    if not project:
+    project_id = acl.asset_project(current_user, asset_id)
+    if not acl.owns(current_user, "project", project_id):
         raise HTTPException(status_code=403, detail="This asset does not belong to a project you own")
 
-    sensors = list(sensors_collection.find({"asset_ids": asset_id}))
+    def build():
+        sensors = list(sensors_reads.find({"asset_ids": asset_id}))
+
+        # Convert MongoDB ObjectIds to strings
+        for sensor in sensors:
+            sensor["_id"] = str(sensor["_id"])
+
+        scopes = [f"asset:{asset_id}", f"project:{project_id}"] + [f"sensor:{sensor['sensor_id']}" for sensor in sensors]
+        return sensors, scopes
 
-    if not sensors:
-        return []  # Fail-safe: Return empty list instead of an error
+    return cached_json(request, ("display_sensors", current_user, asset_id), build, DASHBOARD_MAX_AGE)
 
-    # Convert MongoDB ObjectIds to strings
-    for sensor in sensors:
-        sensor["_id"] = str(sensor["_id"])
+EARTH_RADIUS_M = 6378100
 
-    return sensors
\ No newline at end of file
+## Sensors whose latest position is inside a bounding box or a radius
+@router.get("/api/sensor-locations/within")
+async def sensors_within(
+    min_lon: Optional[float] = None,
+    min_lat: Optional[float] = None,
+    max_lon: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    radius_m: Optional[float] = None,
+    limit: int = 1000,
+    current_user: str = Depends(get_current_user)
+):
+    if None not in (min_lon, min_lat, max_lon, max_lat):
+        geometry = {"$geometry": {"type": "Polygon", "coordinates": [[
+            [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]
+        ]]}}
+    elif None not in (lon, lat, radius_m):
+        geometry = {"$centerSphere": [[lon, lat], radius_m / EARTH_RADIUS_M]}
+    else:
+        raise HTTPException(status_code=400, detail="Give either min_lon, min_lat, max_lon, max_lat or lon, lat, radius_m")
+
+    sensors = list(sensors_reads.find(
+        {"owner_id": current_user, "location": {"$geoWithin": geometry}},
+        {"_id": 0, "sensor_id": 1, "name": 1, "asset_ids": 1, "project_ids": 1, "location": 1, "location_updated_at": 1, "alerts": 1},
+        limit=limit
+    ))
+    return ORJSONResponse(sensors)
+
+## Positions reported by one sensor over a time range, oldest first
+@router.get("/api/sensor-locations/{sensor_id}/track")
+async def sensor_track(
+    sensor_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 5000,
+    current_user: str = Depends(get_current_user)
+):
+    if not acl.owns(current_user, "sensor", sensor_id):
+        raise HTTPException(status_code=404, detail="Sensor not found or you don't have access")
+
+    query = {"sensor_id": sensor_id, "location": {"$type": "object"}}
+    if start or end:
+        query["timestamp"] = {}
+        if start:
+            query["timestamp"]["$gte"] = start
+        if end:
+            query["timestamp"]["$lte"] = end
+
+    # Served by the (sensor_id, timestamp) index
+    points = list(sensor_data_reads.find(
+        query,
+        {"_id": 0, "timestamp": 1, "location.coordinates": 1},
+        sort=[("timestamp", 1)],
+        limit=limit
+    ))
+    return ORJSONResponse([
+        {"timestamp": point["timestamp"], "coordinates": point["location"]["coordinates"]} for point in points
+    ])
+
+## Approximate quantiles and a histogram of one reading field ("temperature", "accelerometer.x")
+## over sensors (sensor_id, repeatable) or every sensor of an asset, from the per-bucket sketches
+@router.get("/api/sensor-stats/quantiles")
+async def sensor_field_quantiles(
+    field: str,
+    sensor_id: List[str] = Query([]),
+    asset_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    q: str = "0.5,0.9,0.95,0.99",
+    bins: int = 20,
+    current_user: str = Depends(get_current_user)
+):
+    started = time.perf_counter()
+    try:
+        qs = [float(value) for value in q.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="q must be comma separated numbers")
+    if any(not 0 <= value <= 1 for value in qs) or not 1 <= bins <= 1000:
+        raise HTTPException(status_code=400, detail="q must be between 0 and 1 and bins between 1 and 1000")
+
+    query = {"owner_id": current_user}
+    if asset_id:
+        query["asset_ids"] = asset_id
+    elif sensor_id:
+        query["sensor_id"] = {"$in": sensor_id}
+    else:
+        raise HTTPException(status_code=400, detail="Give sensor_id or asset_id")
+    sensor_ids = [sensor["sensor_id"] for sensor in sensors_reads.find(query, {"sensor_id": 1})]
+    if not sensor_ids or (sensor_id and not asset_id and len(sensor_ids) != len(set(sensor_id))):
+        raise HTTPException(status_code=404, detail="Sensor not found or you don't have access")
+
+    sketch = sketch_service.merged(sensor_ids, field, start, end)
+    return ORJSONResponse({
+        "field": field,
+        "sensors": len(sensor_ids),
+        **sketch.summary(),
+        "quantiles": sketch.quantiles(qs),
+        "histogram": sketch.histogram(bins),
+        "relative_accuracy": sketch_service.RELATIVE_ACCURACY,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
@@ -1,7 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import ORJSONResponse
 from models.user_model import User
-from database import users_collection
+from database import users_collection, users_reads
+from services.stats_service import get_fleet_stats
+from services import delivery_service, acl
+from typing import Dict, Any
 from bson import ObjectId
+import asyncio
 import random
 import string
 from services.auth_service import *
@@ -28,11 +33,31 @@ async def get_user_name(current_user: str = Depends(get_current_user)):
     print("response", response)
     return response
 
-@router.get("/api/admin/dashboard/users")
+## Where the user's live alerts are sent, see services/delivery_service.py
+@router.get("/api/user/alert-delivery")
+async def get_alert_delivery(current_user: str = Depends(get_current_user)):
+    return delivery_service.get_settings(current_user)
+
+@router.put("/api/user/alert-delivery")
+async def update_alert_delivery(settings: Dict[str, Any], current_user: str = Depends(get_current_user)):
+    try:
+        # Off the event loop, the webhook host is resolved
+        return await asyncio.to_thread(delivery_service.set_settings, current_user, settings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+## Queue a test alert on every configured channel
+@router.post("/api/user/alert-delivery/test")
+async def test_alert_delivery(current_user: str = Depends(get_current_user)):
+    delivery_ids = delivery_service.enqueue_test(current_user)
+    if not delivery_ids:
+        raise HTTPException(status_code=400, detail="No webhook or email configured")
+    return {"message": "Test alert queued", "delivery_ids": delivery_ids}
+
+@router.get("/api/admin/dashboard/users", response_class=ORJSONResponse)
 async def get_all_users(current_user: str = Depends(get_admin_user)):
-    # Get all users from the database
-    print("testest")
-    users_cursor = users_collection.find({})
+    # Get all users from the database, never send the password hashes
+    users_cursor = users_reads.find({}, {"password": 0})
     users = []
     for user in users_cursor:
         # Convert ObjectId to string for JSON serialization
@@ -106,4 +131,14 @@ async def login_as_user(
         }
     )
     
-    return {"token": impersonation_token}
\ No newline at end of file
+    return {"token": impersonation_token}
+
+## Ownership index: cached users, hits and the misses that went to MongoDB
+@router.get("/api/admin/acl")
+async def acl_stats(current_user: str = Depends(get_admin_user)):
+    return acl.snapshot()
+
+## Fleet wide counts for the admin dashboard, cached and refreshed in the background
+@router.get("/api/admin/dashboard/stats", response_class=ORJSONResponse)
+async def get_admin_stats(current_user: str = Depends(get_admin_user)):
+    return get_fleet_stats()
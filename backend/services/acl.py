@@ -0,0 +1,157 @@
+# Per-user ownership index for authorization checks.
+#
+# The first check for a user loads every project, asset (with its project)
+# and sensor the user owns in one aggregation; after that "does this user
+# own X" is a set lookup. Create routes add to the index, delete routes and
+# finished cascade jobs drop the user's entry so it is reloaded.
+#
+# Entries live in this process, like the response cache. An ID that is not
+# in the entry is looked up in MongoDB before access is refused, so objects
+# created through another worker are found and added. Deletes go through
+# forget(), which also bumps the user's stamp in the acl_versions collection;
+# every ACL_CHECK_SECONDS an entry compares its stamp with that one and is
+# reloaded when another worker deleted something meanwhile. Entries are
+# reloaded after ACL_TTL_SECONDS regardless.
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from database import projects_collection, assets_collection, sensors_collection, acl_versions_collection
+
+TTL_SECONDS = float(os.getenv("ACL_TTL_SECONDS", "300"))
+CHECK_SECONDS = float(os.getenv("ACL_CHECK_SECONDS", "2"))
+# Stamp bumped by forget(None), invalidates every user's entry
+EVERYONE = "*"
+MAX_USERS = int(os.getenv("ACL_MAX_USERS", "10000"))
+
+COLLECTIONS = {
+    "project": projects_collection,
+    "asset": assets_collection,
+    "sensor": sensors_collection,
+}
+
+stats = {"hits": 0, "misses": 0, "loads": 0, "denied": 0, "stale": 0}
+
+class _Entry:
+    __slots__ = ("projects", "assets", "sensors", "expires", "version", "checked")
+
+    def __init__(self):
+        self.projects = set()
+        # asset_id -> project_id
+        self.assets: Dict[str, Optional[str]] = {}
+        self.sensors = set()
+        self.expires = time.monotonic() + TTL_SECONDS
+        # Shared stamps the entry was loaded at, see _stamp
+        self.version: Tuple[int, int] = (0, 0)
+        self.checked = time.monotonic()
+
+    def ids(self, kind: str):
+        return self.projects if kind == "project" else self.assets if kind == "asset" else self.sensors
+
+_entries: "OrderedDict[str, _Entry]" = OrderedDict()
+_lock = threading.Lock()
+
+def _load(user: str) -> _Entry:
+    """Everything the user owns, one $unionWith aggregation."""
+    owned = {"$match": {"owner_id": user}}
+    pipeline = [
+        owned,
+        {"$project": {"_id": 0, "kind": {"$literal": "project"}, "id": "$project_id"}},
+        {"$unionWith": {"coll": "assets", "pipeline": [
+            owned,
+            {"$project": {"_id": 0, "kind": {"$literal": "asset"}, "id": "$asset_id", "project_id": 1}},
+        ]}},
+        {"$unionWith": {"coll": "sensors", "pipeline": [
+            owned,
+            {"$project": {"_id": 0, "kind": {"$literal": "sensor"}, "id": "$sensor_id"}},
+        ]}},
+    ]
+    entry = _Entry()
+    for row in projects_collection.aggregate(pipeline):
+        _add(entry, row["kind"], row["id"], row.get("project_id"))
+    stats["loads"] += 1
+    return entry
+
+def _add(entry: _Entry, kind: str, object_id: str, project_id: Optional[str] = None):
+    if kind == "asset":
+        entry.assets[object_id] = project_id
+    else:
+        entry.ids(kind).add(object_id)
+
+def _stamp(user: str) -> Tuple[int, int]:
+    """The user's and everyone's delete stamps from acl_versions."""
+    versions = {row["user_id"]: row["version"] for row in acl_versions_collection.find({"user_id": {"$in": [user, EVERYONE]}})}
+    return versions.get(user, 0), versions.get(EVERYONE, 0)
+
+def _entry(user: str) -> _Entry:
+    entry = _entries.get(user)
+    now = time.monotonic()
+    stamp = None
+    if entry is not None and entry.expires >= now and now - entry.checked >= CHECK_SECONDS:
+        stamp = _stamp(user)
+        if stamp == entry.version:
+            entry.checked = now
+        else:
+            # Something was deleted through another worker
+            stats["stale"] += 1
+            entry = None
+    if entry is None or entry.expires < now:
+        # Stamp read before the load, a delete racing it is seen at the next check.
+        # Loaded outside the lock, two requests racing both load, the last one is kept
+        stamp = stamp or _stamp(user)
+        entry = _load(user)
+        entry.version = stamp
+        with _lock:
+            _entries[user] = entry
+            while len(_entries) > MAX_USERS:
+                _entries.popitem(last=False)
+    else:
+        with _lock:
+            if user in _entries:
+                _entries.move_to_end(user)
+    return entry
+
+def owns(user: str, kind: str, object_id: Optional[str]) -> bool:
+    """Whether user owns the project, asset or sensor object_id."""
+    if not object_id:
+        return False
+    entry = _entry(user)
+    if object_id in entry.ids(kind):
+        stats["hits"] += 1
+        return True
+
+    # Created through another worker since the entry was loaded, or not the user's
+    stats["misses"] += 1
+    document = COLLECTIONS[kind].find_one({f"{kind}_id": object_id, "owner_id": user}, {"_id": 0, "project_id": 1})
+    if document is None:
+        stats["denied"] += 1
+        return False
+    _add(entry, kind, object_id, document.get("project_id"))
+    return True
+
+def asset_project(user: str, asset_id: str) -> Optional[str]:
+    """project_id of an asset the user owns, None when it isn't theirs (or has no project)."""
+    if not owns(user, "asset", asset_id):
+        return None
+    return _entry(user).assets.get(asset_id)
+
+def grant(user: str, kind: str, object_id: str, project_id: Optional[str] = None):
+    """Record a newly created object, only when the user's entry is loaded."""
+    entry = _entries.get(user)
+    if entry is not None:
+        _add(entry, kind, object_id, project_id)
+
+def forget(user: Optional[str] = None):
+    """Drop a user's entry (everyone's when user is None), reloaded on the next
+    check, here and in other processes within ACL_CHECK_SECONDS."""
+    acl_versions_collection.update_one({"user_id": user or EVERYONE}, {"$inc": {"version": 1}}, upsert=True)
+    with _lock:
+        if user is None:
+            _entries.clear()
+        else:
+            _entries.pop(user, None)
+
+def snapshot() -> Dict[str, Any]:
+    return {"users": len(_entries), "ttl_seconds": TTL_SECONDS, "check_seconds": CHECK_SECONDS, **stats}
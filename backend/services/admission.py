@@ -0,0 +1,155 @@
+# Adaptive admission control for ingest and dashboard reads.
+#
+# An AdaptiveLimiter caps how many requests are doing database work at once.
+# The cap follows latency (gradient style): a short moving average of request
+# latency is compared with a slow one that stands for "normal" latency, and
+# while the short one stays within ADMISSION_TOLERANCE x the slow one the
+# limit grows by about sqrt(limit); when MongoDB slows down the ratio falls
+# and the limit shrinks with it, down to at most half per update.
+#
+# Requests over the limit get 503 with Retry-After straight away instead of
+# queueing in uvicorn until the client times out. Routine readings may only
+# use ADMISSION_ROUTINE_SHARE of the limit, the rest is kept for dashboard
+# reads and readings that carry (or are likely to carry) alerts.
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+
+ENABLED = os.getenv("ADMISSION_CONTROL", "1") == "1"
+INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "20"))
+MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "4"))
+MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "500"))
+TOLERANCE = float(os.getenv("ADMISSION_TOLERANCE", "2.0"))
+ROUTINE_SHARE = float(os.getenv("ADMISSION_ROUTINE_SHARE", "0.8"))
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial: int = INITIAL_LIMIT,
+        min_limit: int = MIN_LIMIT,
+        max_limit: int = MAX_LIMIT,
+        tolerance: float = TOLERANCE,
+        routine_share: float = ROUTINE_SHARE,
+        smoothing: float = 0.2,
+        short_window: int = 10,
+        long_window: int = 500
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.routine_share = routine_share
+        self.smoothing = smoothing
+        self.short_window = short_window
+        self.long_window = long_window
+        self.in_flight = 0
+        self.short_latency = None
+        self.long_latency = None
+        self.lock = threading.Lock()
+        self.stats = {"admitted": 0, "shed_routine": 0, "shed_priority": 0}
+
+    def try_acquire(self, priority: bool) -> bool:
+        with self.lock:
+            cap = self.limit if priority else self.limit * self.routine_share
+            if self.in_flight >= max(1, int(cap)):
+                self.stats["shed_priority" if priority else "shed_routine"] += 1
+                return False
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return True
+
+    def release(self, latency: float):
+        with self.lock:
+            self.in_flight -= 1
+            self._update(latency)
+
+    def _update(self, latency: float):
+        if self.short_latency is None:
+            self.short_latency = self.long_latency = latency
+            return
+        self.short_latency += (latency - self.short_latency) / self.short_window
+        self.long_latency += (latency - self.long_latency) / self.long_window
+        # Let the baseline catch up quickly when things got faster
+        if self.long_latency > 2 * self.short_latency:
+            self.long_latency *= 0.95
+
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_latency / max(self.short_latency, 1e-6)))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        if target > self.limit and self.in_flight < self.limit / 2:
+            # Not using the limit we have, no evidence it could be higher
+            return
+        limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = min(max(limit, self.min_limit), self.max_limit)
+
+    def retry_after(self) -> int:
+        # About the time the work in flight needs to drain
+        return max(1, math.ceil((self.short_latency or 0) * 2))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": ENABLED,
+            "limit": round(self.limit, 2),
+            "routine_limit": round(self.limit * self.routine_share, 2),
+            "in_flight": self.in_flight,
+            "short_latency_ms": round((self.short_latency or 0) * 1000, 2),
+            "long_latency_ms": round((self.long_latency or 0) * 1000, 2),
+            **self.stats
+        }
+
+limiter = AdaptiveLimiter()
+
+def _shed_detail() -> Dict[str, Any]:
+    return {
+        "status_code": 503,
+        "detail": "Server is overloaded, retry later",
+        "headers": {"Retry-After": str(limiter.retry_after())},
+    }
+
+@asynccontextmanager
+async def slot(priority: bool):
+    """Hold one unit of the limit for the body, 503 when there is none."""
+    if not ENABLED:
+        yield
+        return
+    if not limiter.try_acquire(priority):
+        raise HTTPException(**_shed_detail())
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        limiter.release(time.perf_counter() - started)
+
+def is_priority(readings: List[Dict[str, Any]]) -> bool:
+    """Readings that will or probably will raise alerts: out of their absolute
+    limits, or from a sensor that is alerting right now."""
+    from services.asset_health import current_severity
+
+    for reading in readings:
+        values = reading.get("readings", {})
+        pitch, roll = values.get("pitch"), values.get("roll")
+        if isinstance(pitch, (int, float)) and not -90 <= pitch <= 90:
+            return True
+        if isinstance(roll, (int, float)) and not -180 <= roll <= 180:
+            return True
+        if current_severity(reading["sensor_id"]) not in (None, "good"):
+            return True
+    return False
+
+async def dashboard_reads(request: Request, call_next):
+    """HTTP middleware: API GETs (dashboard reads) count against the limit at priority."""
+    if not ENABLED or request.method != "GET" or not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    if not limiter.try_acquire(True):
+        shed = _shed_detail()
+        return JSONResponse(status_code=503, content={"detail": shed["detail"]}, headers=shed["headers"])
+    started = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        limiter.release(time.perf_counter() - started)
@@ -0,0 +1,266 @@
+# Sharded alert evaluation on a pool of worker processes.
+#
+# With ALERT_SHARDS=N the API starts N processes and every sensor_id is
+# hashed to one of them. A shard keeps the rolling history (the last
+# HISTORY_SIZE readings) of its sensors in memory and runs classify_alert
+# for them, so alert evaluation uses N cores and a sensor's readings are
+# always classified by the same process, one after the other, in the order
+# they were submitted.
+#
+# Readings go to a shard over its own multiprocessing queue and results come
+# back on one shared queue. These pickle over pipes instead of using a
+# shared-memory ring: only the readings dict and time of each reading cross
+# over, which costs little next to classify_alert, and queues already block,
+# wake the reader and survive a shard being killed and restarted.
+#
+# The first reading a shard sees for a sensor carries the sensor's history
+# (from MongoDB and the write-behind log), after that the shard's own state
+# is used. Readings classified elsewhere (another uvicorn worker, replay, the
+# in-process fallback) never reach the shard, so a sensor's history is sent
+# again once it is ALERT_SHARD_RESEED_SECONDS old; until then the shard may
+# miss them. A seed is merged with what the shard classified itself, newest
+# first by reading time: a seed loaded while other batches of the sensor were
+# in flight doesn't have their readings yet.
+#
+# If a shard doesn't answer within ALERT_SHARD_TIMEOUT seconds it is
+# restarted, once per generation of the process, and every batch still
+# waiting on it is classified in the calling thread instead.
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from itertools import count
+from typing import Dict, Any, List, Callable, Optional
+
+SHARDS = int(os.getenv("ALERT_SHARDS", "0"))
+TIMEOUT = float(os.getenv("ALERT_SHARD_TIMEOUT", "10"))
+RESEED_SECONDS = float(os.getenv("ALERT_SHARD_RESEED_SECONDS", "30"))
+
+LoadHistory = Callable[[str], List[Dict[str, Any]]]
+Classify = Callable[[List[Dict[str, Any]], LoadHistory], List[Dict[str, Any]]]
+
+stats = {
+    "submitted": 0,
+    "batches": 0,
+    "fallbacks": 0,
+    "restarts": 0,
+}
+
+def shard_of(sensor_id: str, shards: int) -> int:
+    # Stable across processes and restarts, unlike hash()
+    return zlib.crc32(sensor_id.encode()) % shards
+
+def _entry(reading: Dict[str, Any]) -> Dict[str, Any]:
+    """History entry: the readings classify_alert compares against, and the
+    time in naive UTC as MongoDB gives it back, to merge seeds by."""
+    timestamp = reading.get("timestamp")
+    if isinstance(timestamp, datetime) and timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return {"readings": reading.get("readings", {}), "timestamp": timestamp}
+
+def _slim(reading: Dict[str, Any]) -> Dict[str, Any]:
+    # Only what classify_alert and the history look at crosses the process boundary
+    slim = _entry(reading)
+    if "location" in reading:
+        slim["location"] = reading["location"]
+    return slim
+
+def _merge(seed: List[Dict[str, Any]], own, size: int) -> deque:
+    """The newest size entries of a seed and of the shard's own history."""
+    entries = list(seed)
+    entries.extend(entry for entry in own if entry not in seed)
+    entries.sort(key=lambda entry: entry["timestamp"] or datetime.min, reverse=True)
+    return deque(entries[:size], maxlen=size)
+
+def _shard_main(shard: int, requests, results, history_size: int):
+    """Worker process loop: classify (sensor_id, reading, seed) items in order."""
+    from services.sensor_service import classify_alert
+
+    histories: Dict[str, deque] = {}
+    while True:
+        message = requests.get()
+        if message is None:
+            return
+        request_id, items = message
+        alerts = []
+        try:
+            for sensor_id, reading, seed in items:
+                history = histories.get(sensor_id)
+                if history is None or seed is not None:
+                    # A seed is the sensor's history from MongoDB, merged with ours
+                    history = histories[sensor_id] = _merge(seed or [], history or (), history_size)
+                alerts.append(classify_alert(reading, list(history)))
+                history.appendleft({"readings": reading["readings"], "timestamp": reading["timestamp"]})
+            results.put((request_id, alerts, None))
+        except Exception as e:
+            results.put((request_id, None, f"{type(e).__name__}: {e}"))
+
+class ShardPool:
+    def __init__(self, shards: int = SHARDS, history_size: int = 10):
+        self.shards = shards
+        self.history_size = history_size
+        # spawn: the workers must not inherit the parent's MongoClient or threads
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.processes: List[Any] = [None] * shards
+        self.queues: List[Any] = [None] * shards
+        # sensor_id -> when its history was last sent, per shard
+        self.known: List[Dict[str, float]] = [{} for _ in range(shards)]
+        # Bumped on every (re)start, a timed out batch restarts its shard only once
+        self.generations = [0] * shards
+        # request_id -> (shard, future)
+        self.pending: Dict[int, Any] = {}
+        self.ids = count()
+        self.lock = threading.Lock()
+        self.reader = None
+
+    def start(self) -> "ShardPool":
+        for shard in range(self.shards):
+            self._start_shard(shard)
+        self.reader = threading.Thread(target=self._read_results, name="alert-shard-results", daemon=True)
+        self.reader.start()
+        return self
+
+    def _start_shard(self, shard: int):
+        queue = self.context.Queue()
+        process = self.context.Process(
+            target=_shard_main,
+            args=(shard, queue, self.results, self.history_size),
+            name=f"alert-shard-{shard}",
+            daemon=True
+        )
+        process.start()
+        self.queues[shard] = queue
+        self.processes[shard] = process
+        self.known[shard] = {}
+        self.generations[shard] += 1
+
+    def _restart_shard(self, shard: int, generation: int):
+        """Restart the shard unless it was already restarted since generation,
+        failing every batch still waiting on it over to the fallback."""
+        with self.lock:
+            if self.generations[shard] != generation:
+                return
+            process = self.processes[shard]
+            if process.is_alive():
+                process.terminate()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join(timeout=5)
+            self._start_shard(shard)
+            stats["restarts"] += 1
+            waiting = [request_id for request_id, (pending_shard, _) in list(self.pending.items()) if pending_shard == shard]
+        for request_id in waiting:
+            entry = self.pending.pop(request_id, None)
+            if entry is not None and not entry[1].done():
+                entry[1].set_exception(RuntimeError("shard restarted"))
+
+    def _read_results(self):
+        while True:
+            message = self.results.get()
+            if message is None:
+                return
+            request_id, alerts, error = message
+            entry = self.pending.pop(request_id, None)
+            if entry is None or entry[1].done():
+                # Answer to a batch that already timed out
+                continue
+            future = entry[1]
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(alerts)
+
+    def classify(self, readings: List[Dict[str, Any]], load_history: LoadHistory, fallback: Classify) -> List[Dict[str, Any]]:
+        """Alerts for each reading, in order. load_history(sensor_id) gives
+        the newest-first history for sensors a shard hasn't seen yet,
+        fallback(readings, load_history) classifies in this process."""
+        by_shard: Dict[int, List[int]] = {}
+        for index, reading in enumerate(readings):
+            by_shard.setdefault(shard_of(reading["sensor_id"], self.shards), []).append(index)
+
+        submitted = []
+        now = time.monotonic()
+        for shard, indexes in by_shard.items():
+            known = self.known[shard]
+            seeded = set()
+            items = []
+            for index in indexes:
+                sensor_id = readings[index]["sensor_id"]
+                seed = None
+                if known.get(sensor_id, float("-inf")) < now - RESEED_SECONDS and sensor_id not in seeded:
+                    seed = [_entry(entry) for entry in load_history(sensor_id)]
+                    seeded.add(sensor_id)
+                items.append((sensor_id, _slim(readings[index]), seed))
+
+            future = Future()
+            request_id = next(self.ids)
+            with self.lock:
+                generation = self.generations[shard]
+                self.pending[request_id] = (shard, future)
+                self.queues[shard].put((request_id, items))
+                # Marked after the put, so a concurrent batch either sends its
+                # own seed or queues behind this one
+                for sensor_id in seeded:
+                    self.known[shard][sensor_id] = now
+            submitted.append((shard, indexes, request_id, future, generation))
+
+        stats["submitted"] += len(readings)
+        stats["batches"] += len(submitted)
+
+        alerts: List[Optional[Dict[str, Any]]] = [None] * len(readings)
+        for shard, indexes, request_id, future, generation in submitted:
+            try:
+                shard_alerts = future.result(timeout=TIMEOUT)
+            except (FutureTimeoutError, RuntimeError) as e:
+                print(f"Alert shard {shard} failed ({str(e) or 'timeout'}), classifying here")
+                self.pending.pop(request_id, None)
+                stats["fallbacks"] += 1
+                self._restart_shard(shard, generation)
+                shard_alerts = fallback([readings[index] for index in indexes], load_history)
+            for index, reading_alerts in zip(indexes, shard_alerts):
+                alerts[index] = reading_alerts
+        return alerts
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "shards": self.shards,
+            "alive": sum(1 for process in self.processes if process and process.is_alive()),
+            "sensors": [len(known) for known in self.known],
+            "pending": len(self.pending),
+            **stats
+        }
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+
+_pool: Optional[ShardPool] = None
+
+def enabled() -> bool:
+    return SHARDS > 0
+
+def start(history_size: int) -> ShardPool:
+    global _pool
+    if _pool is None:
+        _pool = ShardPool(SHARDS, history_size).start()
+    return _pool
+
+def get_pool() -> Optional[ShardPool]:
+    return _pool
+
+def stop():
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
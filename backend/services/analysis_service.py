@@ -0,0 +1,322 @@
+# Offline analysis of uploaded CSV/XLSX files, the algorithm.py check as jobs.
+#
+# An upload is streamed to ANALYSIS_DIR and queued as an analysis_jobs
+# document; a process pool of ANALYSIS_WORKERS runs the jobs, so the API
+# workers only receive the file. A job
+#   1. converts the file once into a columnar cache, one float64 file per
+#      column under cache/<sha256 of the upload>/, reading ANALYSIS_CHUNK_ROWS
+#      rows at a time (pandas chunks for CSV, openpyxl's streaming reader for
+#      XLSX). The same file uploaded again reuses the cache.
+#   2. evaluates every column with numpy over memory-mapped chunks: the
+#      column mean, the limits mean +- ANALYSIS_TOLERANCE x |mean| (the
+#      algorithm.py rule), and the rows above and below them.
+# Progress is saved on the job document after every chunk, results go to
+# analysis_results, one document per column with the first
+# ANALYSIS_MAX_ANOMALIES anomalous rows.
+# A worker takes a lease on its job (like the cascade delete jobs) and renews
+# it with every progress update; on startup, jobs still queued and running
+# jobs whose lease ran out (their process died) are queued again.
+# Like algorithm.py the 'Date & Time' column is left out and blanks count
+# as 0; columns without any numeric value are skipped.
+#
+# pandas, numpy and openpyxl are imported by the workers only.
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, BinaryIO
+
+from database import analysis_jobs_collection, analysis_results_collection
+
+ANALYSIS_DIR = os.getenv("ANALYSIS_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "analysis"))
+WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+CHUNK_ROWS = int(os.getenv("ANALYSIS_CHUNK_ROWS", "100000"))
+MAX_UPLOAD_MB = int(os.getenv("ANALYSIS_MAX_UPLOAD_MB", "200"))
+TOLERANCE = float(os.getenv("ANALYSIS_TOLERANCE", "0.15"))
+MAX_ANOMALIES = int(os.getenv("ANALYSIS_MAX_ANOMALIES", "1000"))
+
+# A chunk must be converted or a column analyzed within this
+LEASE_SECONDS = 300
+
+EXTENSIONS = (".csv", ".xlsx")
+SKIPPED_COLUMNS = ("Date & Time",)
+COPY_CHUNK = 1024 * 1024
+
+def _uploads_dir() -> str:
+    return os.path.join(ANALYSIS_DIR, "uploads")
+
+def _cache_dir(file_hash: str) -> str:
+    return os.path.join(ANALYSIS_DIR, "cache", file_hash)
+
+## Queueing, in the API process
+
+def save_upload(source: BinaryIO, filename: str) -> Dict[str, Any]:
+    """Stream an upload to disk, returns {path, file_hash, size}.
+
+    Raises ValueError for other file types or uploads over ANALYSIS_MAX_UPLOAD_MB."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError("Upload a .csv or .xlsx file")
+    os.makedirs(_uploads_dir(), exist_ok=True)
+    path = os.path.join(_uploads_dir(), f"{uuid.uuid4()}{extension}")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as out:
+            while True:
+                chunk = source.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_MB * 1024 * 1024:
+                    raise ValueError(f"Files are limited to {MAX_UPLOAD_MB} MB")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return {"path": path, "file_hash": digest.hexdigest(), "size": size}
+
+def create_job(owner_id: str, filename: str, upload: Dict[str, Any]) -> Dict[str, Any]:
+    now = datetime.now()
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "owner_id": owner_id,
+        "filename": filename,
+        "path": upload["path"],
+        "file_hash": upload["file_hash"],
+        "size": upload["size"],
+        "status": "queued",
+        "progress": {"stage": "queued", "rows": 0, "columns": 0, "columns_done": 0},
+        "error": None,
+        "lease_until": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    analysis_jobs_collection.insert_one(job)
+    job.pop("_id", None)
+    submit(job["job_id"])
+    return job
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: the workers must not inherit the parent's MongoClient or threads
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def submit(job_id: str):
+    def report(future):
+        if not future.cancelled() and future.exception():
+            print(f"Analysis job {job_id} crashed: {future.exception()}")
+    _get_pool().submit(run_job, job_id).add_done_callback(report)
+
+def _claimable(now: datetime) -> Dict[str, Any]:
+    return {"status": {"$in": ["queued", "running"]}, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]}
+
+def resume_jobs():
+    """Queue jobs a previous process left queued, or running with an expired lease."""
+    for job in analysis_jobs_collection.find(_claimable(datetime.now()), {"job_id": 1}):
+        submit(job["job_id"])
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        # Unfinished jobs stay queued/running and are resumed on the next start
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def get_job(job_id: str, results: bool = True) -> Optional[Dict[str, Any]]:
+    job = analysis_jobs_collection.find_one({"job_id": job_id}, {"_id": 0, "path": 0})
+    if job and results:
+        job["results"] = list(analysis_results_collection.find(
+            {"job_id": job_id},
+            {"_id": 0, "job_id": 0, "index": 0},
+            sort=[("index", 1)]
+        ))
+    return job
+
+def list_jobs(owner_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+    return list(analysis_jobs_collection.find(
+        {"owner_id": owner_id},
+        {"_id": 0, "path": 0},
+        sort=[("created_at", -1)],
+        limit=limit
+    ))
+
+def delete_job(job_id: str):
+    """Remove a finished job, its results, its upload (left behind by failed
+    jobs) and its cache when no other job uses it."""
+    job = analysis_jobs_collection.find_one_and_delete({"job_id": job_id}, {"path": 1, "file_hash": 1})
+    if not job:
+        return
+    analysis_results_collection.delete_many({"job_id": job_id})
+    path = job.get("path")
+    if path and os.path.exists(path):
+        os.remove(path)
+    if not analysis_jobs_collection.find_one({"file_hash": job["file_hash"]}, {"_id": 1}):
+        shutil.rmtree(_cache_dir(job["file_hash"]), ignore_errors=True)
+
+## Running, in the pool's worker processes
+
+def _update(job_id: str, **fields):
+    analysis_jobs_collection.update_one({"job_id": job_id}, {"$set": {**fields, "updated_at": datetime.now()}})
+
+def _progress(job_id: str, **fields):
+    """Save progress and renew the job's lease."""
+    _update(job_id, lease_until=datetime.now() + timedelta(seconds=LEASE_SECONDS), **fields)
+
+def _chunks(path: str):
+    """DataFrames of at most CHUNK_ROWS rows."""
+    import pandas as pd
+
+    if path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=CHUNK_ROWS)
+        return
+
+    from openpyxl import load_workbook
+    # read_only streams the sheet instead of loading it whole
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(name) if name is not None else f"Unnamed: {index}" for index, name in enumerate(header)]
+        batch = []
+        width = len(header)
+        for row in rows:
+            batch.append(row[:width] + (None,) * (width - len(row)))
+            if len(batch) >= CHUNK_ROWS:
+                yield pd.DataFrame.from_records(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=header)
+    finally:
+        workbook.close()
+
+def convert(job_id: str, path: str, cache: str) -> Dict[str, Any]:
+    """Write the file's columns to cache, returns its meta ({columns, rows})."""
+    import numpy as np
+    import pandas as pd
+
+    meta_path = os.path.join(cache, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            return json.load(meta_file)
+
+    building = f"{cache}.{uuid.uuid4().hex}"
+    os.makedirs(building)
+    columns: List[str] = []
+    # By position, XLSX headers may repeat a name
+    numeric: List[bool] = []
+    files = []
+    rows = 0
+    try:
+        for chunk in _chunks(path):
+            chunk = chunk.drop(columns=[name for name in SKIPPED_COLUMNS if name in chunk.columns])
+            if not columns:
+                columns = [str(name) for name in chunk.columns]
+                numeric = [False] * len(columns)
+                files = [open(os.path.join(building, f"{index}.f64"), "wb") for index in range(len(columns))]
+            for index in range(len(columns)):
+                values = pd.to_numeric(chunk.iloc[:, index], errors="coerce")
+                numeric[index] = numeric[index] or bool(values.notna().any())
+                # Blanks count as 0, as in algorithm.clean_data
+                files[index].write(values.fillna(0).to_numpy(dtype=np.float64).tobytes())
+            rows += len(chunk)
+            _progress(job_id, **{"progress.stage": "converting", "progress.rows": rows, "progress.columns": len(columns)})
+        meta = {"columns": columns, "numeric": numeric, "rows": rows}
+        with open(os.path.join(building, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+    finally:
+        for column_file in files:
+            column_file.close()
+    try:
+        os.rename(building, cache)
+    except OSError:
+        # Another job converted the same file meanwhile, use theirs
+        shutil.rmtree(building, ignore_errors=True)
+    return meta
+
+def analyze_column(values, name: str) -> Dict[str, Any]:
+    """algorithm.py's limits for one column, evaluated CHUNK_ROWS at a time."""
+    import numpy as np
+
+    rows = len(values)
+    total = 0.0
+    for start in range(0, rows, CHUNK_ROWS):
+        total += float(np.sum(values[start:start + CHUNK_ROWS], dtype=np.float64))
+    mean = total / rows if rows else 0.0
+    boundary = abs(mean) * TOLERANCE
+    lower, upper = mean - boundary, mean + boundary
+
+    high = low = 0
+    minimum, maximum = float("inf"), float("-inf")
+    anomalies = []
+    for start in range(0, rows, CHUNK_ROWS):
+        chunk = np.asarray(values[start:start + CHUNK_ROWS])
+        above = chunk > upper
+        below = chunk < lower
+        high += int(above.sum())
+        low += int(below.sum())
+        minimum, maximum = min(minimum, float(chunk.min())), max(maximum, float(chunk.max()))
+        if len(anomalies) < MAX_ANOMALIES:
+            for row in np.flatnonzero(above | below)[:MAX_ANOMALIES - len(anomalies)]:
+                anomalies.append({"row": start + int(row), "value": float(chunk[row]), "kind": "high" if above[row] else "low"})
+    return {
+        "column": name,
+        "rows": rows,
+        "mean": mean,
+        "min": minimum if rows else None,
+        "max": maximum if rows else None,
+        "lower": lower,
+        "upper": upper,
+        "high": high,
+        "low": low,
+        "normal": rows - high - low,
+        "anomalies": anomalies,
+        "anomalies_truncated": high + low > len(anomalies),
+    }
+
+def run_job(job_id: str):
+    """Process pool entry point: convert, analyze and store one job."""
+    import numpy as np
+
+    now = datetime.now()
+    job = analysis_jobs_collection.find_one_and_update(
+        {"job_id": job_id, **_claimable(now)},
+        # A job resumed after a crash starts over, the conversion is cached
+        {"$set": {"status": "running", "started_at": now, "lease_until": now + timedelta(seconds=LEASE_SECONDS)}}
+    )
+    if not job:
+        return
+    analysis_results_collection.delete_many({"job_id": job_id})
+    try:
+        cache = _cache_dir(job["file_hash"])
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        meta = convert(job_id, job["path"], cache)
+        # The cache holds everything now
+        if os.path.exists(job["path"]):
+            os.remove(job["path"])
+
+        skipped = []
+        _progress(job_id, **{"progress.stage": "analyzing", "progress.rows": meta["rows"], "progress.columns": len(meta["columns"])})
+        for index, (name, numeric) in enumerate(zip(meta["columns"], meta["numeric"])):
+            if not numeric:
+                skipped.append(name)
+            else:
+                values = np.memmap(os.path.join(cache, f"{index}.f64"), dtype=np.float64, mode="r") if meta["rows"] else np.zeros(0)
+                analysis_results_collection.insert_one({"job_id": job_id, "index": index, **analyze_column(values, name)})
+            _progress(job_id, **{"progress.columns_done": index + 1})
+
+        _update(job_id, status="done", skipped_columns=skipped, finished_at=datetime.now(), lease_until=None, **{"progress.stage": "done"})
+    except Exception as e:
+        print(f"Analysis job {job_id} failed: {e}")
+        _update(job_id, status="failed", error=f"{type(e).__name__}: {e}", lease_until=None, **{"progress.stage": "failed"})
@@ -0,0 +1,238 @@
+# Asset-level composite health.
+#
+# One asset_health document per asset holds the severity of each of its
+# sensors' latest alerts (good < warning < danger, "invalid" counts as a
+# warning) and the summary derived from them: the worst severity, how many
+# sensors are alerting, the composite status and when that status last
+# changed. Ingest only touches it when a sensor's severity changes, so a
+# project's health page is one indexed read per asset instead of a read per
+# sensor.
+#
+# Several processes ingest (API workers, the line listener, replay), so the
+# severity recorded on the asset is what decides whether a write is needed:
+# set_sensor only updates documents where the sensor's severity differs. The
+# severity a process last wrote is remembered for ASSET_HEALTH_RECHECK_SECONDS
+# to skip even that query, a change made meanwhile by another process is
+# picked up once it expires.
+#
+# The composite status is the worst sensor severity, raised by rules such as
+# "2 or more sensors in warning => danger":
+#   {"severity": "warning", "at_least": 2, "status": "danger"}
+#   {"severity": "warning", "fraction": 0.5, "status": "danger"}
+# An asset's own rules (PUT /api/assets/{asset_id}/health-rules) replace the
+# ASSET_HEALTH_RULES default.
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+from pymongo import ReturnDocument, ReplaceOne
+from database import asset_health_collection, asset_health_reads, assets_collection, sensors_collection
+
+LEVELS = ["good", "warning", "danger"]
+RANK = {"good": 0, "warning": 1, "invalid": 1, "danger": 2}
+
+def validate_rules(rules: Any) -> List[Dict[str, Any]]:
+    """Normalized copy of a list of composite rules, ValueError when one is malformed."""
+    if rules is None:
+        return []
+    if not isinstance(rules, list):
+        raise ValueError("Health rules must be a list")
+    normalized = []
+    for rule in rules:
+        if not isinstance(rule, dict):
+            raise ValueError("Each health rule must be an object")
+        severity, status = rule.get("severity"), rule.get("status")
+        if severity not in LEVELS or status not in LEVELS:
+            raise ValueError(f"severity and status must be one of {', '.join(LEVELS)}")
+        if ("at_least" in rule) == ("fraction" in rule):
+            raise ValueError("Give either at_least or fraction")
+        if "at_least" in rule:
+            if not isinstance(rule["at_least"], int) or isinstance(rule["at_least"], bool) or rule["at_least"] < 1:
+                raise ValueError("at_least must be a positive integer")
+            normalized.append({"severity": severity, "at_least": rule["at_least"], "status": status})
+        else:
+            if not isinstance(rule["fraction"], (int, float)) or isinstance(rule["fraction"], bool) or not 0 < rule["fraction"] <= 1:
+                raise ValueError("fraction must be between 0 and 1")
+            normalized.append({"severity": severity, "fraction": float(rule["fraction"]), "status": status})
+    return normalized
+
+DEFAULT_RULES = validate_rules(json.loads(os.getenv("ASSET_HEALTH_RULES", "[]")))
+RECHECK_SECONDS = float(os.getenv("ASSET_HEALTH_RECHECK_SECONDS", "10"))
+
+# Severity this process last recorded for each sensor and when, so unchanged
+# sensors cost nothing even while sensors.alerts lags behind the write-behind log
+_applied: Dict[str, Tuple[str, float]] = {}
+
+def severity_of(alerts: Optional[Dict[str, Any]]) -> str:
+    """Worst status in a (possibly nested) alerts dict."""
+    worst = 0
+    for status in (alerts or {}).values():
+        if isinstance(status, dict):
+            worst = max([worst] + [RANK.get(sub_status, 0) for sub_status in status.values()])
+        else:
+            worst = max(worst, RANK.get(status, 0))
+    return LEVELS[worst]
+
+def _asset_ids(sensor: Dict[str, Any]) -> List[str]:
+    asset_ids = sensor.get("asset_ids")
+    if not asset_ids:
+        return []
+    return [asset_ids] if isinstance(asset_ids, str) else list(asset_ids)
+
+def summarize(sensors: Dict[str, str], rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+    counts = {level: 0 for level in LEVELS}
+    for severity in sensors.values():
+        counts[severity] += 1
+    worst = max((RANK[severity] for severity in sensors.values()), default=0)
+
+    status = worst
+    for rule in rules:
+        # Sensors at the rule's severity or worse
+        matching = sum(count for level, count in counts.items() if RANK[level] >= RANK[rule["severity"]])
+        needed = rule["at_least"] if "at_least" in rule else rule["fraction"] * len(sensors)
+        if sensors and matching >= needed:
+            status = max(status, RANK[rule["status"]])
+
+    return {
+        "worst": LEVELS[worst],
+        "status": LEVELS[status],
+        "alerting": len(sensors) - counts["good"],
+        "total": len(sensors),
+        "counts": counts,
+    }
+
+def _recompute(health: Dict[str, Any]):
+    summary = summarize(health.get("sensors", {}), health.get("rules") or DEFAULT_RULES)
+    now = datetime.now()
+    summary["updated_at"] = now
+    if summary["status"] != health.get("status"):
+        summary["changed_at"] = now
+    # A newer version was written meanwhile, its writer recomputes from a
+    # state that already includes this change
+    asset_health_collection.update_one(
+        {"asset_id": health["asset_id"], "version": health["version"]},
+        {"$set": summary}
+    )
+
+def set_sensor(sensor: Dict[str, Any], severity: str):
+    """Record a sensor's severity on each of its assets and recompute the
+    summaries of those where it changed."""
+    field = f"sensors.{sensor['sensor_id']}"
+    for asset_id in _asset_ids(sensor):
+        # Conditional, a process with a stale view of the severity writes nothing
+        health = asset_health_collection.find_one_and_update(
+            {"asset_id": asset_id, field: {"$ne": severity}},
+            {
+                "$set": {field: severity, "project_id": sensor.get("project_ids"), "owner_id": sensor.get("owner_id")},
+                "$inc": {"version": 1},
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if health is None:
+            # Either already at this severity or the asset has no document yet
+            created = asset_health_collection.update_one(
+                {"asset_id": asset_id},
+                {"$setOnInsert": {field: severity, "project_id": sensor.get("project_ids"), "owner_id": sensor.get("owner_id"), "version": 1}},
+                upsert=True
+            )
+            if created.upserted_id is None:
+                continue
+            health = asset_health_collection.find_one({"asset_id": asset_id})
+        _recompute(health)
+    _applied[sensor["sensor_id"]] = (severity, time.monotonic())
+
+def current_severity(sensor_id: str) -> Optional[str]:
+    """Severity this process last recorded for a sensor, None when it hasn't seen it.
+
+    Another process may have recorded a newer one, good enough for admission priority."""
+    applied = _applied.get(sensor_id)
+    return applied[0] if applied else None
+
+def apply_alerts(sensors: Iterable[Dict[str, Any]], alerts: Dict[str, Dict[str, Any]]):
+    """Called by ingest with each sensor document and its latest alerts of the batch."""
+    now = time.monotonic()
+    for sensor in sensors:
+        severity = severity_of(alerts[sensor["sensor_id"]])
+        applied = _applied.get(sensor["sensor_id"])
+        # Unknown or expired, the conditional write decides
+        if applied is None or now - applied[1] >= RECHECK_SECONDS or applied[0] != severity:
+            set_sensor(sensor, severity)
+
+def remove_assets(asset_ids: List[str]):
+    if asset_ids:
+        asset_health_collection.delete_many({"asset_id": {"$in": asset_ids}})
+
+def set_rules(asset: Dict[str, Any], rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Store an asset's own rules (empty list for the defaults) and recompute its status."""
+    assets_collection.update_one({"asset_id": asset["asset_id"]}, {"$set": {"health_rules": rules}})
+    health = asset_health_collection.find_one_and_update(
+        {"asset_id": asset["asset_id"]},
+        {
+            "$set": {"rules": rules, "project_id": asset.get("project_id"), "owner_id": asset.get("owner_id")},
+            "$setOnInsert": {"sensors": {}},
+            "$inc": {"version": 1},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _recompute(health)
+    return get_health(asset["asset_id"])
+
+def get_health(asset_id: str, reads: bool = False) -> Optional[Dict[str, Any]]:
+    """reads: dashboard read, may come from a secondary."""
+    collection = asset_health_reads if reads else asset_health_collection
+    return collection.find_one({"asset_id": asset_id}, {"_id": 0, "version": 0})
+
+def get_project_health(project_id: str) -> Dict[str, Any]:
+    """Every asset's health in a project plus the project's worst status."""
+    assets = list(asset_health_reads.find({"project_id": project_id}, {"_id": 0, "version": 0, "sensors": 0}))
+    status = max((RANK[asset.get("status", "good")] for asset in assets), default=0)
+    return {
+        "project_id": project_id,
+        "status": LEVELS[status],
+        "alerting_assets": sum(1 for asset in assets if asset.get("status", "good") != "good"),
+        "assets": assets,
+    }
+
+def rebuild_health(asset_id: Optional[str] = None) -> int:
+    """Recompute asset health documents from sensors.alerts (one asset or all).
+
+    Returns the number of documents written."""
+    query = {"asset_ids": asset_id} if asset_id else {"asset_ids": {"$nin": [None, ""]}}
+    assets: Dict[str, Dict[str, Any]] = {}
+    for sensor in sensors_collection.find(query, {"sensor_id": 1, "asset_ids": 1, "project_ids": 1, "owner_id": 1, "alerts": 1}):
+        for sensor_asset_id in _asset_ids(sensor):
+            if asset_id and sensor_asset_id != asset_id:
+                continue
+            health = assets.setdefault(sensor_asset_id, {
+                "asset_id": sensor_asset_id,
+                "project_id": sensor.get("project_ids"),
+                "owner_id": sensor.get("owner_id"),
+                "sensors": {},
+            })
+            health["sensors"][sensor["sensor_id"]] = severity_of(sensor.get("alerts"))
+
+    rules = {
+        asset["asset_id"]: asset.get("health_rules") or []
+        for asset in assets_collection.find({"asset_id": {"$in": list(assets)}}, {"asset_id": 1, "health_rules": 1})
+    }
+    previous = {
+        health["asset_id"]: health
+        for health in asset_health_collection.find({"asset_id": {"$in": list(assets)}}, {"asset_id": 1, "status": 1, "changed_at": 1, "version": 1})
+    }
+    now = datetime.now()
+    writes = []
+    for health_id, health in assets.items():
+        health["rules"] = rules.get(health_id, [])
+        health.update(summarize(health["sensors"], health["rules"] or DEFAULT_RULES))
+        old = previous.get(health_id, {})
+        health["version"] = old.get("version", 0) + 1
+        health["updated_at"] = now
+        health["changed_at"] = old.get("changed_at", now) if old.get("status") == health["status"] else now
+        writes.append(ReplaceOne({"asset_id": health_id}, health, upsert=True))
+    if writes:
+        asset_health_collection.bulk_write(writes, ordered=False)
+    _applied.clear()
+    return len(writes)
@@ -0,0 +1,187 @@
+# Per-sensor baseline calibration.
+#
+# Once a night (BASELINE_HOUR) every sensor's readings of the last
+# BASELINE_DAYS are summarised per field by MongoDB: median, MAD (median
+# absolute deviation from the median) and the p01/p05/p25/p75/p95/p99
+# bands. The result is stored on the sensor document as
+#   baseline: {computed_at, days, fields: {"temperature": {...},
+#              "accelerometer": {"x": {...}, ...}}}
+# and classify_alert then judges each reading by its distance from the
+# median in MADs, without loading any history. Fields with fewer than
+# BASELINE_MIN_READINGS readings are left out and only get their absolute
+# limit checks until a later calibration covers them; sensors with no
+# calibrated field at all keep the rolling-mean classification.
+#
+# Every API worker runs the nightly task. Before computing, a worker claims
+# a batch of stale sensors by stamping baseline_claim/baseline_lease_until on
+# them, and only calibrates the sensors that carry its own claim; the others
+# skip sensors whose lease hasn't run out.
+#
+# The median/percentile accumulators need MongoDB 7.0 or later.
+import asyncio
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from pymongo import UpdateOne
+from services.response_cache import bump_many
+from database import sensors_collection, sensor_data_collection
+
+DAYS = int(os.getenv("BASELINE_DAYS", "30"))
+MIN_READINGS = int(os.getenv("BASELINE_MIN_READINGS", "30"))
+HOUR = int(os.getenv("BASELINE_HOUR", "2"))
+BATCH_SIZE = int(os.getenv("BASELINE_BATCH_SIZE", "100"))
+# A sensor calibrated more recently than this is skipped by the nightly run
+FRESH_HOURS = 20
+# How long a worker's claim on a batch of sensors keeps the others off it
+LEASE_SECONDS = int(os.getenv("BASELINE_LEASE_SECONDS", "1800"))
+
+PERCENTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+BANDS = ["p01", "p05", "p25", "median", "p75", "p95", "p99"]
+
+def _field_values(sensor_ids: List[str], since: datetime) -> List[Dict[str, Any]]:
+    """Pipeline stages giving one {sensor_id, field, value} document per numeric reading field."""
+    return [
+        {"$match": {"sensor_id": {"$in": sensor_ids}, "timestamp": {"$gte": since}}},
+        {"$project": {"_id": 0, "sensor_id": 1, "fields": {"$objectToArray": "$readings"}}},
+        {"$unwind": "$fields"},
+        # Vector fields become one entry per axis, "accelerometer.x"
+        {"$project": {"sensor_id": 1, "pairs": {"$cond": [
+            {"$eq": [{"$type": "$fields.v"}, "object"]},
+            {"$map": {
+                "input": {"$objectToArray": "$fields.v"},
+                "as": "axis",
+                "in": {"k": {"$concat": ["$fields.k", ".", "$$axis.k"]}, "v": "$$axis.v"}
+            }},
+            ["$fields"]
+        ]}}},
+        {"$unwind": "$pairs"},
+        {"$match": {"pairs.v": {"$type": "number"}}},
+        {"$project": {"sensor_id": 1, "field": "$pairs.k", "value": "$pairs.v"}},
+    ]
+
+def compute_baselines(sensor_ids: List[str], days: int = DAYS) -> Dict[str, Dict[str, Any]]:
+    """{sensor_id: {field: stats}} for the given sensors, two aggregations per call."""
+    since = datetime.now() - timedelta(days=days)
+
+    bands = sensor_data_collection.aggregate(_field_values(sensor_ids, since) + [
+        {"$group": {
+            "_id": {"sensor_id": "$sensor_id", "field": "$field"},
+            "count": {"$sum": 1},
+            "bands": {"$percentile": {"input": "$value", "p": PERCENTILES, "method": "approximate"}},
+        }},
+        {"$match": {"count": {"$gte": MIN_READINGS}}},
+    ], allowDiskUse=True)
+    stats = {}
+    for row in bands:
+        key = f"{row['_id']['sensor_id']}|{row['_id']['field']}"
+        stats[key] = {"count": row["count"], **dict(zip(BANDS, row["bands"]))}
+    if not stats:
+        return {}
+
+    # MAD needs each field's median first, passed in as a literal lookup
+    medians = {key: value["median"] for key, value in stats.items()}
+    mads = sensor_data_collection.aggregate(_field_values(sensor_ids, since) + [
+        {"$addFields": {"median": {"$getField": {
+            "field": {"$concat": ["$sensor_id", "|", "$field"]},
+            "input": {"$literal": medians}
+        }}}},
+        {"$match": {"median": {"$type": "number"}}},
+        {"$group": {
+            "_id": {"sensor_id": "$sensor_id", "field": "$field"},
+            "mad": {"$median": {"input": {"$abs": {"$subtract": ["$value", "$median"]}}, "method": "approximate"}},
+        }},
+    ], allowDiskUse=True)
+    for row in mads:
+        stats[f"{row['_id']['sensor_id']}|{row['_id']['field']}"]["mad"] = row["mad"]
+
+    baselines: Dict[str, Dict[str, Any]] = {}
+    for key, value in stats.items():
+        sensor_id, field = key.split("|", 1)
+        value.setdefault("mad", 0)
+        fields = baselines.setdefault(sensor_id, {})
+        # Same shape as readings: vector axes nest under their field
+        name, _, axis = field.partition(".")
+        if axis:
+            fields.setdefault(name, {})[axis] = value
+        else:
+            fields[name] = value
+    return baselines
+
+def calibrate(sensor_ids: List[str], days: int = DAYS) -> int:
+    """Compute and store baselines, BATCH_SIZE sensors per aggregation.
+
+    Returns the number of sensors that got a baseline."""
+    calibrated = 0
+    for start in range(0, len(sensor_ids), BATCH_SIZE):
+        batch = sensor_ids[start:start + BATCH_SIZE]
+        baselines = compute_baselines(batch, days)
+        now = datetime.now()
+        if baselines:
+            sensors_collection.bulk_write([
+                UpdateOne({"sensor_id": sensor_id}, {"$set": {"baseline": {"computed_at": now, "days": days, "fields": fields}}})
+                for sensor_id, fields in baselines.items()
+            ], ordered=False)
+            bump_many("sensor", baselines)
+            calibrated += len(baselines)
+    return calibrated
+
+def _stale_filter(stale: datetime) -> Dict[str, Any]:
+    return {"$or": [{"baseline.computed_at": {"$lt": stale}}, {"baseline": {"$exists": False}}]}
+
+def claim_due(sensor_ids: List[str], stale: datetime) -> List[str]:
+    """Claim the still stale, unclaimed sensors among sensor_ids, returns the ones this call got."""
+    now = datetime.now()
+    token = uuid.uuid4().hex
+    sensors_collection.update_many(
+        {
+            "sensor_id": {"$in": sensor_ids},
+            "$and": [
+                _stale_filter(stale),
+                {"$or": [{"baseline_lease_until": None}, {"baseline_lease_until": {"$lt": now}}]},
+            ],
+        },
+        {"$set": {"baseline_claim": token, "baseline_lease_until": now + timedelta(seconds=LEASE_SECONDS)}}
+    )
+    return [sensor["sensor_id"] for sensor in sensors_collection.find({"baseline_claim": token}, {"sensor_id": 1})]
+
+def calibrate_due() -> int:
+    """Every sensor without a baseline or with one older than FRESH_HOURS that no other worker has claimed."""
+    stale = datetime.now() - timedelta(hours=FRESH_HOURS)
+    sensor_ids = [sensor["sensor_id"] for sensor in sensors_collection.find(_stale_filter(stale), {"sensor_id": 1})]
+    calibrated = 0
+    # Claimed a batch at a time, so a lease only has to cover one batch
+    for start in range(0, len(sensor_ids), BATCH_SIZE):
+        claimed = claim_due(sensor_ids[start:start + BATCH_SIZE], stale)
+        if claimed:
+            calibrated += calibrate(claimed)
+    return calibrated
+
+def start_calibration(sensor_ids: Optional[List[str]] = None):
+    """Recalibrate in a background thread, every sensor when sensor_ids is None."""
+    def run():
+        try:
+            ids = sensor_ids if sensor_ids is not None else [sensor["sensor_id"] for sensor in sensors_collection.find({}, {"sensor_id": 1})]
+            print(f"Calibrated {calibrate(ids)} sensor baselines")
+        except Exception as e:
+            print(f"Baseline calibration failed: {e}")
+    threading.Thread(target=run, name="baseline-calibration", daemon=True).start()
+
+def _seconds_until(hour: int) -> float:
+    now = datetime.now()
+    next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+async def calibrate_nightly():
+    """Background task started from the app lifespan."""
+    while True:
+        await asyncio.sleep(_seconds_until(HOUR))
+        try:
+            count = await asyncio.to_thread(calibrate_due)
+            print(f"Calibrated {count} sensor baselines")
+        except Exception as e:
+            print(f"Baseline calibration failed: {e}")
@@ -0,0 +1,155 @@
+# Compact ingest formats for bandwidth constrained devices.
+#
+# MessagePack: the same object (or a list of objects) as the JSON body of
+# /api/receive-sensor-data. Keys may use the short aliases in COMPACT_KEYS and
+# sensor_id may be sent as the 16 raw bytes of the UUID.
+#
+# Fixed-layout frame, version 1 (all little-endian):
+#   header   "SF" | version u8 | sensor_count u8 | reading_count u16
+#   sensors  sensor_count x 16 byte UUID
+#   readings reading_count x (sensor index u8 | unix time u32 | millis u16 | 15 x float32)
+# The float32 fields are listed in FRAME_FIELDS. NaN means "not reported".
+import math
+import struct
+import uuid
+from datetime import datetime, timezone
+from typing import List, Dict, Any
+
+from services.sensor_service import build_sensor_document
+
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+FRAME_CONTENT_TYPE = "application/vnd.setu.frame"
+
+COMPACT_KEYS = {
+    "id": "sensor_id",
+    "ts": "timestamp",
+    "st": "status",
+    "adc": "adc",
+    "t": "temperature",
+    "r": "roll",
+    "p": "pitch",
+    "pos": "position",
+    "a": "accelerometer",
+    "m": "magnetometer",
+    "g": "gyroscope",
+}
+
+FRAME_MAGIC = b"SF"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<2sBBH")
+FRAME_FIELDS = [
+    "adc", "temperature", "roll", "pitch", "lat", "lon",
+    "accelerometer.x", "accelerometer.y", "accelerometer.z",
+    "magnetometer.x", "magnetometer.y", "magnetometer.z",
+    "gyroscope.x", "gyroscope.y", "gyroscope.z",
+]
+FRAME_RECORDS = {
+    1: struct.Struct("<BIH" + "f" * len(FRAME_FIELDS)),
+}
+
+def _expand_keys(item: Dict[Any, Any]) -> Dict[str, Any]:
+    data = {COMPACT_KEYS.get(key, key): value for key, value in item.items()}
+    sensor_id = data.get("sensor_id")
+    if isinstance(sensor_id, bytes):
+        if len(sensor_id) != 16:
+            raise ValueError("Binary sensor_id must be 16 bytes")
+        data["sensor_id"] = str(uuid.UUID(bytes=sensor_id))
+    return data
+
+def decode_msgpack(body: bytes) -> List[Dict[str, Any]]:
+    # Imported on first use, most deployments never see a MessagePack body
+    import msgpack
+    try:
+        payload = msgpack.unpackb(body, raw=False, timestamp=3)
+    except ValueError as e:
+        # msgpack's decode errors are all ValueError subclasses, some without a message
+        raise ValueError(f"Invalid MessagePack body ({type(e).__name__})")
+    items = payload if isinstance(payload, list) else [payload]
+    readings = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("Each MessagePack reading must be a map")
+        readings.append(build_sensor_document(_expand_keys(item)))
+    return readings
+
+def _frame_reading(sensor_id: str, seconds: int, millis: int, values) -> Dict[str, Any]:
+    fields = {name: value for name, value in zip(FRAME_FIELDS, values) if not math.isnan(value)}
+    data = {
+        "sensor_id": sensor_id,
+        "timestamp": datetime.fromtimestamp(seconds + millis / 1000, tz=timezone.utc),
+    }
+    for name in ("adc", "temperature", "roll", "pitch"):
+        if name in fields:
+            data[name] = fields[name]
+    if "lat" in fields and "lon" in fields:
+        # Same "lat, lon" string the JSON devices send
+        data["position"] = f"{fields['lat']}, {fields['lon']}"
+    for vector in ("accelerometer", "magnetometer", "gyroscope"):
+        axes = {axis: fields.get(f"{vector}.{axis}") for axis in ("x", "y", "z")}
+        if any(value is not None for value in axes.values()):
+            data[vector] = axes
+    return build_sensor_document(data)
+
+def decode_frame(body: bytes) -> List[Dict[str, Any]]:
+    if len(body) < FRAME_HEADER.size:
+        raise ValueError("Frame is too short")
+    magic, version, sensor_count, reading_count = FRAME_HEADER.unpack_from(body)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not a sensor frame")
+    record = FRAME_RECORDS.get(version)
+    if record is None:
+        raise ValueError(f"Unsupported frame version {version}")
+
+    offset = FRAME_HEADER.size
+    expected = offset + sensor_count * 16 + reading_count * record.size
+    if len(body) != expected:
+        raise ValueError(f"Frame length {len(body)} does not match header (expected {expected})")
+
+    sensor_ids = [str(uuid.UUID(bytes=body[offset + i * 16:offset + (i + 1) * 16])) for i in range(sensor_count)]
+    offset += sensor_count * 16
+
+    readings = []
+    for index, seconds, millis, *values in record.iter_unpack(body[offset:]):
+        if index >= sensor_count:
+            raise ValueError(f"Sensor index {index} out of range")
+        readings.append(_frame_reading(sensor_ids[index], seconds, millis, values))
+    return readings
+
+def encode_frame(readings: List[Dict[str, Any]]) -> bytes:
+    """Build a version 1 frame from JSON-style readings (for devices and mocks)."""
+    record = FRAME_RECORDS[FRAME_VERSION]
+    sensor_ids = list(dict.fromkeys(reading["sensor_id"] for reading in readings))
+    if len(sensor_ids) > 255 or len(readings) > 65535:
+        raise ValueError("Too many sensors or readings for one frame")
+
+    records = []
+    for reading in readings:
+        timestamp = reading.get("timestamp") or datetime.now(timezone.utc)
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        seconds, millis = divmod(round(timestamp.timestamp() * 1000), 1000)
+
+        values = dict.fromkeys(FRAME_FIELDS, math.nan)
+        for name in ("adc", "temperature", "roll", "pitch"):
+            if reading.get(name) is not None:
+                values[name] = reading[name]
+        if reading.get("position"):
+            values["lat"], values["lon"] = map(float, reading["position"].split(","))
+        for vector in ("accelerometer", "magnetometer", "gyroscope"):
+            for axis, value in (reading.get(vector) or {}).items():
+                if value is not None:
+                    values[f"{vector}.{axis}"] = value
+
+        records.append(record.pack(sensor_ids.index(reading["sensor_id"]), seconds, millis, *values.values()))
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, len(sensor_ids), len(records))
+    return header + b"".join(uuid.UUID(sensor_id).bytes for sensor_id in sensor_ids) + b"".join(records)
+
+def decode_binary_payload(content_type: str, body: bytes) -> List[Dict[str, Any]]:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in (MSGPACK_CONTENT_TYPE, "application/x-msgpack"):
+        return decode_msgpack(body)
+    if media_type == FRAME_CONTENT_TYPE:
+        return decode_frame(body)
+    raise LookupError(f"Unsupported content type {media_type or 'none'}")
@@ -0,0 +1,298 @@
+# Background cascade deletes for projects and assets, plus an orphan sweeper.
+#
+# The route deletes the project/asset document itself so it disappears from
+# the UI straight away, then queues a job here that removes everything that
+# hung off it in batches of at most BATCH_SIZE documents. Job progress
+# (current step and ID chunk) is saved after every batch so a restarted
+# worker resumes where the previous one stopped.
+#
+# The sensor and asset IDs a job removes are kept in delete_job_ids in chunks
+# of BATCH_SIZE, not in the job document, so a large project can't push it
+# towards the 16 MB document limit. A job that fails is retried up to
+# DELETE_MAX_ATTEMPTS times, DELETE_RETRY_SECONDS apart and doubling, then
+# stays failed until an admin retries it (POST /api/admin/delete-jobs/{job_id}/retry).
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterator
+
+from pymongo import ReturnDocument
+from services.notification_service import rebuild_counters
+from services.response_cache import bump_many
+from services import acl
+from database import (
+    users_collection,
+    sensors_collection,
+    sensor_data_collection,
+    projects_collection,
+    assets_collection,
+    notification_collection,
+    delete_jobs_collection,
+    delete_job_ids_collection,
+    asset_health_collection,
+    sensor_sketches_collection,
+)
+
+BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "1000"))
+BATCH_PAUSE_MS = int(os.getenv("DELETE_BATCH_PAUSE_MS", "50"))
+MAX_ATTEMPTS = int(os.getenv("DELETE_MAX_ATTEMPTS", "5"))
+RETRY_SECONDS = float(os.getenv("DELETE_RETRY_SECONDS", "30"))
+LEASE_SECONDS = 60
+
+COLLECTIONS = {
+    "sensor_data": sensor_data_collection,
+    "notifications": notification_collection,
+    "sensors": sensors_collection,
+    "assets": assets_collection,
+    "asset_health": asset_health_collection,
+    "sensor_sketches": sensor_sketches_collection,
+}
+
+# Each step deletes the documents whose field is in one of the job's ID lists
+# (by name). Parents first: once its sensor is gone ingest answers 404, so no
+# reading, notification or health document is written after its step ran.
+# Readings already waiting in the write-behind log can still land later; the
+# orphan sweep removes those
+STEPS = [
+    {"collection": "sensors", "field": "sensor_id", "ids": "sensor_ids"},
+    {"collection": "assets", "field": "asset_id", "ids": "asset_ids"},
+    {"collection": "sensor_data", "field": "sensor_id", "ids": "sensor_ids"},
+    {"collection": "notifications", "field": "sensor_id", "ids": "sensor_ids"},
+    {"collection": "sensor_sketches", "field": "sensor_id", "ids": "sensor_ids"},
+    {"collection": "asset_health", "field": "asset_id", "ids": "asset_ids"},
+]
+
+def _save_ids(job_id: str, lists: Dict[str, List[Any]]) -> Dict[str, int]:
+    """Store a job's ID lists in BATCH_SIZE chunks, returns their lengths."""
+    delete_job_ids_collection.delete_many({"job_id": job_id})
+    chunks = [
+        {"job_id": job_id, "name": name, "chunk": index, "values": values[start:start + BATCH_SIZE]}
+        for name, values in lists.items()
+        for index, start in enumerate(range(0, len(values), BATCH_SIZE))
+    ]
+    if chunks:
+        delete_job_ids_collection.insert_many(chunks)
+    return {name: len(values) for name, values in lists.items()}
+
+def _chunk(job_id: str, name: str, index: int) -> Optional[List[Any]]:
+    chunk = delete_job_ids_collection.find_one({"job_id": job_id, "name": name, "chunk": index}, {"values": 1})
+    return None if chunk is None else chunk["values"]
+
+def _chunks(job_id: str, name: str) -> Iterator[List[Any]]:
+    for chunk in delete_job_ids_collection.find({"job_id": job_id, "name": name}, {"values": 1}).sort("chunk", 1):
+        yield chunk["values"]
+
+def _new_job(kind: str, target_id: Optional[str], owner_id: Optional[str], lists: Dict[str, List[Any]], **extra) -> Dict[str, Any]:
+    now = datetime.now()
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "kind": kind,
+        "target_id": target_id,
+        "owner_id": owner_id,
+        "status": "queued",
+        "steps": STEPS,
+        "step": 0,
+        "chunk": 0,
+        "deleted": {},
+        "error": None,
+        "attempts": 0,
+        "lease_until": None,
+        "created_at": now,
+        "updated_at": now,
+        **extra
+    }
+    # IDs first, a job never runs without its lists
+    job["targets"] = _save_ids(job["job_id"], lists)
+    delete_jobs_collection.insert_one(job)
+    start_job(job["job_id"])
+    return job
+
+def queue_project_delete(project: Dict[str, Any]) -> Dict[str, Any]:
+    project_id = project["project_id"]
+    asset_ids = [asset["asset_id"] for asset in assets_collection.find({"project_id": project_id}, {"asset_id": 1})]
+    sensor_ids = [sensor["sensor_id"] for sensor in sensors_collection.find(
+        {"$or": [{"project_ids": project_id}, {"asset_ids": {"$in": asset_ids}}]}, {"sensor_id": 1}
+    )]
+    return _new_job("project", project_id, project["owner_id"], {"sensor_ids": sensor_ids, "asset_ids": asset_ids})
+
+def queue_asset_delete(asset: Dict[str, Any]) -> Dict[str, Any]:
+    asset_id = asset["asset_id"]
+    sensor_ids = [sensor["sensor_id"] for sensor in sensors_collection.find({"asset_ids": asset_id}, {"sensor_id": 1})]
+    # The route already deleted the asset; listing it removes its health
+    # document once no sensor can recreate it
+    return _new_job("asset", asset_id, asset["owner_id"], {"sensor_ids": sensor_ids, "asset_ids": [asset_id]}, project_id=asset.get("project_id"))
+
+def queue_orphan_sweep(requested_by: str) -> Dict[str, Any]:
+    # Steps are worked out when the job runs, see _plan_orphan_sweep
+    return _new_job("orphans", None, requested_by, {}, steps=[], planned=False)
+
+def _missing(ids: List[Any], collection, field: str) -> List[Any]:
+    ids = [value for value in ids if value is not None]
+    existing = set()
+    for start in range(0, len(ids), BATCH_SIZE):
+        existing.update(document[field] for document in collection.find({field: {"$in": ids[start:start + BATCH_SIZE]}}, {field: 1}))
+    return [value for value in ids if value not in existing]
+
+def _plan_orphan_sweep(job_id: str) -> Dict[str, Any]:
+    """Steps (and their ID lists) that delete documents whose parent no longer exists."""
+    missing_projects = _missing(assets_collection.distinct("project_id"), projects_collection, "project_id")
+    orphan_assets = [asset["asset_id"] for asset in assets_collection.find({"project_id": {"$in": missing_projects}}, {"asset_id": 1})]
+    live_asset_ids = set(assets_collection.distinct("asset_id")) - set(orphan_assets)
+    live_project_ids = set(projects_collection.distinct("project_id"))
+
+    orphan_sensors = []
+    for sensor in sensors_collection.find({}, {"sensor_id": 1, "asset_ids": 1, "project_ids": 1}):
+        asset_id, project_id = sensor.get("asset_ids"), sensor.get("project_ids")
+        if (asset_id and asset_id not in live_asset_ids) or (project_id and project_id not in live_project_ids):
+            orphan_sensors.append(sensor["sensor_id"])
+
+    live_sensor_ids = set(sensors_collection.distinct("sensor_id")) - set(orphan_sensors)
+    data_sensor_ids = [sensor_id for sensor_id in sensor_data_collection.distinct("sensor_id") if sensor_id not in live_sensor_ids]
+    notification_sensor_ids = [sensor_id for sensor_id in notification_collection.distinct("sensor_id") if sensor_id not in live_sensor_ids]
+    sketch_sensor_ids = [sensor_id for sensor_id in sensor_sketches_collection.distinct("sensor_id") if sensor_id not in live_sensor_ids]
+    health_asset_ids = [asset_id for asset_id in asset_health_collection.distinct("asset_id") if asset_id not in live_asset_ids]
+
+    targets = _save_ids(job_id, {
+        "data_sensor_ids": data_sensor_ids,
+        "notification_sensor_ids": notification_sensor_ids,
+        "sketch_sensor_ids": sketch_sensor_ids,
+        "sensor_ids": orphan_sensors,
+        "asset_ids": orphan_assets,
+        "health_asset_ids": health_asset_ids,
+    })
+    return {
+        "steps": [
+            {"collection": "sensors", "field": "sensor_id", "ids": "sensor_ids"},
+            {"collection": "assets", "field": "asset_id", "ids": "asset_ids"},
+            {"collection": "sensor_data", "field": "sensor_id", "ids": "data_sensor_ids"},
+            {"collection": "notifications", "field": "sensor_id", "ids": "notification_sensor_ids"},
+            {"collection": "sensor_sketches", "field": "sensor_id", "ids": "sketch_sensor_ids"},
+            {"collection": "asset_health", "field": "asset_id", "ids": "health_asset_ids"},
+        ],
+        "targets": targets,
+        "planned": True,
+    }
+
+def _claim(job_id: str) -> Optional[Dict[str, Any]]:
+    """Take the lease on a job so only one worker runs it."""
+    now = datetime.now()
+    return delete_jobs_collection.find_one_and_update(
+        {
+            "job_id": job_id,
+            "status": {"$in": ["queued", "running"]},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}],
+        },
+        {"$set": {"status": "running", "lease_until": now + timedelta(seconds=LEASE_SECONDS), "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def _delete_batch(step: Dict[str, Any], values: List[Any]) -> int:
+    """Delete at most BATCH_SIZE documents matching values, 0 once none are left.
+
+    No sort: the first matches in the field's index are taken and deleted by
+    _id, and deleted documents leave the index, so every batch costs the same
+    however many documents match."""
+    collection = COLLECTIONS[step["collection"]]
+    ids = [document["_id"] for document in collection.find({step["field"]: {"$in": values}}, {"_id": 1}).limit(BATCH_SIZE)]
+    if not ids:
+        return 0
+    return collection.delete_many({"_id": {"$in": ids}}).deleted_count
+
+def _run_job(job_id: str):
+    job = _claim(job_id)
+    if not job:
+        return
+
+    try:
+        if job["kind"] == "orphans" and not job.get("planned"):
+            plan = _plan_orphan_sweep(job_id)
+            job.update(plan)
+            delete_jobs_collection.update_one({"job_id": job_id}, {"$set": plan})
+
+        step, chunk, deleted = job["step"], job["chunk"], job["deleted"]
+        values = None
+        while step < len(job["steps"]):
+            current = job["steps"][step]
+            if values is None:
+                values = _chunk(job_id, current["ids"], chunk)
+            if values is None:
+                # Every chunk of the list is done
+                step, chunk, count = step + 1, 0, 0
+            else:
+                count = _delete_batch(current, values)
+                if not count:
+                    chunk, values = chunk + 1, None
+                deleted[current["collection"]] = deleted.get(current["collection"], 0) + count
+            delete_jobs_collection.update_one(
+                {"job_id": job_id},
+                {"$set": {
+                    "step": step,
+                    "chunk": chunk,
+                    "deleted": deleted,
+                    "lease_until": datetime.now() + timedelta(seconds=LEASE_SECONDS),
+                    "updated_at": datetime.now(),
+                }}
+            )
+            if count:
+                time.sleep(BATCH_PAUSE_MS / 1000)
+
+        # Drop the references the owners' user and project documents still hold
+        for name, field, project_field, scope in (("sensor_ids", "sensors", "sensors", "sensor"), ("asset_ids", "assets", "asset_ids", "asset")):
+            for ids in _chunks(job_id, name):
+                users_collection.update_many({field: {"$in": ids}}, {"$pull": {field: {"$in": ids}}})
+                projects_collection.update_many({project_field: {"$in": ids}}, {"$pull": {project_field: {"$in": ids}}})
+                bump_many(scope, ids)
+        if job.get("project_id"):
+            bump_many("project", [job["project_id"]])
+
+        # Notifications went in bulk, recount instead of tracking each one
+        rebuild_counters(None if job["kind"] == "orphans" else job["owner_id"])
+        # Ownership checks found the deleted objects until now
+        acl.forget(None if job["kind"] == "orphans" else job["owner_id"])
+
+        delete_jobs_collection.update_one(
+            {"job_id": job_id},
+            {"$set": {"status": "done", "error": None, "lease_until": None, "updated_at": datetime.now()}}
+        )
+        delete_job_ids_collection.delete_many({"job_id": job_id})
+    except Exception as e:
+        attempts = job.get("attempts", 0) + 1
+        retry = attempts < MAX_ATTEMPTS
+        delay = RETRY_SECONDS * 2 ** (attempts - 1)
+        print(f"Delete job {job_id} failed (attempt {attempts}){f', retrying in {delay:.0f}s' if retry else ''}: {e}")
+        # Progress is kept, a retry continues from the last batch
+        delete_jobs_collection.update_one(
+            {"job_id": job_id},
+            {"$set": {"status": "queued" if retry else "failed", "attempts": attempts, "error": str(e), "lease_until": None, "updated_at": datetime.now()}}
+        )
+        if retry:
+            timer = threading.Timer(delay, start_job, args=(job_id,))
+            timer.daemon = True
+            timer.start()
+
+def start_job(job_id: str):
+    threading.Thread(target=_run_job, args=(job_id,), name=f"delete-job-{job_id}", daemon=True).start()
+
+def retry_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Queue a failed job again with a fresh set of attempts, None when it isn't failed."""
+    job = delete_jobs_collection.find_one_and_update(
+        {"job_id": job_id, "status": "failed"},
+        {"$set": {"status": "queued", "attempts": 0, "updated_at": datetime.now()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job is not None:
+        start_job(job_id)
+    return job
+
+def resume_jobs():
+    """Pick up jobs a previous process left queued or running."""
+    for job in delete_jobs_collection.find({"status": {"$in": ["queued", "running"]}}, {"job_id": 1}):
+        start_job(job["job_id"])
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return delete_jobs_collection.find_one(
+        {"job_id": job_id},
+        {"_id": 0, "steps": 0, "lease_until": 0}
+    )
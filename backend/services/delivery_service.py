@@ -0,0 +1,625 @@
+# Outbound alert delivery: webhooks and email.
+#
+# Users opt in with PUT /api/user/alert-delivery:
+#   {"webhook_url", "webhook_secret", "email", "digest_minutes", "min_severity"}
+# Ingest hands every batch's notifications to enqueue(), which writes one
+# delivery per user and channel to the deliveries collection; that
+# collection is the retry queue, so nothing is lost when the API restarts.
+# DELIVERY_WORKERS threads claim due deliveries (with a lease, like the
+# cascade delete jobs) and send them over pooled connections: one urllib3
+# PoolManager with keep-alive for webhooks, and SMTP connections that log in
+# once and are reused. A failed delivery is retried with exponential backoff
+# up to DELIVERY_MAX_ATTEMPTS times; 4xx webhook answers (besides 408/429)
+# and 5xx SMTP replies fail it at once. Webhooks connect to the address
+# check_webhook_url resolved and approved (with the URL's Host header and
+# TLS name), so a name that resolves elsewhere by then can't redirect them.
+#
+# With digest_minutes set, email alerts are not sent one batch at a time:
+# they are counted into the user's open delivery_digests document and the
+# first alert of a window schedules one summary email digest_minutes later.
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import os
+import queue
+import random
+import smtplib
+import socket
+import ssl
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import parseaddr
+from urllib.parse import urlsplit
+from typing import Dict, Any, List, Optional, Iterable
+
+import orjson
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import deliveries_collection, delivery_digests_collection, users_collection
+
+WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+POLL_SECONDS = float(os.getenv("DELIVERY_POLL_SECONDS", "1"))
+MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "8"))
+BACKOFF_SECONDS = float(os.getenv("DELIVERY_BACKOFF_SECONDS", "5"))
+MAX_BACKOFF_SECONDS = float(os.getenv("DELIVERY_MAX_BACKOFF_SECONDS", "3600"))
+DIGEST_CHECK_SECONDS = float(os.getenv("DELIVERY_DIGEST_CHECK_SECONDS", "30"))
+
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+WEBHOOK_POOL_SIZE = int(os.getenv("WEBHOOK_POOL_SIZE", "10"))
+# Webhooks may only go to public addresses, except these hosts (e.g. localhost for mock_delivery.py)
+WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+# Email delivery is off while SMTP_HOST is unset
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "starttls")
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_FROM = os.getenv("SMTP_FROM", "SETU Technologies inc. <alerts@localhost>")
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+# A connection idle longer than this gets a NOOP before it is reused
+SMTP_IDLE_SECONDS = 60
+
+SMTP_SECURITY_MODES = ("ssl", "starttls", "none")
+if SMTP_SECURITY not in SMTP_SECURITY_MODES:
+    raise ValueError(f"SMTP_SECURITY must be one of {', '.join(SMTP_SECURITY_MODES)}")
+
+LEASE_SECONDS = 60
+# Delivery settings are read once per SETTINGS_TTL per user and process
+SETTINGS_TTL = 30
+DIGEST_SAMPLES = 10
+SEVERITY = {"warning": 1, "invalid": 1, "danger": 2}
+
+stats = {
+    "enqueued": 0,
+    "sent": 0,
+    "retried": 0,
+    "failed": 0,
+    "digests": 0,
+}
+
+class DeliveryError(Exception):
+    def __init__(self, message: str, permanent: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+
+## Settings
+
+def check_webhook_url(url: str) -> List[str]:
+    """ValueError unless url is http(s) to a host resolving only to public addresses.
+
+    Keeps users from making the server POST to loopback, link-local (cloud
+    metadata) or private services; checked when saved and before each send.
+    Returns the checked addresses, none for WEBHOOK_ALLOWED_HOSTS."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("webhook_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if host in WEBHOOK_ALLOWED_HOSTS:
+        return []
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"webhook_url host {host} does not resolve")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"webhook_url host {host} is not a public address")
+    return sorted(addresses)
+
+def check_email(email: str):
+    """ValueError unless email is one bare address, nothing that could add header lines or recipients."""
+    if any(char in email for char in "\r\n"):
+        raise ValueError("email must not contain line breaks")
+    _, address = parseaddr(email)
+    if address != email or address.count("@") != 1 or any(char in address for char in " ,;<>\"()"):
+        raise ValueError("email must be a single email address")
+
+def _optional_string(settings: Dict[str, Any], name: str) -> Optional[str]:
+    value = settings.get(name) or None
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value
+
+def validate_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalized delivery settings, ValueError when one is malformed."""
+    webhook_url = _optional_string(settings, "webhook_url")
+    if webhook_url:
+        check_webhook_url(webhook_url)
+    email = _optional_string(settings, "email")
+    if email:
+        check_email(email)
+    digest_minutes = settings.get("digest_minutes", 0)
+    # bool is an int subclass, True is not a number of minutes
+    if isinstance(digest_minutes, bool) or not isinstance(digest_minutes, int) or not 0 <= digest_minutes <= 1440:
+        raise ValueError("digest_minutes must be between 0 and 1440")
+    min_severity = settings.get("min_severity", "warning")
+    if min_severity not in ("warning", "danger"):
+        raise ValueError("min_severity must be warning or danger")
+    return {
+        "webhook_url": webhook_url,
+        "webhook_secret": _optional_string(settings, "webhook_secret"),
+        "email": email,
+        "digest_minutes": digest_minutes,
+        "min_severity": min_severity,
+    }
+
+_settings: Dict[str, tuple] = {}
+
+def settings_for(user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Delivery settings of each user that has any, cached for SETTINGS_TTL."""
+    now = time.monotonic()
+    missing = [user_id for user_id in user_ids if user_id not in _settings or _settings[user_id][0] < now]
+    if missing:
+        found = {
+            user["email"]: user.get("alert_delivery")
+            for user in users_collection.find({"email": {"$in": missing}}, {"email": 1, "alert_delivery": 1})
+        }
+        for user_id in missing:
+            _settings[user_id] = (now + SETTINGS_TTL, found.get(user_id))
+    return {user_id: _settings[user_id][1] for user_id in user_ids if _settings[user_id][1]}
+
+def set_settings(user_id: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    settings = validate_settings(settings)
+    users_collection.update_one({"email": user_id}, {"$set": {"alert_delivery": settings}})
+    _settings.pop(user_id, None)
+    return settings
+
+def get_settings(user_id: str) -> Dict[str, Any]:
+    user = users_collection.find_one({"email": user_id}, {"alert_delivery": 1})
+    return (user or {}).get("alert_delivery") or validate_settings({})
+
+## Queue
+
+_wake = threading.Event()
+
+def _delivery(user_id: str, channel: str, target: str, payload: Dict[str, Any], delivery_id: Optional[str] = None) -> Dict[str, Any]:
+    now = datetime.now()
+    return {
+        "delivery_id": delivery_id or str(uuid.uuid4()),
+        "user_id": user_id,
+        "channel": channel,
+        "target": target,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "lease_until": None,
+        "created_at": now,
+    }
+
+def _alert(notification: Dict[str, Any]) -> Dict[str, Any]:
+    data = notification.get("data", {})
+    alert = {
+        "notification_id": notification["notification_id"],
+        "sensor_id": notification["sensor_id"],
+        "alert_type": notification["alert_type"],
+        "message": notification["message"],
+        "field": data.get("field"),
+        "timestamp": notification["timestamp"],
+    }
+    if data.get("sub_field"):
+        alert["sub_field"] = data["sub_field"]
+    return alert
+
+def _email_payload(alerts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    worst = "danger" if any(alert["alert_type"] == "danger" for alert in alerts) else "warning"
+    subject = alerts[0]["message"] if len(alerts) == 1 else f"{worst.upper()}: {len(alerts)} abnormal sensor readings"
+    return {"subject": subject, "body": "\n".join(alert["message"] for alert in alerts)}
+
+def enqueue(notifications: List[Dict[str, Any]]):
+    """Queue the deliveries for a batch of new notifications, called by ingest."""
+    if not notifications:
+        return
+    by_user = defaultdict(list)
+    for notification in notifications:
+        by_user[notification["user_id"]].append(notification)
+    settings = settings_for(by_user)
+    if not settings:
+        return
+
+    deliveries = []
+    for user_id, config in settings.items():
+        alerts = [
+            _alert(notification) for notification in by_user[user_id]
+            if SEVERITY.get(notification["alert_type"], 0) >= SEVERITY[config["min_severity"]]
+        ]
+        if not alerts:
+            continue
+        if config.get("webhook_url"):
+            deliveries.append(_delivery(user_id, "webhook", config["webhook_url"], {"user_id": user_id, "alerts": alerts}))
+        if config.get("email") and SMTP_HOST:
+            if config.get("digest_minutes"):
+                _add_to_digest(user_id, config["digest_minutes"], alerts)
+            else:
+                deliveries.append(_delivery(user_id, "email", config["email"], _email_payload(alerts)))
+
+    if deliveries:
+        deliveries_collection.insert_many(deliveries, ordered=False)
+        stats["enqueued"] += len(deliveries)
+        _wake.set()
+
+def enqueue_test(user_id: str) -> List[str]:
+    """One test delivery per configured channel, returns their delivery_ids."""
+    config = get_settings(user_id)
+    alert = {"notification_id": "test", "sensor_id": "test", "alert_type": "warning", "message": "TEST: alert delivery is working", "field": None, "timestamp": datetime.now()}
+    deliveries = []
+    if config.get("webhook_url"):
+        deliveries.append(_delivery(user_id, "webhook", config["webhook_url"], {"user_id": user_id, "alerts": [alert]}))
+    if config.get("email") and SMTP_HOST:
+        deliveries.append(_delivery(user_id, "email", config["email"], _email_payload([alert])))
+    if deliveries:
+        deliveries_collection.insert_many(deliveries, ordered=False)
+        _wake.set()
+    return [delivery["delivery_id"] for delivery in deliveries]
+
+## Digests
+
+def _add_to_digest(user_id: str, minutes: int, alerts: List[Dict[str, Any]]):
+    now = datetime.now()
+    increments = defaultdict(int)
+    for alert in alerts:
+        increments[f"by_severity.{alert['alert_type']}"] += 1
+        increments[f"by_sensor.{alert['sensor_id']}"] += 1
+    increments["count"] = len(alerts)
+    # One open digest per user (unique partial index), the first alert opens it
+    delivery_digests_collection.update_one(
+        {"user_id": user_id, "open": True},
+        {
+            "$inc": dict(increments),
+            "$push": {"latest": {"$each": [alert["message"] for alert in alerts], "$slice": -DIGEST_SAMPLES}},
+            "$setOnInsert": {"digest_id": str(uuid.uuid4()), "opened_at": now, "due_at": now + timedelta(minutes=minutes)},
+        },
+        upsert=True
+    )
+
+def _digest_payload(digest: Dict[str, Any]) -> Dict[str, Any]:
+    minutes = max(1, round((digest["due_at"] - digest["opened_at"]).total_seconds() / 60))
+    by_severity = digest.get("by_severity", {})
+    lines = [
+        f"{digest['count']} alerts in the last {minutes} minutes: "
+        + ", ".join(f"{count} {severity}" for severity, count in sorted(by_severity.items())),
+        "",
+        "By sensor:",
+    ]
+    by_sensor = sorted(digest.get("by_sensor", {}).items(), key=lambda item: -item[1])
+    lines.extend(f"  {sensor_id}: {count}" for sensor_id, count in by_sensor)
+    lines.extend(["", "Latest:"])
+    lines.extend(f"  {message}" for message in digest.get("latest", []))
+    worst = "DANGER" if by_severity.get("danger") else "WARNING"
+    return {"subject": f"{worst}: {digest['count']} sensor alerts in the last {minutes} minutes", "body": "\n".join(lines)}
+
+def send_due_digests() -> int:
+    """Close every digest whose window is over and queue its email.
+
+    Returns the number of digests queued."""
+    now = datetime.now()
+    # Close first: alerts arriving from now on open the user's next digest
+    for digest in delivery_digests_collection.find({"open": True, "due_at": {"$lte": now}}, {"_id": 1}):
+        delivery_digests_collection.update_one({"_id": digest["_id"], "open": True}, {"$set": {"open": False}})
+
+    queued = 0
+    # Closed digests, including any a crashed process closed but didn't queue
+    for digest in delivery_digests_collection.find({"open": False}):
+        config = settings_for([digest["user_id"]]).get(digest["user_id"])
+        if config and config.get("email") and SMTP_HOST:
+            try:
+                # delivery_id = digest_id, so a retry after a crash can't queue it twice
+                deliveries_collection.insert_one(_delivery(digest["user_id"], "email", config["email"], _digest_payload(digest), digest["digest_id"]))
+                queued += 1
+            except DuplicateKeyError:
+                pass
+        delivery_digests_collection.delete_one({"_id": digest["_id"]})
+    if queued:
+        stats["digests"] += queued
+        stats["enqueued"] += queued
+        _wake.set()
+    return queued
+
+async def send_digests_periodically():
+    """Background task started from the app lifespan."""
+    while True:
+        await asyncio.sleep(DIGEST_CHECK_SECONDS)
+        try:
+            await asyncio.to_thread(send_due_digests)
+        except Exception as e:
+            print(f"Alert digests failed: {e}")
+
+## Connection pools
+
+class WebhookPool:
+    """Keep-alive HTTP connections, shared by every delivery worker."""
+
+    def __init__(self, size: int = WEBHOOK_POOL_SIZE, timeout: float = WEBHOOK_TIMEOUT):
+        import urllib3
+
+        self.urllib3 = urllib3
+        # block: at most size connections per host, workers wait for a free one
+        self.http = urllib3.PoolManager(num_pools=50, maxsize=size, block=True, retries=False, timeout=urllib3.Timeout(total=timeout))
+
+    def send(self, url: str, payload: Dict[str, Any], secret: Optional[str] = None):
+        body = orjson.dumps({**payload, "sent_at": datetime.now()}, default=str)
+        headers = {"Content-Type": "application/json", "User-Agent": "setu-alerts"}
+        try:
+            # Again at send time, the name may resolve elsewhere by now
+            addresses = check_webhook_url(url)
+        except ValueError as e:
+            raise DeliveryError(str(e), permanent=True)
+        if secret:
+            headers["X-Setu-Signature"] = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        try:
+            if addresses:
+                response = self._send_pinned(url, addresses[0], body, headers)
+            else:
+                response = self.http.request("POST", url, body=body, headers=headers)
+        except self.urllib3.exceptions.HTTPError as e:
+            raise DeliveryError(f"{type(e).__name__}: {e}")
+        if response.status < 300:
+            return
+        retry_after = response.headers.get("Retry-After")
+        raise DeliveryError(
+            f"HTTP {response.status}",
+            permanent=400 <= response.status < 500 and response.status not in (408, 429),
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+        )
+
+    def _send_pinned(self, url: str, address: str, body: bytes, headers: Dict[str, str]):
+        """POST to the checked address instead of resolving the name again.
+
+        The Host header and, for https, the SNI name and certificate check
+        still use the URL's host name."""
+        parts = urlsplit(url)
+        pool = self.http.connection_from_host(
+            address,
+            parts.port or (443 if parts.scheme == "https" else 80),
+            parts.scheme,
+            pool_kwargs={"server_hostname": parts.hostname}
+        )
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        return pool.request("POST", path, body=body, headers={**headers, "Host": parts.netloc.rpartition("@")[2]}, redirect=False)
+
+class SmtpPool:
+    """Logged-in SMTP connections, reused until the server drops them."""
+
+    def __init__(self, size: int = SMTP_POOL_SIZE):
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()
+        self.stats = {"connections": 0, "reused": 0}
+
+    def _connect(self) -> smtplib.SMTP:
+        if SMTP_SECURITY == "ssl":
+            connection = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT, context=ssl.create_default_context())
+        else:
+            connection = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if SMTP_SECURITY == "starttls":
+                connection.starttls(context=ssl.create_default_context())
+        if SMTP_USER:
+            connection.login(SMTP_USER, SMTP_PASSWORD or "")
+        self.stats["connections"] += 1
+        return connection
+
+    def _take(self) -> smtplib.SMTP:
+        try:
+            connection, last_used = self.idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        if time.monotonic() - last_used > SMTP_IDLE_SECONDS:
+            try:
+                if connection.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("NOOP failed")
+            except (smtplib.SMTPException, OSError):
+                self._close(connection)
+                return self._connect()
+        self.stats["reused"] += 1
+        return connection
+
+    def _close(self, connection: smtplib.SMTP):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def send(self, to: str, subject: str, body: str):
+        message = EmailMessage()
+        try:
+            message["From"] = SMTP_FROM
+            message["To"] = to
+            # Sensor messages go in the subject, a line break there would end the header
+            message["Subject"] = " ".join(subject.split())
+        except ValueError as e:
+            # e.g. an address saved before validate_settings checked for line breaks
+            raise DeliveryError(f"Invalid email header: {e}", permanent=True)
+        message.set_content(body)
+
+        with self.slots:
+            connection = None
+            try:
+                connection = self._take()
+                try:
+                    connection.send_message(message)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    # The server timed out a pooled connection, once more on a new one
+                    connection.close()
+                    connection = self._connect()
+                    connection.send_message(message)
+            except smtplib.SMTPResponseException as e:
+                self._discard(connection, e)
+                raise DeliveryError(f"SMTP {e.smtp_code}: {e.smtp_error!r}", permanent=e.smtp_code >= 500)
+            except smtplib.SMTPRecipientsRefused as e:
+                self._discard(connection, e)
+                raise DeliveryError(f"Recipient refused: {e.recipients}", permanent=True)
+            except (smtplib.SMTPException, OSError) as e:
+                self._discard(connection, e)
+                raise DeliveryError(f"{type(e).__name__}: {e}")
+            self.idle.put((connection, time.monotonic()))
+
+    def _discard(self, connection: Optional[smtplib.SMTP], error: Exception):
+        if connection is None:
+            return
+        if (isinstance(error, smtplib.SMTPResponseException) and error.smtp_code < 500) or isinstance(error, smtplib.SMTPRecipientsRefused):
+            # The connection itself is fine, only this message was refused
+            try:
+                connection.rset()
+                self.idle.put((connection, time.monotonic()))
+                return
+            except (smtplib.SMTPException, OSError):
+                pass
+        connection.close()
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+## Workers
+
+def _claim() -> Optional[Dict[str, Any]]:
+    """Take the lease on the next due delivery, or one whose lease ran out."""
+    now = datetime.now()
+    return deliveries_collection.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "lease_until": {"$lt": now}},
+        ]},
+        {"$set": {"status": "sending", "lease_until": now + timedelta(seconds=LEASE_SECONDS)}},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def backoff(attempts: int) -> float:
+    """Seconds before attempt attempts + 1, doubling with +-20% jitter."""
+    delay = min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+class Deliverer:
+    def __init__(self, workers: int = WORKERS):
+        self.workers = workers
+        self.webhooks = WebhookPool()
+        self.smtp = SmtpPool() if SMTP_HOST else None
+        self.stopping = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> "Deliverer":
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"alert-delivery-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                delivery = _claim()
+            except Exception as e:
+                print(f"Alert delivery queue unavailable: {e}")
+                delivery = None
+            if delivery is None:
+                _wake.wait(POLL_SECONDS)
+                _wake.clear()
+                continue
+            try:
+                self.deliver(delivery)
+            except Exception as e:
+                # Anything deliver() didn't expect fails this delivery, not the worker
+                print(f"Alert delivery {delivery['delivery_id']} failed: {type(e).__name__}: {e}")
+                self._fail(delivery, e)
+
+    def _fail(self, delivery: Dict[str, Any], error: Exception):
+        stats["failed"] += 1
+        try:
+            deliveries_collection.update_one(
+                {"delivery_id": delivery["delivery_id"]},
+                {"$set": {"status": "failed", "failed_at": datetime.now(), "attempts": delivery["attempts"] + 1, "last_error": f"{type(error).__name__}: {error}", "lease_until": None}}
+            )
+        except Exception as e:
+            # Left to its lease, another worker picks it up once that runs out
+            print(f"Alert delivery queue unavailable: {e}")
+
+    def send(self, delivery: Dict[str, Any]):
+        payload = delivery["payload"]
+        if delivery["channel"] == "webhook":
+            config = settings_for([delivery["user_id"]]).get(delivery["user_id"]) or {}
+            self.webhooks.send(delivery["target"], payload, config.get("webhook_secret"))
+        elif self.smtp is None:
+            raise DeliveryError("SMTP_HOST is not set")
+        else:
+            self.smtp.send(delivery["target"], payload["subject"], payload["body"])
+
+    def deliver(self, delivery: Dict[str, Any]):
+        attempts = delivery["attempts"] + 1
+        now = datetime.now()
+        try:
+            self.send(delivery)
+        except DeliveryError as e:
+            if e.permanent or attempts >= MAX_ATTEMPTS:
+                stats["failed"] += 1
+                update = {"status": "failed", "failed_at": now}
+            else:
+                stats["retried"] += 1
+                delay = max(e.retry_after or 0, backoff(attempts))
+                update = {"status": "pending", "next_attempt_at": now + timedelta(seconds=delay)}
+            deliveries_collection.update_one(
+                {"delivery_id": delivery["delivery_id"]},
+                {"$set": {**update, "attempts": attempts, "last_error": str(e), "lease_until": None}}
+            )
+            return
+        stats["sent"] += 1
+        deliveries_collection.update_one(
+            {"delivery_id": delivery["delivery_id"]},
+            {"$set": {"status": "sent", "sent_at": now, "attempts": attempts, "lease_until": None}}
+        )
+
+    def stop(self):
+        self.stopping.set()
+        _wake.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        if self.smtp:
+            self.smtp.close()
+
+_deliverer: Optional[Deliverer] = None
+
+def start() -> Deliverer:
+    global _deliverer
+    if _deliverer is None:
+        _deliverer = Deliverer().start()
+    return _deliverer
+
+def stop():
+    global _deliverer
+    if _deliverer is not None:
+        _deliverer.stop()
+        _deliverer = None
+
+def retry_failed() -> int:
+    """Queue every failed delivery again, returns how many."""
+    result = deliveries_collection.update_many(
+        {"status": "failed"},
+        {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.now()}}
+    )
+    _wake.set()
+    return result.modified_count
+
+def snapshot() -> Dict[str, Any]:
+    queued = defaultdict(dict)
+    for row in deliveries_collection.aggregate([
+        {"$group": {"_id": {"channel": "$channel", "status": "$status"}, "count": {"$sum": 1}}}
+    ]):
+        queued[row["_id"]["channel"]][row["_id"]["status"]] = row["count"]
+    return {
+        "workers": _deliverer.workers if _deliverer else 0,
+        "smtp": _deliverer.smtp.stats if _deliverer and _deliverer.smtp else None,
+        "open_digests": delivery_digests_collection.count_documents({"open": True}),
+        "queue": queued,
+        **stats
+    }
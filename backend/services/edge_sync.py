@@ -0,0 +1,161 @@
+# Syncing an edge gateway's readings upstream as per-minute aggregates.
+#
+# On the gateway (edge.py) a Syncer thread wakes every EDGE_SYNC_SECONDS,
+# aggregates the readings stored since the last successful push into
+# EDGE_BUCKET_SECONDS buckets per sensor (count/sum/min/max of every numeric
+# field, see SqliteReadingStore.minute_aggregates) and POSTs them to
+# EDGE_UPSTREAM_URL/api/edge/sync with the shared EDGE_SYNC_TOKEN. The last
+# pushed reading id is kept in the SQLite file, so a push that fails is sent
+# again next time and nothing is skipped across restarts. Synced readings
+# older than EDGE_RETENTION_HOURS are then pruned locally.
+#
+# Bucket starts are sent in UTC and converted to the API's naive local time
+# on arrival, gateways and API may be in different time zones (naive starts
+# from older gateways are taken as they are). Upstream, store_aggregates()
+# writes each bucket as one sensor_data document timed at the bucket start:
+# readings holds every field's mean, edge the gateway, count and per-field
+# min/max. Documents are upserted by
+# (sensor_id, timestamp, gateway), a bucket sent again replaces the earlier
+# one. Buckets of sensors that aren't registered upstream are dropped.
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+
+import orjson
+
+from models.edge_model import EdgeSync
+
+SYNC_SECONDS = float(os.getenv("EDGE_SYNC_SECONDS", "60"))
+BUCKET_SECONDS = int(os.getenv("EDGE_BUCKET_SECONDS", "60"))
+RETENTION_HOURS = float(os.getenv("EDGE_RETENTION_HOURS", "72"))
+UPSTREAM_URL = os.getenv("EDGE_UPSTREAM_URL")
+# Shared by the gateway and the upstream API, /api/edge/sync is off upstream while unset
+SYNC_TOKEN = os.getenv("EDGE_SYNC_TOKEN")
+GATEWAY_ID = os.getenv("EDGE_GATEWAY_ID", socket.gethostname())
+# Readings covered by one push, bounds the request size after a long outage
+MAX_READINGS_PER_PUSH = int(os.getenv("EDGE_MAX_READINGS_PER_PUSH", "50000"))
+
+stats = {"pushes": 0, "buckets": 0, "failures": 0, "pruned": 0, "last_push": None, "last_error": None}
+
+## On the gateway
+
+def push(store, http) -> int:
+    """Send the aggregates of readings stored since the last push, returns how many buckets."""
+    after = int(store.get_state("synced_id", 0))
+    upto = min(store.last_id(), after + MAX_READINGS_PER_PUSH)
+    if upto <= after:
+        return 0
+    buckets = store.minute_aggregates(after, upto, BUCKET_SECONDS)
+    response = http.request(
+        "POST",
+        UPSTREAM_URL.rstrip("/") + "/api/edge/sync",
+        body=orjson.dumps({"gateway": GATEWAY_ID, "buckets": buckets}),
+        headers={"Content-Type": "application/json", "X-Edge-Token": SYNC_TOKEN or ""},
+        timeout=30,
+        retries=False,
+    )
+    if response.status >= 300:
+        raise RuntimeError(f"Upstream answered {response.status}: {response.data[:200].decode(errors='replace')}")
+    store.set_state("synced_id", upto)
+    stats["pushes"] += 1
+    stats["buckets"] += len(buckets)
+    stats["last_push"] = datetime.now()
+    return len(buckets)
+
+def prune(store) -> int:
+    synced = int(store.get_state("synced_id", 0)) if UPSTREAM_URL else store.last_id()
+    pruned = store.prune(datetime.now() - timedelta(hours=RETENTION_HOURS), synced)
+    stats["pruned"] += pruned
+    return pruned
+
+class Syncer(threading.Thread):
+    def __init__(self, store):
+        super().__init__(name="edge-sync", daemon=True)
+        self.store = store
+        self.stopping = threading.Event()
+        self.http = None
+        if UPSTREAM_URL:
+            import urllib3
+            self.http = urllib3.PoolManager(num_pools=1, maxsize=1)
+
+    def run(self):
+        while not self.stopping.wait(SYNC_SECONDS):
+            self.sync()
+
+    def sync(self):
+        try:
+            if self.http is not None:
+                # Catch up in MAX_READINGS_PER_PUSH steps
+                while push(self.store, self.http) and not self.stopping.is_set():
+                    pass
+            prune(self.store)
+            stats["last_error"] = None
+        except Exception as e:
+            stats["failures"] += 1
+            stats["last_error"] = f"{type(e).__name__}: {e}"
+            print(f"Edge sync failed: {e}")
+
+    def stop(self):
+        self.stopping.set()
+        self.join(timeout=SYNC_SECONDS + 30)
+        # One last push of what came in since the previous one
+        self.sync()
+
+def snapshot(store) -> Dict[str, Any]:
+    return {
+        "gateway": GATEWAY_ID,
+        "upstream": UPSTREAM_URL,
+        "readings": store.count(),
+        "synced_id": int(store.get_state("synced_id", 0)),
+        "last_id": store.last_id(),
+        **stats,
+    }
+
+## Upstream, in the API
+
+def _means(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """{"accelerometer.x": stats} -> {"accelerometer": {"x": mean}}"""
+    readings: Dict[str, Any] = {}
+    for path, field in fields.items():
+        value = field.sum / field.count if field.count else None
+        parent, _, child = path.rpartition(".")
+        if parent and isinstance(readings.setdefault(parent, {}), dict):
+            readings[parent][child] = value
+        else:
+            readings[path] = value
+    return readings
+
+def store_aggregates(sync: EdgeSync) -> Dict[str, Any]:
+    from pymongo import UpdateOne
+    from database import sensors_collection, sensor_data_collection
+    from services.response_cache import bump_many
+
+    sensor_ids = list({bucket.sensor_id for bucket in sync.buckets})
+    known = {sensor["sensor_id"] for sensor in sensors_collection.find({"sensor_id": {"$in": sensor_ids}}, {"sensor_id": 1})}
+    operations: List[UpdateOne] = []
+    for bucket in sync.buckets:
+        if bucket.sensor_id not in known:
+            continue
+        # Naive local time, like the API's own readings
+        start = bucket.start.astimezone().replace(tzinfo=None) if bucket.start.tzinfo else bucket.start
+        operations.append(UpdateOne(
+            {"sensor_id": bucket.sensor_id, "timestamp": start, "edge.gateway": sync.gateway},
+            {"$set": {
+                "status": "active",
+                "readings": _means(bucket.fields),
+                "edge.seconds": bucket.seconds,
+                "edge.count": bucket.count,
+                # A list, field paths contain dots
+                "edge.fields": [
+                    {"field": path, "count": field.count, "min": field.min, "max": field.max}
+                    for path, field in bucket.fields.items()
+                ],
+            }},
+            upsert=True,
+        ))
+    if operations:
+        sensor_data_collection.bulk_write(operations, ordered=False)
+        bump_many("sensor", known)
+    return {"stored": len(operations), "unknown_sensors": sorted(set(sensor_ids) - known)}
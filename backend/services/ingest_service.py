@@ -0,0 +1,164 @@
+import math
+from fastapi import HTTPException
+from bson import ObjectId
+from services.sensor_service import classify_alert, build_notifications
+from services import write_behind, alert_shards, asset_health, sketch_service, delivery_service, readings_store
+from services.rate_limiter import limiter
+from database import sensors_collection
+from typing import List, Dict, Any, Optional
+
+HISTORY_SIZE = 10
+
+def find_sensors(sensor_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Look up every sensor referenced by a batch in one $in query."""
+    unique_ids = list(set(sensor_ids))
+    if not unique_ids:
+        return {}
+    return {sensor["sensor_id"]: sensor for sensor in sensors_collection.find({"sensor_id": {"$in": unique_ids}})}
+
+def load_history(sensor_id: str) -> List[Dict[str, Any]]:
+    """The sensor's last HISTORY_SIZE readings, newest first."""
+    history = readings_store.get_store().recent(sensor_id, HISTORY_SIZE)
+    if write_behind.enabled():
+        # Readings acknowledged but not group committed yet
+        history = (write_behind.get_log().recent_readings(sensor_id) + history)[:HISTORY_SIZE]
+    return history
+
+def classify_in_process(readings: List[Dict[str, Any]], load_history=load_history) -> List[Dict[str, Any]]:
+    """Alerts for each reading, each one seeing the same sensor's earlier ones as history."""
+    histories = {}
+    alerts = []
+    for reading in readings:
+        sensor_id = reading["sensor_id"]
+        history = histories.get(sensor_id)
+        if history is None:
+            history = histories[sensor_id] = load_history(sensor_id)
+        alerts.append(classify_alert(reading, history))
+        history.insert(0, reading)
+        del history[HISTORY_SIZE:]
+    return alerts
+
+def classify_readings(readings: List[Dict[str, Any]], sensors: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sensors with a calibrated baseline are classified against it straight
+    away, no history needed. The rest on the alert shard processes when they
+    are running, here otherwise."""
+    alerts: List[Optional[Dict[str, Any]]] = [None] * len(readings)
+    rest = []
+    for index, reading in enumerate(readings):
+        baseline = sensors[reading["sensor_id"]].get("baseline")
+        if baseline:
+            alerts[index] = classify_alert(reading, [], baseline)
+        else:
+            rest.append(index)
+
+    if rest:
+        pool = alert_shards.get_pool()
+        batch = [readings[index] for index in rest]
+        results = classify_in_process(batch) if pool is None else pool.classify(batch, load_history, classify_in_process)
+        for index, result in zip(rest, results):
+            alerts[index] = result
+    return alerts
+
+def ingest_readings(readings: List[Dict[str, Any]], rate_limit: bool = True) -> List[Optional[Dict[str, Any]]]:
+    """Classify, notify and store a batch of normalized readings.
+
+    Readings must already look like the output of build_sensor_document.
+    Returns one entry per reading: {"id", "alerts"}, None when the sensor
+    is not registered, or the rate limiter's verdict ({"rate_limited": ...})
+    when it was not stored now. Readings of the same sensor are classified
+    in order, each one seeing the previous ones as history, the same as if
+    they had been posted one at a time.
+    """
+    sensors = find_sensors([reading["sensor_id"] for reading in readings])
+    sensor_updates = {}
+    documents = []
+    notifications = []
+    accepted = []
+    admitted = []
+
+    # Readings each sensor may store now, and the verdict for the rest
+    allowance = {}
+    verdicts = {}
+    if rate_limit:
+        # A token per reading, taken at once for each sensor in this batch
+        by_sensor: Dict[str, List[Dict[str, Any]]] = {}
+        for reading in readings:
+            if reading["sensor_id"] in sensors:
+                by_sensor.setdefault(reading["sensor_id"], []).append(reading)
+        for sensor_id, group in by_sensor.items():
+            allowance[sensor_id], verdicts[sensor_id] = limiter.admit_many(sensors[sensor_id], group)
+
+    for reading in readings:
+        sensor = sensors.get(reading["sensor_id"])
+        if not sensor:
+            accepted.append(None)
+            continue
+
+        if rate_limit:
+            if not allowance[sensor["sensor_id"]]:
+                accepted.append(verdicts[sensor["sensor_id"]])
+                continue
+            allowance[sensor["sensor_id"]] -= 1
+
+        admitted.append(reading)
+        accepted.append(reading)
+
+    for reading, alerts in zip(admitted, classify_readings(admitted, sensors)):
+        sensor = sensors[reading["sensor_id"]]
+        reading["alerts"] = alerts
+        notifications.extend(build_notifications(sensor, reading, alerts))
+
+        # Latest alerts, reading time (and position, when the reading has one) mirrored on the sensor
+        updates = sensor_updates.setdefault(sensor["sensor_id"], {})
+        updates["alerts"] = alerts
+        updates["last_seen"] = reading["timestamp"]
+        if reading.get("location"):
+            updates["location"] = reading["location"]
+            updates["location_updated_at"] = reading["timestamp"]
+        documents.append(reading)
+
+    if documents:
+        write_results(documents, notifications, sensor_updates)
+        sketch_service.record(documents)
+        # Webhooks and emails go out from the delivery workers
+        delivery_service.enqueue(notifications)
+        # Only sensors whose worst severity changed touch asset_health
+        asset_health.apply_alerts(
+            [sensors[sensor_id] for sensor_id in sensor_updates],
+            {sensor_id: updates["alerts"] for sensor_id, updates in sensor_updates.items()}
+        )
+
+    return [
+        {"id": str(reading["_id"]), "alerts": reading["alerts"]} if reading and "_id" in reading else reading
+        for reading in accepted
+    ]
+
+def write_results(documents: List[Dict[str, Any]], notifications: List[Dict[str, Any]], sensor_updates: Dict[str, Dict[str, Any]]):
+    """Store a batch either straight to Mongo or through the write-behind log."""
+    if not write_behind.enabled():
+        # Notifications first so their embedded copy of the reading has no _id
+        write_behind.commit(documents, notifications, sensor_updates)
+        return
+
+    # _ids are fixed before the append so a replay can't insert twice. The
+    # notification keeps its own copy of the reading, without the reading's _id,
+    # the same as in direct mode
+    for notification in notifications:
+        notification["data"]["sensor_data"] = dict(notification["data"]["sensor_data"])
+        notification["_id"] = ObjectId()
+    for document in documents:
+        document["_id"] = ObjectId()
+    write_behind.get_log().append(documents, notifications, sensor_updates)
+
+def ingest_reading(reading: Dict[str, Any]) -> Dict[str, Any]:
+    """Single reading version used by /api/receive-sensor-data."""
+    result = ingest_readings([reading])[0]
+    if result is None:
+        raise HTTPException(status_code=404, detail="Sensor not registered")
+    if result.get("rate_limited") == "rejected":
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded for this sensor",
+            headers={"Retry-After": str(max(1, math.ceil(result["retry_after"])))}
+        )
+    return result
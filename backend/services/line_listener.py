@@ -0,0 +1,254 @@
+# Raw TCP/UDP ingest for devices that can't afford HTTP per reading.
+#
+# One reading per line:  <sensor_id> <timestamp> <field>=<value>,<field>=<value>...
+#   timestamp   ISO 8601, unix seconds, or "-" for the time it was received
+#   fields      temperature=21.5,pitch=3,accelerometer.x=0.1,lat=45.5,lon=-73.2
+#               vector axes use "<field>.<axis>", lat/lon become "position",
+#               quoted values stay strings (status="idle")
+#
+# Lines are micro-batched into services.ingest_service.ingest_readings, the
+# same pipeline /api/receive-sensor-data uses.
+#
+# Enable inside the API with LINE_PROTOCOL_TCP_PORT and/or LINE_PROTOCOL_UDP_PORT,
+# or run it as its own process from the backend folder:
+#   python -m services.line_listener
+# On its own it starts what the API's lifespan starts for ingest: alert
+# shards, the write-behind log, the release of rate-limited readings and the
+# delivery workers for the alerts it raises.
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from services.sensor_service import build_sensor_document, VECTOR_FIELDS
+
+HOST = os.getenv("LINE_PROTOCOL_HOST", "0.0.0.0")
+TCP_PORT = int(os.getenv("LINE_PROTOCOL_TCP_PORT", "0"))
+UDP_PORT = int(os.getenv("LINE_PROTOCOL_UDP_PORT", "0"))
+BATCH_SIZE = int(os.getenv("LINE_PROTOCOL_BATCH_SIZE", "500"))
+BATCH_MS = int(os.getenv("LINE_PROTOCOL_BATCH_MS", "50"))
+QUEUE_SIZE = int(os.getenv("LINE_PROTOCOL_QUEUE_SIZE", "10000"))
+# Lines a single TCP connection may have waiting for the database before we
+# stop reading from its socket
+CONNECTION_PENDING = int(os.getenv("LINE_PROTOCOL_CONNECTION_PENDING", "1000"))
+MAX_LINE = 4096
+# How long stop() waits for connections to close and queued lines to be stored
+STOP_SECONDS = float(os.getenv("LINE_PROTOCOL_STOP_SECONDS", "5"))
+
+stats = {
+    "accepted": 0,
+    "dropped": 0,
+    "rejected": 0,
+    "rate_limited": 0,
+    "invalid": 0,
+    "batches": 0,
+    "connections": 0,
+}
+
+def _parse_value(raw: str) -> Any:
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        return raw[1:-1]
+    try:
+        return int(raw)
+    except ValueError:
+        return float(raw)
+
+def parse_line(line: str) -> Dict[str, Any]:
+    """Parse one line into the same storage dict as the JSON ingest."""
+    parts = line.strip().split(" ", 2)
+    if len(parts) != 3:
+        raise ValueError("Expected '<sensor_id> <timestamp> <fields>'")
+    sensor_id, timestamp, field_set = parts
+
+    data = {"sensor_id": sensor_id}
+    if timestamp != "-":
+        try:
+            data["timestamp"] = float(timestamp)
+        except ValueError:
+            data["timestamp"] = timestamp
+
+    lat = lon = None
+    for pair in field_set.split(","):
+        key, sep, raw = pair.partition("=")
+        if not sep or not key:
+            raise ValueError(f"Bad field '{pair}'")
+        value = _parse_value(raw)
+        field, _, axis = key.partition(".")
+        if field in VECTOR_FIELDS and axis in ("x", "y", "z"):
+            data.setdefault(field, {"x": None, "y": None, "z": None})[axis] = value
+        elif key == "lat":
+            lat = value
+        elif key == "lon":
+            lon = value
+        else:
+            data[key] = value
+    if lat is not None and lon is not None:
+        data["position"] = f"{lat}, {lon}"
+
+    return build_sensor_document(data)
+
+class LineListener:
+    def __init__(self, host: str = HOST, tcp_port: int = TCP_PORT, udp_port: int = UDP_PORT):
+        self.host = host
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+        self.queue: Optional[asyncio.Queue] = None
+        self.tcp_server = None
+        self.udp_transport = None
+        self.batcher = None
+        self.writers = set()
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.batcher = asyncio.create_task(self._run_batches())
+        if self.tcp_port:
+            self.tcp_server = await asyncio.start_server(self._handle_tcp, self.host, self.tcp_port, limit=MAX_LINE)
+            print(f"Line protocol TCP listener on {self.host}:{self.tcp_port}")
+        if self.udp_port:
+            loop = asyncio.get_running_loop()
+            self.udp_transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UdpProtocol(self), local_addr=(self.host, self.udp_port)
+            )
+            print(f"Line protocol UDP listener on {self.host}:{self.udp_port}")
+        return self
+
+    async def stop(self):
+        if self.tcp_server:
+            self.tcp_server.close()
+            # Open connections would keep wait_closed() waiting on idle devices
+            for writer in list(self.writers):
+                writer.close()
+            try:
+                await asyncio.wait_for(self.tcp_server.wait_closed(), STOP_SECONDS)
+            except asyncio.TimeoutError:
+                print("Line protocol TCP connections did not close in time")
+        if self.udp_transport:
+            self.udp_transport.close()
+        if self.batcher:
+            # Let the batcher flush what is already queued
+            try:
+                await asyncio.wait_for(self.queue.join(), STOP_SECONDS)
+            except asyncio.TimeoutError:
+                print(f"Line protocol stopped with {self.queue.qsize()} lines not stored")
+            self.batcher.cancel()
+
+    def _parse(self, line: bytes) -> Optional[Dict[str, Any]]:
+        try:
+            return parse_line(line.decode())
+        except (ValueError, OverflowError):
+            stats["invalid"] += 1
+            return None
+
+    def submit_nowait(self, line: bytes):
+        """UDP path: no way to slow the sender down, so drop when full."""
+        reading = self._parse(line)
+        if reading is None:
+            return
+        try:
+            self.queue.put_nowait((reading, None))
+        except asyncio.QueueFull:
+            stats["dropped"] += 1
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        stats["connections"] += 1
+        self.writers.add(writer)
+        pending = asyncio.Semaphore(CONNECTION_PENDING)
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    line = e.partial
+                    if not line:
+                        break
+                except asyncio.LimitOverrunError:
+                    stats["invalid"] += 1
+                    break
+                if not line.strip():
+                    continue
+                reading = self._parse(line)
+                if reading is None:
+                    continue
+                # Stops reading this socket (TCP flow control pushes back on
+                # the device) once it has too many lines in flight
+                await pending.acquire()
+                await self.queue.put((reading, pending))
+        except ConnectionError:
+            pass
+        finally:
+            stats["connections"] -= 1
+            self.writers.discard(writer)
+            writer.close()
+
+    async def _run_batches(self):
+        from services.ingest_service import ingest_readings
+
+        while True:
+            items = [await self.queue.get()]
+            deadline = time.monotonic() + BATCH_MS / 1000
+            while len(items) < BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                # pymongo is blocking, keep it off the event loop
+                results = await asyncio.to_thread(ingest_readings, [reading for reading, _ in items])
+                accepted = sum(1 for result in results if result is not None and "id" in result)
+                rate_limited = sum(1 for result in results if result is not None and "rate_limited" in result)
+                stats["accepted"] += accepted
+                stats["rate_limited"] += rate_limited
+                stats["rejected"] += len(results) - accepted - rate_limited
+                stats["batches"] += 1
+            except Exception as e:
+                print(f"Line protocol batch of {len(items)} failed: {e}")
+                stats["dropped"] += len(items)
+            finally:
+                for _, pending in items:
+                    if pending is not None:
+                        pending.release()
+                    self.queue.task_done()
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, listener: LineListener):
+        self.listener = listener
+
+    def datagram_received(self, data: bytes, addr):
+        # A datagram may carry several lines
+        for line in data.splitlines():
+            if line.strip():
+                self.listener.submit_nowait(line)
+
+def enabled() -> bool:
+    return bool(TCP_PORT or UDP_PORT)
+
+async def serve_forever():
+    import database
+    from services import alert_shards, delivery_service, ingest_service, rate_limiter, write_behind
+
+    database.setup_mongodb()
+    if alert_shards.enabled():
+        alert_shards.start(ingest_service.HISTORY_SIZE)
+    if write_behind.enabled():
+        write_behind.get_log()
+    release = asyncio.create_task(rate_limiter.release_periodically())
+    delivery_service.start()
+    digests = asyncio.create_task(delivery_service.send_digests_periodically())
+    listener = await LineListener(tcp_port=TCP_PORT or 8094, udp_port=UDP_PORT or 8094).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await listener.stop()
+        release.cancel()
+        digests.cancel()
+        delivery_service.stop()
+        write_behind.close_log()
+        alert_shards.stop()
+
+if __name__ == "__main__":
+    asyncio.run(serve_forever())
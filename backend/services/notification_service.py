@@ -0,0 +1,93 @@
+# Unread notification counters.
+#
+# One notification_counters document per user keeps the number of unread
+# notifications, split by severity (alert_type) and by sensor. They are
+# $inc'd whenever notifications are inserted or removed so the UI badge is a
+# single indexed read. rebuild_counters recomputes them from the
+# notifications collection to repair any drift (bulk deletes, crashes).
+import asyncio
+import os
+from collections import defaultdict
+from typing import List, Dict, Any, Optional
+
+from pymongo import UpdateOne, ReplaceOne
+from database import notification_collection, notification_counters_collection, notification_counters_reads
+
+RECONCILE_MINUTES = int(os.getenv("NOTIFICATION_RECONCILE_MINUTES", "60"))
+
+def _empty_summary() -> Dict[str, Any]:
+    return {"unread": 0, "by_severity": {}, "by_sensor": {}}
+
+def count_created(notifications: List[Dict[str, Any]], sign: int = 1):
+    """Apply the unread counter changes for inserted (or removed, sign=-1) notifications."""
+    increments = defaultdict(lambda: defaultdict(int))
+    for notification in notifications:
+        if notification.get("read"):
+            continue
+        user = increments[notification["user_id"]]
+        user["unread"] += sign
+        user[f"by_severity.{notification['alert_type']}"] += sign
+        user[f"by_sensor.{notification['sensor_id']}"] += sign
+    if increments:
+        notification_counters_collection.bulk_write(
+            [UpdateOne({"user_id": user_id}, {"$inc": dict(fields)}, upsert=True) for user_id, fields in increments.items()],
+            ordered=False
+        )
+
+def count_removed(notification: Optional[Dict[str, Any]]):
+    if notification:
+        count_created([notification], sign=-1)
+
+def get_summary(user_id: str) -> Dict[str, Any]:
+    counters = notification_counters_reads.find_one({"user_id": user_id}, {"_id": 0, "user_id": 0})
+    if not counters:
+        return _empty_summary()
+    # Zeroed entries stay behind after $inc, hide them
+    return {
+        "unread": max(counters.get("unread", 0), 0),
+        "by_severity": {key: value for key, value in counters.get("by_severity", {}).items() if value > 0},
+        "by_sensor": {key: value for key, value in counters.get("by_sensor", {}).items() if value > 0},
+    }
+
+def rebuild_counters(user_id: Optional[str] = None) -> int:
+    """Recompute counters from the notifications collection (one user or all).
+
+    Returns the number of counter documents written."""
+    match = {"read": False}
+    if user_id:
+        match["user_id"] = user_id
+    summaries = defaultdict(_empty_summary)
+    for row in notification_collection.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "sensor_id": "$sensor_id", "alert_type": "$alert_type"},
+            "count": {"$sum": 1}
+        }},
+    ]):
+        key = row["_id"]
+        summary = summaries[key["user_id"]]
+        summary["unread"] += row["count"]
+        summary["by_severity"][key["alert_type"]] = summary["by_severity"].get(key["alert_type"], 0) + row["count"]
+        summary["by_sensor"][key["sensor_id"]] = summary["by_sensor"].get(key["sensor_id"], 0) + row["count"]
+
+    if user_id:
+        summaries[user_id]  # A user with nothing unread still gets zeroed
+    else:
+        notification_counters_collection.delete_many({"user_id": {"$nin": list(summaries)}})
+
+    if summaries:
+        notification_counters_collection.bulk_write(
+            [ReplaceOne({"user_id": user}, {"user_id": user, **summary}, upsert=True) for user, summary in summaries.items()],
+            ordered=False
+        )
+    return len(summaries)
+
+async def reconcile_periodically():
+    """Rebuild all counters at startup (seeds existing deployments) and then
+    every NOTIFICATION_RECONCILE_MINUTES."""
+    while True:
+        try:
+            await asyncio.to_thread(rebuild_counters)
+        except Exception as e:
+            print(f"Notification counter reconcile failed: {e}")
+        await asyncio.sleep(RECONCILE_MINUTES * 60)
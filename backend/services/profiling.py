@@ -0,0 +1,246 @@
+# On-demand profiling of a running API worker, off unless PROFILING_ENABLED=1.
+#
+# Three tools, all answered by the worker process that handles the request
+# (the response carries its pid, with several uvicorn workers repeat until
+# the one of interest answers):
+#   sample()        a statistical stack sampler: a thread reads every other
+#                   thread's stack from sys._current_frames() every
+#                   interval_ms for N seconds and counts them as collapsed
+#                   stacks ("thread;module:function:line;..." count), the
+#                   input format of flamegraph.pl and speedscope
+#   per request     requests to PROFILING_ROUTES with the header
+#                   X-Profile: <PROFILING_TOKEN> run their blocking part under
+#                   cProfile; the response's X-Profile-Id fetches the result
+#                   as pstats, text or collapsed stacks
+#   tracemalloc     start/stop tracing allocations and take snapshots, the
+#                   top allocation sites, optionally compared with the
+#                   previous snapshot
+import contextvars
+import cProfile
+import hmac
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, Any, List, Optional, Callable
+
+from fastapi import Request
+
+ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# Per-request profiling is off while PROFILING_TOKEN is unset
+TOKEN = os.getenv("PROFILING_TOKEN")
+ROUTES = [route for route in os.getenv("PROFILING_ROUTES", "/api/receive-sensor-data,/api/receive-sensor-data/binary").split(",") if route]
+KEEP = int(os.getenv("PROFILING_KEEP", "20"))
+MAX_SECONDS = 120
+MAX_DEPTH = 64
+# Bounds for tracemalloc's traceback depth and the rows of a report
+MAX_FRAMES = 100
+MAX_LIMIT = 1000
+
+## Stack sampler
+
+_sampling = threading.Lock()
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+def sample(seconds: float, interval_ms: float = 5) -> Dict[str, Any]:
+    """Sample every thread of this process; blocks for seconds.
+
+    Raises RuntimeError when a sampling run is already in progress."""
+    if not _sampling.acquire(blocking=False):
+        raise RuntimeError("A sampling run is already in progress")
+    try:
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        interval = interval_ms / 1000
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        return {"pid": os.getpid(), "seconds": seconds, "interval_ms": interval_ms, "samples": samples, "stacks": stacks}
+    finally:
+        _sampling.release()
+
+def collapsed(stacks: Dict[str, float]) -> str:
+    """flamegraph.pl / speedscope collapsed stack lines, biggest first."""
+    return "".join(f"{stack} {round(count)}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]) if round(count) > 0)
+
+## Per-request cProfile
+
+_current: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("profile", default=None)
+_profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_profiles_lock = threading.Lock()
+
+def requested(request: Request) -> bool:
+    return (
+        ENABLED and bool(TOKEN) and request.url.path in ROUTES
+        and hmac.compare_digest(request.headers.get("x-profile", "").encode(), TOKEN.encode())
+    )
+
+async def profile_requests(request: Request, call_next):
+    """HTTP middleware: profile the requests that ask for it with X-Profile."""
+    if not requested(request):
+        return await call_next(request)
+    profile = {"profile_id": str(uuid.uuid4()), "path": request.url.path, "pid": os.getpid(), "started_at": time.time(), "profilers": []}
+    token = _current.set(profile)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+        profile["wall_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        with _profiles_lock:
+            _profiles[profile["profile_id"]] = profile
+            while len(_profiles) > KEEP:
+                _profiles.popitem(last=False)
+    response.headers["X-Profile-Id"] = profile["profile_id"]
+    return response
+
+def call(func: Callable, *args, **kwargs):
+    """Run func, under cProfile when the current request is being profiled.
+
+    Meant for the blocking part a route hands to asyncio.to_thread, which
+    copies the request's context into the thread."""
+    profile = _current.get()
+    if profile is None:
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profile["profilers"].append(profiler)
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    return _profiles.get(profile_id)
+
+def list_profiles() -> List[Dict[str, Any]]:
+    return [
+        {key: value for key, value in profile.items() if key != "profilers"}
+        for profile in reversed(_profiles.values())
+    ]
+
+def profile_stats(profile: Dict[str, Any]) -> Optional[pstats.Stats]:
+    if not profile["profilers"]:
+        return None
+    stats = pstats.Stats(profile["profilers"][0])
+    for profiler in profile["profilers"][1:]:
+        stats.add(profiler)
+    return stats
+
+def pstats_bytes(stats: pstats.Stats) -> bytes:
+    """The file format of Profile.dump_stats, for pstats, snakeviz or gprof2dot."""
+    return marshal.dumps(stats.stats)
+
+def pstats_text(stats: pstats.Stats, sort: str = "cumulative", limit: int = 50) -> str:
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+def _function_name(func) -> str:
+    filename, line, name = func
+    return f"{os.path.basename(filename)}:{name}:{line}" if line else name
+
+def stats_collapsed(stats: pstats.Stats) -> Dict[str, float]:
+    """Collapsed stacks (microseconds) rebuilt from cProfile's caller graph.
+
+    cProfile keeps caller -> callee edges, not whole stacks, so a function's
+    time is split over the paths leading to it in proportion to the time
+    each caller spent in it."""
+    raw = stats.stats
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, caller_stats in callers.items():
+            callees[caller].append((func, caller_stats[3]))
+    result: Dict[str, float] = defaultdict(float)
+
+    def walk(func, path: List[str], seen: set, share: float):
+        _, _, self_time, cumulative, _ = raw[func]
+        key = ";".join(path)
+        result[key] += self_time * share * 1e6
+        if len(path) >= MAX_DEPTH:
+            return
+        for callee, time_from_here in callees.get(func, []):
+            if callee in seen or callee not in raw or not raw[callee][3]:
+                continue
+            # share of this path in func's time, times func's share of callee's time
+            callee_share = share * (time_from_here / raw[callee][3])
+            if callee_share * raw[callee][3] * 1e6 < 1:
+                continue
+            walk(callee, path + [_function_name(callee)], seen | {callee}, callee_share)
+
+    for func, (_, _, _, _, callers) in raw.items():
+        if not callers:
+            walk(func, [_function_name(func)], {func}, 1.0)
+    return result
+
+## tracemalloc
+
+_snapshots: Dict[str, Any] = {"previous": None}
+
+def tracemalloc_start(frames: int = 25) -> Dict[str, Any]:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        _snapshots["previous"] = None
+    return tracemalloc_status()
+
+def tracemalloc_stop() -> Dict[str, Any]:
+    tracemalloc.stop()
+    _snapshots["previous"] = None
+    return tracemalloc_status()
+
+def tracemalloc_status() -> Dict[str, Any]:
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {
+        "pid": os.getpid(),
+        "tracing": tracemalloc.is_tracing(),
+        "frames": tracemalloc.get_traceback_limit(),
+        "current_bytes": current,
+        "peak_bytes": peak,
+    }
+
+def tracemalloc_snapshot(group_by: str = "lineno", limit: int = 30, compare: bool = False) -> Dict[str, Any]:
+    """Top allocation sites now, or their growth since the previous snapshot.
+
+    Raises RuntimeError while tracemalloc is not tracing."""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not tracing, start it first")
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    previous = _snapshots["previous"]
+    _snapshots["previous"] = snapshot
+
+    if compare and previous is not None:
+        top = snapshot.compare_to(previous, group_by)[:limit]
+        entries = [
+            {"site": stat.traceback.format(), "size_bytes": stat.size, "size_diff_bytes": stat.size_diff, "count": stat.count, "count_diff": stat.count_diff}
+            for stat in top
+        ]
+    else:
+        top = snapshot.statistics(group_by)[:limit]
+        entries = [{"site": stat.traceback.format(), "size_bytes": stat.size, "count": stat.count} for stat in top]
+    return {**tracemalloc_status(), "group_by": group_by, "compared": bool(compare and previous is not None), "top": entries}
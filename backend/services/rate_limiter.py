@@ -0,0 +1,230 @@
+# In-process token-bucket rate limits for ingest, keyed by sensor_id and by
+# the sensor's owner.
+#
+# Each sensor can override the defaults through "rate_limit" on its sensor
+# document: {"rate": readings per second, "burst": bucket size,
+# "policy": "reject" | "keep_latest" | "aggregate"}.
+#   reject       over-limit readings are refused (HTTP 429 with Retry-After)
+#   keep_latest  only the newest over-limit reading is kept and stored once
+#                the sensor has tokens again
+#   aggregate    over-limit readings are averaged into one reading that is
+#                stored once the sensor has tokens again
+# A rate of 0 means no limit, a burst has to be at least 1.
+#
+# Every reading takes a token. The readings of one sensor that arrive
+# together (a multi-reading binary frame, a line protocol micro-batch, an
+# ingest_readings call) are charged in one take: the oldest ones that fit
+# in the bucket are admitted and the rest share the policy's verdict.
+#
+# Limits are per API process, with several uvicorn workers each one enforces
+# them separately.
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+SENSOR_RATE = float(os.getenv("SENSOR_RATE_LIMIT", "10"))
+SENSOR_BURST = float(os.getenv("SENSOR_RATE_BURST", "20"))
+OWNER_RATE = float(os.getenv("OWNER_RATE_LIMIT", "200"))
+OWNER_BURST = float(os.getenv("OWNER_RATE_BURST", "400"))
+DEFAULT_POLICY = os.getenv("RATE_LIMIT_POLICY", "reject")
+IDLE_SECONDS = 600
+
+POLICIES = ("reject", "keep_latest", "aggregate")
+
+stats = {
+    "admitted": 0,
+    "dropped": 0,
+    "coalesced": 0,
+    "released": 0,
+}
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def available(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= 1
+
+    def take(self, count: int = 1):
+        self.tokens -= count
+
+    def retry_after(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+def validate_rate_limit(config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Check a sensor's rate_limit setting, raises ValueError when it is wrong."""
+    if config is None:
+        return None
+    if not isinstance(config, dict):
+        raise ValueError("rate_limit must be an object")
+    cleaned = {}
+    for key, minimum in (("rate", 0), ("burst", 1)):
+        if key in config:
+            value = config[key]
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not value >= minimum:
+                raise ValueError(f"rate_limit.{key} must be a number >= {minimum}")
+            cleaned[key] = float(value)
+    if "policy" in config:
+        if config["policy"] not in POLICIES:
+            raise ValueError(f"rate_limit.policy must be one of {', '.join(POLICIES)}")
+        cleaned["policy"] = config["policy"]
+    return cleaned
+
+def _average(held: Dict[str, Any], reading: Dict[str, Any]):
+    """Fold reading into the running average kept in held."""
+    count = held.get("coalesced_count", 1)
+    for key, value in reading["readings"].items():
+        current = held["readings"].get(key)
+        if isinstance(value, (int, float)) and isinstance(current, (int, float)):
+            held["readings"][key] = current + (value - current) / (count + 1)
+        elif isinstance(value, dict) and isinstance(current, dict):
+            for axis, axis_value in value.items():
+                if isinstance(axis_value, (int, float)) and isinstance(current.get(axis), (int, float)):
+                    current[axis] = current[axis] + (axis_value - current[axis]) / (count + 1)
+                else:
+                    current[axis] = axis_value
+        else:
+            held["readings"][key] = value
+    for key in ("timestamp", "status", "location"):
+        if key in reading:
+            held[key] = reading[key]
+    held["coalesced_count"] = count + 1
+
+class RateLimiter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sensor_buckets: Dict[str, TokenBucket] = {}
+        self.owner_buckets: Dict[str, TokenBucket] = {}
+        self.held: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        self.per_sensor: Dict[str, Dict[str, int]] = {}
+        self.limited_at: Dict[str, float] = {}
+
+    def _sensor_bucket(self, sensor: Dict[str, Any]) -> Optional[TokenBucket]:
+        config = sensor.get("rate_limit") or {}
+        rate = config.get("rate", SENSOR_RATE)
+        burst = config.get("burst", max(SENSOR_BURST, 1))
+        if not rate:
+            return None
+        bucket = self.sensor_buckets.get(sensor["sensor_id"])
+        if bucket is None or bucket.rate != rate or bucket.burst != burst:
+            bucket = self.sensor_buckets[sensor["sensor_id"]] = TokenBucket(rate, burst)
+        return bucket
+
+    def _owner_bucket(self, owner_id: str) -> Optional[TokenBucket]:
+        if not OWNER_RATE:
+            return None
+        bucket = self.owner_buckets.get(owner_id)
+        if bucket is None:
+            bucket = self.owner_buckets[owner_id] = TokenBucket(OWNER_RATE, max(OWNER_BURST, 1))
+        return bucket
+
+    def _count(self, sensor_id: str, key: str, now: float, count: int = 1):
+        stats[key] += count
+        counts = self.per_sensor.setdefault(sensor_id, {"dropped": 0, "coalesced": 0})
+        counts[key] += count
+        self.limited_at[sensor_id] = now
+
+    def _take(self, buckets, now: float, count: int = 1) -> Tuple[int, Optional[float]]:
+        """Take up to count tokens from every bucket at once, as many as all of
+        them have. Returns how many, and the wait for the next token when
+        that is fewer than count."""
+        buckets = [bucket for bucket in buckets if bucket is not None]
+        for bucket in buckets:
+            bucket.refill(now)
+        granted = min([count] + [int(bucket.tokens) for bucket in buckets])
+        for bucket in buckets:
+            bucket.take(granted)
+        if granted == count:
+            return granted, None
+        return granted, max(bucket.retry_after() for bucket in buckets if bucket.tokens < 1)
+
+    def admit(self, sensor: Dict[str, Any], reading: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """None when the reading may be stored now, otherwise what happened to it:
+        {"rate_limited": "rejected", "retry_after": seconds} or {"rate_limited": "coalesced"}."""
+        return self.admit_many(sensor, [reading])[1]
+
+    def admit_many(self, sensor: Dict[str, Any], readings: List[Dict[str, Any]]) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """admit() for readings of one sensor that arrived together, oldest first.
+
+        Returns how many of the first readings may be stored now and the
+        verdict for the others (None when all were admitted)."""
+        sensor_id = sensor["sensor_id"]
+        policy = (sensor.get("rate_limit") or {}).get("policy", DEFAULT_POLICY)
+        with self.lock:
+            now = time.monotonic()
+            admitted, wait = self._take([self._sensor_bucket(sensor), self._owner_bucket(sensor["owner_id"])], now, len(readings))
+            stats["admitted"] += admitted
+            if wait is None:
+                return admitted, None
+
+            over = readings[admitted:]
+            if policy == "reject":
+                self._count(sensor_id, "dropped", now, len(over))
+                return admitted, {"rate_limited": "rejected", "retry_after": wait}
+
+            for reading in over:
+                held = self.held.get(sensor_id)
+                if held is None or policy == "keep_latest":
+                    # Stored as is until tokens come back, the newest one wins
+                    values = {key: dict(value) if isinstance(value, dict) else value for key, value in reading["readings"].items()}
+                    self.held[sensor_id] = (sensor, {**reading, "readings": values})
+                else:
+                    _average(held[1], reading)
+            self._count(sensor_id, "coalesced", now, len(over))
+            return admitted, {"rate_limited": "coalesced"}
+
+    def release_held(self) -> List[Dict[str, Any]]:
+        """Coalesced readings whose sensor has tokens again, ready to ingest."""
+        released = []
+        with self.lock:
+            now = time.monotonic()
+            for sensor_id, (sensor, reading) in list(self.held.items()):
+                if self._take([self._sensor_bucket(sensor), self._owner_bucket(sensor["owner_id"])], now)[0]:
+                    released.append(reading)
+                    del self.held[sensor_id]
+            stats["released"] += len(released)
+
+            # Forget buckets nobody has used for a while, they would be full anyway
+            for buckets in (self.sensor_buckets, self.owner_buckets):
+                for key, bucket in list(buckets.items()):
+                    if now - bucket.updated > IDLE_SECONDS:
+                        del buckets[key]
+            for sensor_id, limited_at in list(self.limited_at.items()):
+                if now - limited_at > IDLE_SECONDS:
+                    del self.limited_at[sensor_id]
+                    del self.per_sensor[sensor_id]
+        return released
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                **stats,
+                "held": len(self.held),
+                "sensors": {sensor_id: dict(counts) for sensor_id, counts in self.per_sensor.items()},
+            }
+
+limiter = RateLimiter()
+
+async def release_periodically(interval: float = 1.0):
+    """Store coalesced readings as their sensors get tokens back."""
+    from services.ingest_service import ingest_readings
+
+    while True:
+        await asyncio.sleep(interval)
+        released = limiter.release_held()
+        if released:
+            try:
+                await asyncio.to_thread(ingest_readings, released, False)
+            except Exception as e:
+                print(f"Storing {len(released)} coalesced readings failed: {e}")
@@ -0,0 +1,271 @@
+# Storage of sensor readings behind one interface.
+#
+# ReadingStore is what the read routes and ingest history use to get at
+# readings, so they don't depend on where readings live:
+#   MongoReadingStore   the sensor_data collection, what the API runs on
+#   SqliteReadingStore  a local SQLite file in WAL mode, for single-box edge
+#                       gateways that can't spare the RAM for mongod (see
+#                       edge.py): same (sensor_id, timestamp) index, batch
+#                       writes in one transaction per call, and per-minute
+#                       aggregates for syncing upstream
+# Documents come back in the sensor_data shape (sensor_id, timestamp, status,
+# readings, location) with _id as a string, newest first. Timestamps are naive
+# local time, like the ones parse_timestamp gives readings without one.
+#
+# Users, sensors, projects and the rest of the API's collections stay in
+# MongoDB, they rely on Mongo features (leases, $unionWith, TTL and 2dsphere
+# indexes) that have no embedded equivalent here.
+import abc
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+import orjson
+
+class ReadingStore(abc.ABC):
+    @abc.abstractmethod
+    def insert_many(self, readings: List[Dict[str, Any]]) -> int:
+        """Store a batch of readings, returns how many were stored."""
+
+    @abc.abstractmethod
+    def recent(self, sensor_id: str, limit: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """The sensor's newest `limit` readings between start and end."""
+
+    def latest_many(self, sensor_ids: List[str], limit: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """recent() for many sensors at once, keyed by sensor_id (every one present)."""
+        return {sensor_id: self.recent(sensor_id, limit, start, end) for sensor_id in sensor_ids}
+
+    def close(self):
+        pass
+
+def _time_range(start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    return {**({"$gte": start} if start else {}), **({"$lte": end} if end else {})}
+
+class MongoReadingStore(ReadingStore):
+    def __init__(self, collection, reads=None):
+        self.collection = collection
+        # Where recent/latest_many read from, e.g. the dashboard read preference
+        self.reads = reads if reads is not None else collection
+
+    def insert_many(self, readings: List[Dict[str, Any]]) -> int:
+        if readings:
+            self.collection.insert_many(readings, ordered=False)
+        return len(readings)
+
+    def recent(self, sensor_id: str, limit: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        query = {"sensor_id": sensor_id}
+        if start or end:
+            query["timestamp"] = _time_range(start, end)
+        results = list(self.reads.find(query, sort=[("timestamp", -1)], limit=limit))
+        for result in results:
+            result["_id"] = str(result["_id"])
+        return results
+
+    def latest_many(self, sensor_ids: List[str], limit: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, List[Dict[str, Any]]]:
+        match = {"sensor_id": {"$in": sensor_ids}}
+        if start or end:
+            match["timestamp"] = _time_range(start, end)
+        # One pass over the (sensor_id, timestamp) index, the newest `limit` per
+        # sensor. $topN keeps every matching reading in view, callers bound the
+        # time range
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": "$sensor_id",
+                "readings": {"$topN": {"n": limit, "sortBy": {"timestamp": -1}, "output": "$$ROOT"}},
+            }},
+        ]
+        readings = {sensor_id: [] for sensor_id in sensor_ids}
+        for group in self.reads.aggregate(pipeline):
+            for reading in group["readings"]:
+                reading["_id"] = str(reading["_id"])
+            readings[group["_id"]] = group["readings"]
+        return readings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    sensor_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    status TEXT,
+    readings TEXT NOT NULL,
+    location TEXT
+);
+CREATE INDEX IF NOT EXISTS readings_sensor_ts ON readings (sensor_id, ts DESC);
+CREATE INDEX IF NOT EXISTS readings_ts ON readings (ts);
+CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value);
+"""
+
+def _epoch(value: datetime) -> float:
+    # Naive datetimes are local time, as datetime.now() in parse_timestamp
+    return value.timestamp()
+
+# One step of a json_tree fullkey: .name, ."quoted name" (JSON string escapes) or [index]
+_JSON_STEP = re.compile(r'\.(?:("(?:[^"\\]|\\.)*")|([^.\[]+))|(\[\d+\])')
+
+def _field_path(fullkey: str) -> str:
+    """'$.accelerometer.x' -> 'accelerometer.x', '$."my field"' -> 'my field'."""
+    parts = []
+    for quoted, name, index in _JSON_STEP.findall(fullkey[1:]):
+        if index and parts:
+            parts[-1] += index
+        else:
+            parts.append(json.loads(quoted) if quoted else name or index)
+    return ".".join(parts)
+
+class SqliteReadingStore(ReadingStore):
+    """Readings in a SQLite file, WAL mode: one writer, readers never block it."""
+
+    def __init__(self, path: str, cache_mb: int = 8):
+        self.path = path
+        self.cache_mb = cache_mb
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Durable at checkpoints, a power cut loses at most the last commits
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA cache_size=-{self.cache_mb * 1024}")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        return connection
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def insert_many(self, readings: List[Dict[str, Any]]) -> int:
+        rows = [
+            (
+                reading["sensor_id"],
+                _epoch(reading["timestamp"]),
+                reading.get("status"),
+                orjson.dumps(reading.get("readings", {})).decode(),
+                orjson.dumps(reading["location"]).decode() if reading.get("location") else None,
+            )
+            for reading in readings
+        ]
+        with self._write_lock:
+            self._writer.execute("BEGIN")
+            try:
+                self._writer.executemany("INSERT INTO readings (sensor_id, ts, status, readings, location) VALUES (?, ?, ?, ?, ?)", rows)
+                self._writer.execute("COMMIT")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    @staticmethod
+    def _document(row: Tuple) -> Dict[str, Any]:
+        reading_id, sensor_id, ts, status, readings, location = row
+        document = {
+            "_id": str(reading_id),
+            "sensor_id": sensor_id,
+            "timestamp": datetime.fromtimestamp(ts),
+            "status": status,
+            "readings": orjson.loads(readings),
+        }
+        if location:
+            document["location"] = orjson.loads(location)
+        return document
+
+    def recent(self, sensor_id: str, limit: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT id, sensor_id, ts, status, readings, location FROM readings WHERE sensor_id = ?"
+        params: List[Any] = [sensor_id]
+        if start:
+            sql += " AND ts >= ?"
+            params.append(_epoch(start))
+        if end:
+            sql += " AND ts <= ?"
+            params.append(_epoch(end))
+        sql += " ORDER BY ts DESC LIMIT ?"
+        params.append(limit)
+        return [self._document(row) for row in self._reader().execute(sql, params)]
+
+    # latest_many is one indexed LIMIT query per sensor, in process that is
+    # cheaper than a window function over every reading of the sensors
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT count(*) FROM readings").fetchone()[0]
+
+    def sensor_ids(self) -> List[str]:
+        return [row[0] for row in self._reader().execute("SELECT DISTINCT sensor_id FROM readings")]
+
+    def get_state(self, name: str, default: Any = None) -> Any:
+        row = self._reader().execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_state(self, name: str, value: Any):
+        with self._write_lock:
+            self._writer.execute("INSERT INTO sync_state (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value", (name, value))
+
+    def last_id(self) -> int:
+        return self._reader().execute("SELECT coalesce(max(id), 0) FROM readings").fetchone()[0]
+
+    def minute_aggregates(self, after_id: int, upto_id: int, bucket_seconds: int = 60) -> List[Dict[str, Any]]:
+        """Per sensor and bucket count/sum/min/max of every numeric field.
+
+        Covers the buckets that readings after_id < id <= upto_id fall into,
+        recomputed over all their readings, so a bucket sent again (still
+        open, or a late reading arrived) replaces the earlier one upstream."""
+        touched = """
+            WITH touched AS (
+                SELECT DISTINCT sensor_id, CAST(ts / :width AS INTEGER) AS bucket
+                FROM readings WHERE id > :after AND id <= :upto
+            )
+        """
+        joined = """
+            FROM touched t JOIN readings r
+              ON r.sensor_id = t.sensor_id AND r.ts >= t.bucket * :width AND r.ts < (t.bucket + 1) * :width
+        """
+        params = {"after": after_id, "upto": upto_id, "width": bucket_seconds}
+        reader = self._reader()
+        buckets: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        for sensor_id, bucket, count in reader.execute(f"{touched} SELECT t.sensor_id, t.bucket, count(*) {joined} GROUP BY 1, 2", params):
+            buckets[(sensor_id, bucket)] = {
+                "sensor_id": sensor_id,
+                # Aware, the upstream API may not share the gateway's time zone
+                "start": datetime.fromtimestamp(bucket * bucket_seconds, tz=timezone.utc),
+                "seconds": bucket_seconds,
+                "count": count,
+                "fields": {},
+            }
+        rows = reader.execute(f"""
+            {touched}
+            SELECT t.sensor_id, t.bucket, j.fullkey, count(*), sum(j.value), min(j.value), max(j.value)
+            {joined}, json_tree(r.readings) j
+            WHERE j.type IN ('integer', 'real')
+            GROUP BY 1, 2, 3
+        """, params)
+        for sensor_id, bucket, path, count, total, minimum, maximum in rows:
+            buckets[(sensor_id, bucket)]["fields"][_field_path(path)] = {"count": count, "sum": total, "min": minimum, "max": maximum}
+        return list(buckets.values())
+
+    def prune(self, before: datetime, upto_id: int) -> int:
+        """Delete readings older than before, only those already synced (id <= upto_id)."""
+        with self._write_lock:
+            return self._writer.execute("DELETE FROM readings WHERE ts < ? AND id <= ?", (_epoch(before), upto_id)).rowcount
+
+    def close(self):
+        self._writer.close()
+
+_stores: Dict[bool, MongoReadingStore] = {}
+
+def get_store(reads: bool = False) -> MongoReadingStore:
+    """The API's readings store; reads=True reads with the dashboard read preference."""
+    store = _stores.get(reads)
+    if store is None:
+        from database import sensor_data_collection, sensor_data_reads
+        store = _stores[reads] = MongoReadingStore(sensor_data_collection, sensor_data_reads if reads else None)
+    return store
@@ -0,0 +1,337 @@
+# Historical replay and re-classification.
+#
+# After the alert thresholds change, the alerts saved on sensor_data (and the
+# latest ones mirrored on sensors.alerts) are stale. replay_history streams a
+# sensor's stored readings oldest first, classifies each one against the
+# readings before it exactly like ingest does, and bulk writes back the
+# alerts that changed. replay_file feeds a CSV/XLSX file in the algorithm.py
+# format (one column per reading field) through the same pipeline and stores
+# it as new readings. Sensors (or files) are spread over a process pool, one
+# sensor per task, so every sensor's readings stay in timestamp order.
+#
+# Notifications are either left alone ("suppress") or deleted for the
+# replayed range and rebuilt from the new alerts ("regenerate").
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Callable
+
+from pymongo import UpdateOne
+from services.sensor_service import classify_alert, build_notifications
+from services.ingest_service import HISTORY_SIZE
+from services.notification_service import rebuild_counters
+from services.response_cache import bump_many
+from services import sketch_service
+from database import sensors_collection, sensor_data_collection, notification_collection
+
+BATCH_SIZE = int(os.getenv("REPLAY_BATCH_SIZE", "1000"))
+WORKERS = int(os.getenv("REPLAY_WORKERS", str(os.cpu_count() or 1)))
+NOTIFICATION_MODES = ("suppress", "regenerate")
+
+# Replays started from the admin API, by job_id. Not persisted, a replay
+# is idempotent so an interrupted one is simply started again
+jobs: Dict[str, Dict[str, Any]] = {}
+
+class Pacer:
+    """Sleeps between readings so they play back at speed x real time (0 = as fast as possible)."""
+
+    def __init__(self, speed: float = 0):
+        self.speed = speed
+        self.previous = None
+
+    def wait(self, timestamp: datetime):
+        if self.speed and self.previous is not None:
+            gap = (timestamp - self.previous).total_seconds() / self.speed
+            if gap > 0:
+                time.sleep(gap)
+        self.previous = timestamp
+
+class Batch:
+    """Buffers alert updates, new readings and notifications into bulk writes."""
+
+    def __init__(self, dry_run: bool):
+        self.dry_run = dry_run
+        self.updates = []
+        self.documents = []
+        self.notifications = []
+
+    def add(self, update=None, document=None, notifications=()):
+        if update is not None:
+            self.updates.append(update)
+        if document is not None:
+            self.documents.append(document)
+        self.notifications.extend(notifications)
+        if max(len(self.updates), len(self.documents), len(self.notifications)) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.dry_run:
+            if self.updates:
+                sensor_data_collection.bulk_write(self.updates, ordered=False)
+            if self.documents:
+                sensor_data_collection.insert_many(self.documents, ordered=False)
+                sketch_service.record(self.documents)
+            if self.notifications:
+                notification_collection.insert_many(self.notifications, ordered=False)
+        self.updates, self.documents, self.notifications = [], [], []
+
+def validate_options(notifications: str = "suppress", speed: float = 0):
+    if notifications not in NOTIFICATION_MODES:
+        raise ValueError(f"notifications must be one of {', '.join(NOTIFICATION_MODES)}")
+    if speed < 0:
+        raise ValueError("speed must be 0 (unpaced) or a positive factor")
+
+def _seed_history(sensor_id: str, before: Optional[datetime]) -> List[Dict[str, Any]]:
+    # The readings ingest would have used as history for the first replayed one
+    if before is None:
+        return []
+    return list(sensor_data_collection.find(
+        {"sensor_id": sensor_id, "timestamp": {"$lt": before}},
+        {"readings": 1}
+    ).sort("timestamp", -1).limit(HISTORY_SIZE))
+
+def _classify(sensor: Dict[str, Any], reading: Dict[str, Any], history: List[Dict[str, Any]], regenerate: bool):
+    alerts = classify_alert(reading, history, sensor.get("baseline"))
+    history.insert(0, reading)
+    del history[HISTORY_SIZE:]
+    if not regenerate:
+        return alerts, []
+    # Same embedded copy as at ingest, dated when the reading was taken
+    # rather than now so old alerts don't jump to the top of the list
+    sensor_data = {key: value for key, value in reading.items() if key != "_id"}
+    sensor_data["alerts"] = alerts
+    notifications = build_notifications(sensor, sensor_data, alerts)
+    for notification in notifications:
+        notification["timestamp"] = reading["timestamp"]
+    return alerts, notifications
+
+def _time_range(start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    time_range = {}
+    if start:
+        time_range["$gte"] = start
+    if end:
+        time_range["$lte"] = end
+    return time_range
+
+def replay_history(
+    sensor_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    notifications: str = "suppress",
+    speed: float = 0,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """Re-classify a sensor's stored readings between start and end."""
+    summary = {"sensor_id": sensor_id, "readings": 0, "changed": 0, "notifications": 0, "removed_notifications": 0}
+    sensor = sensors_collection.find_one({"sensor_id": sensor_id})
+    if not sensor:
+        return {**summary, "error": "Sensor not registered"}
+    summary["owner_id"] = sensor["owner_id"]
+
+    regenerate = notifications == "regenerate"
+    query = {"sensor_id": sensor_id}
+    time_range = _time_range(start, end)
+    if time_range:
+        query["timestamp"] = time_range
+
+    if regenerate and not dry_run:
+        notification_query = {"sensor_id": sensor_id}
+        if time_range:
+            notification_query["data.sensor_data.timestamp"] = time_range
+        summary["removed_notifications"] = notification_collection.delete_many(notification_query).deleted_count
+
+    history = _seed_history(sensor_id, start)
+    pacer = Pacer(speed)
+    batch = Batch(dry_run)
+    last = None
+    for reading in sensor_data_collection.find(query).sort("timestamp", 1).batch_size(BATCH_SIZE):
+        pacer.wait(reading["timestamp"])
+        alerts, new_notifications = _classify(sensor, reading, history, regenerate)
+        update = None
+        if alerts != reading.get("alerts"):
+            update = UpdateOne({"_id": reading["_id"]}, {"$set": {"alerts": alerts}})
+            summary["changed"] += 1
+        batch.add(update=update, notifications=new_notifications)
+        summary["readings"] += 1
+        summary["notifications"] += len(new_notifications)
+        last = (reading["timestamp"], alerts)
+    batch.flush()
+
+    if last and not dry_run:
+        # Only when the last replayed reading is still the sensor's latest one
+        last_seen = [last[0], None] if end is None else [last[0]]
+        sensors_collection.update_one(
+            {"sensor_id": sensor_id, "last_seen": {"$in": last_seen}},
+            {"$set": {"alerts": last[1]}}
+        )
+    return summary
+
+def _file_field(column) -> str:
+    # Spreadsheet headers become reading fields, Mongo keys can't contain dots
+    return str(column).strip().replace(".", "_")
+
+def read_file_readings(path: str, sensor_id: str) -> List[Dict[str, Any]]:
+    """Readings for a file in the algorithm.py format, oldest first.
+
+    Rows are timed by the 'Date & Time' column when there is one, otherwise
+    they are spaced algorithm.CHECK_INTERVAL apart ending now."""
+    import algorithm
+    import pandas as pd
+
+    data = algorithm.read_file(path)
+    if 'Date & Time' in data.columns:
+        timestamps = [value.to_pydatetime() for value in pd.to_datetime(data['Date & Time'])]
+    else:
+        now = datetime.now()
+        timestamps = [now - timedelta(seconds=algorithm.CHECK_INTERVAL * (len(data) - row)) for row in range(1, len(data) + 1)]
+
+    columns = algorithm.get_columns(data)
+    readings = []
+    for row, timestamp in enumerate(timestamps):
+        readings.append({
+            "sensor_id": sensor_id,
+            "timestamp": timestamp,
+            "status": "active",
+            "readings": {_file_field(column): values[row] for column, values in columns.items()}
+        })
+    readings.sort(key=lambda reading: reading["timestamp"])
+    return readings
+
+def replay_file(
+    path: str,
+    sensor_id: str,
+    notifications: str = "suppress",
+    speed: float = 0,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """Classify a CSV/XLSX file's rows as readings of sensor_id and store them."""
+    summary = {"sensor_id": sensor_id, "file": path, "readings": 0, "alerts": 0, "notifications": 0}
+    sensor = sensors_collection.find_one({"sensor_id": sensor_id})
+    if not sensor:
+        return {**summary, "error": "Sensor not registered"}
+    summary["owner_id"] = sensor["owner_id"]
+
+    readings = read_file_readings(path, sensor_id)
+    if not readings:
+        return summary
+
+    regenerate = notifications == "regenerate"
+    history = _seed_history(sensor_id, readings[0]["timestamp"])
+    pacer = Pacer(speed)
+    batch = Batch(dry_run)
+    for reading in readings:
+        pacer.wait(reading["timestamp"])
+        alerts, new_notifications = _classify(sensor, reading, history, regenerate)
+        reading["alerts"] = alerts
+        batch.add(document=reading, notifications=new_notifications)
+        summary["readings"] += 1
+        summary["alerts"] += sum(1 for status in alerts.values() if status in ("warning", "danger", "invalid"))
+        summary["notifications"] += len(new_notifications)
+    batch.flush()
+
+    if not dry_run:
+        last = readings[-1]
+        sensors_collection.update_one(
+            {"sensor_id": sensor_id, "$or": [{"last_seen": {"$lt": last["timestamp"]}}, {"last_seen": {"$exists": False}}]},
+            {"$set": {"alerts": last["alerts"], "last_seen": last["timestamp"]}}
+        )
+    return summary
+
+def _run_all(
+    function: Callable[..., Dict[str, Any]],
+    tasks: List[Dict[str, Any]],
+    workers: int,
+    on_result: Optional[Callable[[Dict[str, Any]], None]]
+) -> List[Dict[str, Any]]:
+    results = []
+
+    def done(task, outcome):
+        try:
+            result = outcome()
+        except Exception as e:
+            # One bad sensor or file doesn't stop the others
+            result = {"sensor_id": task["sensor_id"], "error": str(e)}
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            done(task, lambda: function(**task))
+    else:
+        # spawn, not fork: every worker opens its own MongoClient
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(function, **task): task for task in tasks}
+            for future in as_completed(futures):
+                done(futures[future], future.result)
+
+    # Caches and counters live in this process, settle them once for the whole run
+    if not tasks or not tasks[0].get("dry_run"):
+        bump_many("sensor", [result["sensor_id"] for result in results])
+        if tasks and tasks[0].get("notifications") == "regenerate":
+            for owner_id in {result["owner_id"] for result in results if "owner_id" in result}:
+                rebuild_counters(owner_id)
+    return results
+
+def replay_sensors(
+    sensor_ids: List[str],
+    workers: int = WORKERS,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    **options
+) -> List[Dict[str, Any]]:
+    """replay_history for every sensor, in parallel. options are replay_history's keyword arguments."""
+    validate_options(options.get("notifications", "suppress"), options.get("speed", 0))
+    return _run_all(replay_history, [{"sensor_id": sensor_id, **options} for sensor_id in sensor_ids], workers, on_result)
+
+def replay_files(
+    files: Dict[str, str],
+    workers: int = WORKERS,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    **options
+) -> List[Dict[str, Any]]:
+    """replay_file for every {path: sensor_id}, in parallel."""
+    validate_options(options.get("notifications", "suppress"), options.get("speed", 0))
+    return _run_all(replay_file, [{"path": path, "sensor_id": sensor_id, **options} for path, sensor_id in files.items()], workers, on_result)
+
+def start_job(sensor_ids: List[str], requested_by: str, workers: int = WORKERS, **options) -> Dict[str, Any]:
+    """Run replay_sensors in a background thread of the API process."""
+    validate_options(options.get("notifications", "suppress"), options.get("speed", 0))
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "requested_by": requested_by,
+        "status": "running",
+        "sensors": len(sensor_ids),
+        "done": 0,
+        "readings": 0,
+        "changed": 0,
+        "notifications": 0,
+        "errors": [],
+        "created_at": datetime.now(),
+        "finished_at": None,
+    }
+    jobs[job["job_id"]] = job
+
+    def on_result(result):
+        job["done"] += 1
+        job["readings"] += result.get("readings", 0)
+        job["changed"] += result.get("changed", 0)
+        job["notifications"] += result.get("notifications", 0)
+        if "error" in result:
+            job["errors"].append({"sensor_id": result["sensor_id"], "error": result["error"]})
+
+    def run():
+        try:
+            replay_sensors(sensor_ids, workers, on_result, **options)
+            job["status"] = "done"
+        except Exception as e:
+            print(f"Replay job {job['job_id']} failed: {e}")
+            job["status"] = "failed"
+            job["errors"].append({"error": str(e)})
+        job["finished_at"] = datetime.now()
+
+    threading.Thread(target=run, name=f"replay-job-{job['job_id']}", daemon=True).start()
+    return job
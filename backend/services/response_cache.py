@@ -0,0 +1,116 @@
+# Response cache with version stamps for the dashboard read endpoints.
+#
+# Every cached response records the scopes it was built from ("project:<id>",
+# "sensor:<id>", ...). Writes bump the scopes they touch. A cached entry is
+# valid while none of its scopes were bumped after it was built, so an
+# unchanged poll costs a dict lookup: 304 when the client sends the matching
+# If-None-Match, the stored bytes otherwise.
+#
+# Versions live in this process. With several API workers a write handled
+# by one worker doesn't invalidate another worker's cache, so run a single
+# worker or set RESPONSE_CACHE_ENABLED=0.
+#
+# Writes made outside this process (replay.py, the standalone line
+# listener, another worker) bump nothing here, so every entry is also
+# rebuilt once it is RESPONSE_CACHE_TTL_SECONDS old. Routes reading from a
+# secondary pass max_age: a write can be bumped before the secondary has it,
+# so such entries expire after the replication staleness bound if sooner.
+#
+# ETags are a hash of the body, never of the build clock alone: two keys (two
+# users on the same URL) built at the same clock must not share a tag.
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Tuple, Any, Dict, Optional
+
+import orjson
+from fastapi import Request, Response
+
+ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") not in ("0", "false", "False")
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "1000"))
+TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+
+class _Entry:
+    __slots__ = ("scopes", "built_at", "etag", "body", "expires")
+
+    def __init__(self, scopes: List[str], built_at: int, etag: str, body: bytes, expires: float):
+        self.scopes = scopes
+        self.built_at = built_at
+        self.etag = etag
+        self.body = body
+        self.expires = expires
+
+class ResponseCache:
+    def __init__(self):
+        # Process unique prefix so ETags from before a restart never match
+        self.epoch = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        self.clock = 0
+        self.versions: Dict[str, int] = {}
+        self.entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+
+    def bump(self, *scopes: str):
+        with self.lock:
+            self.clock += 1
+            for scope in scopes:
+                self.versions[scope] = self.clock
+
+    def lookup(self, key: Tuple):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry.expires:
+            return None
+        versions = self.versions
+        if any(versions.get(scope, 0) > entry.built_at for scope in entry.scopes):
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key: Tuple, scopes: List[str], body: bytes, built_at: int, max_age: Optional[float] = None) -> _Entry:
+        etag = f'W/"{self.epoch}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        ttl = TTL_SECONDS if max_age is None else min(max_age, TTL_SECONDS)
+        expires = time.monotonic() + ttl
+        entry = _Entry(scopes, built_at, etag, body, expires)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > MAX_ENTRIES:
+                self.entries.popitem(last=False)
+        return entry
+
+cache = ResponseCache()
+
+def bump(*scopes: str):
+    if ENABLED:
+        cache.bump(*scopes)
+
+def bump_many(prefix: str, ids: Iterable[Any]):
+    bump(*(f"{prefix}:{value}" for value in ids if value))
+
+def cached_json(request: Request, key: Tuple, build: Callable[[], Tuple[Any, List[str]]], max_age: Optional[float] = None) -> Response:
+    """Serve key from the cache, or call build() -> (content, scopes) and cache it.
+
+    key must include everything the content depends on besides the scopes
+    (route, user, query parameters). Exceptions from build() are not cached.
+    Entries are rebuilt after RESPONSE_CACHE_TTL_SECONDS, or max_age when shorter."""
+    if not ENABLED:
+        content, _ = build()
+        return Response(orjson.dumps(content, default=str), media_type="application/json")
+
+    entry = cache.lookup(key)
+    if entry is None:
+        # Taken before reading Mongo: a write that lands while we build
+        # bumps past it and the entry is rebuilt on the next request
+        built_at = cache.clock
+        content, scopes = build()
+        entry = cache.store(key, scopes, orjson.dumps(content, default=str), built_at, max_age)
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or entry.etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
@@ -1,10 +1,57 @@
 from typing import Dict, Any
 from models.sensor_model import BaseSensorData
-from datetime import datetime
-from typing import List, Dict, Any
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+import os
 import statistics
+import uuid
+import orjson
 
-def classify_alert(sensor_data: Dict[str, Any], history: List[Dict[str, Any]]) -> Dict[str, Any]:
+SCALAR_FIELDS = ["adc", "temperature", "roll", "pitch", "position"]
+VECTOR_FIELDS = ["accelerometer", "magnetometer", "gyroscope"]
+
+# Robust z-scores (distance from the median in MADs) for baseline classification
+BASELINE_WARNING_Z = float(os.getenv("BASELINE_WARNING_Z", "3"))
+BASELINE_DANGER_Z = float(os.getenv("BASELINE_DANGER_Z", "5"))
+
+class MissingSensorId(ValueError):
+    """A payload without sensor_id, /api/receive-sensor-data answers it with 404 like an unknown sensor."""
+
+def baseline_status(value: float, stats: Dict[str, Any]) -> str:
+    """good/warning/danger for a value against one field's calibrated baseline."""
+    # 1.4826 x MAD estimates the standard deviation for normal data; a field
+    # that barely moves (MAD 0) falls back to its p01..p99 band
+    scale = 1.4826 * stats["mad"]
+    if scale <= 0:
+        scale = (stats["p99"] - stats["p01"]) / 4.65
+    if scale <= 0:
+        return "good" if value == stats["median"] else "warning"
+    z = abs(value - stats["median"]) / scale
+    return "danger" if z > BASELINE_DANGER_Z else "warning" if z > BASELINE_WARNING_Z else "good"
+
+def _classify_baseline(readings: Dict[str, Any], fields: Dict[str, Any], alerts: Dict[str, Any]):
+    for key, value in readings.items():
+        if key in alerts:
+            # Already out of its absolute limits
+            continue
+        stats = fields.get(key)
+        if not isinstance(stats, dict):
+            continue
+        if isinstance(value, (int, float)) and "median" in stats:
+            alerts[key] = baseline_status(value, stats)
+        elif isinstance(value, dict):
+            sub_alerts = {
+                sub_key: baseline_status(sub_value, stats[sub_key])
+                for sub_key, sub_value in value.items()
+                if isinstance(sub_value, (int, float)) and isinstance(stats.get(sub_key), dict) and "median" in stats[sub_key]
+            }
+            if sub_alerts:
+                alerts[key] = sub_alerts
+
+def classify_alert(sensor_data: Dict[str, Any], history: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Alerts for one reading. With a calibrated baseline (see
+    services/baseline_service.py) every field is judged against it and
+    history is not needed; otherwise against the mean of history."""
     alerts = {}
     readings = sensor_data.get("readings", {})
     
@@ -19,6 +66,14 @@ def classify_alert(sensor_data: Dict[str, Any], history: List[Dict[str, Any]]) -
                 alerts[key] = 'danger'
                 continue
     
+    if baseline and baseline.get("fields"):
+        _classify_baseline(readings, baseline["fields"], alerts)
+        if "position" in readings:
+            location = sensor_data["location"] if "location" in sensor_data else parse_position(readings["position"])
+            if location is None:
+                alerts["position"] = "invalid"
+        return alerts
+    
     # If we don't have enough history for statistical analysis, return just the absolute limit alerts
     if not history or len(history) < 3:  # Reduced from 11 to 3 minimum data points
         return alerts
@@ -70,13 +125,10 @@ def classify_alert(sensor_data: Dict[str, Any], history: List[Dict[str, Any]]) -
                         deviation = abs(sub_value - avg_sub) / avg_sub if avg_sub != 0 else float('inf')
                         alerts[key][sub_key] = "danger" if deviation > 0.2 else "warning" if deviation > 0.1 else "good"
     
-    # Handle position separately
+    # Handle position separately, ingest already parsed it into location
     if "position" in readings:
-        try:
-            lat, lon = map(float, readings["position"].split(","))
-            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-                alerts["position"] = "invalid"
-        except ValueError:
+        location = sensor_data["location"] if "location" in sensor_data else parse_position(readings["position"])
+        if location is None:
             alerts["position"] = "invalid"
     
     return alerts
@@ -96,14 +148,12 @@ def process_sensor_data(data: Dict[str, Any]) -> BaseSensorData:
     )
     
     # Process common scalar readings
-    scalar_fields = ["adc", "temperature", "roll", "pitch", "position"]
-    for field in scalar_fields:
+    for field in SCALAR_FIELDS:
         if field in data:
             sensor_data.readings[field] = data.pop(field)
     
     # Process vector readings
-    vector_fields = ["accelerometer", "magnetometer", "gyroscope"]
-    for field in vector_fields:
+    for field in VECTOR_FIELDS:
         if field in data:
             vector_data = data.pop(field)
             # Handle vector data in various formats
@@ -124,4 +174,139 @@ def process_sensor_data(data: Dict[str, Any]) -> BaseSensorData:
     for key, value in data.items():
         sensor_data.readings[key] = value
     
-    return sensor_data
\ No newline at end of file
+    return sensor_data
+
+
+def parse_position(value: Any) -> Optional[Dict[str, Any]]:
+    """GeoJSON point for a "lat, lon" position, None when it is not valid."""
+    try:
+        if isinstance(value, str):
+            lat, lon = map(float, value.split(","))
+        elif isinstance(value, (list, tuple)) and len(value) == 2:
+            lat, lon = float(value[0]), float(value[1])
+        else:
+            return None
+    except (ValueError, TypeError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    # GeoJSON is longitude first
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+# Unix times above this are milliseconds, the cut-off pydantic uses
+MILLISECONDS_FROM = 2e10
+
+def parse_timestamp(value: Any) -> datetime:
+    """Reading time from an ISO string or unix time, seconds or milliseconds,
+    as a number or a numeric string (what pydantic accepted for
+    BaseSensorData.timestamp). Anything else is a ValueError."""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise ValueError("timestamp must be an ISO string or unix time")
+    try:
+        if abs(value) > MILLISECONDS_FROM:
+            value = value / 1000
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    except (OverflowError, OSError) as e:
+        raise ValueError(f"timestamp out of range: {e}") from None
+
+
+def build_sensor_document(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Same normalisation as process_sensor_data, but straight into the
+    storage dict without building a BaseSensorData model."""
+    sensor_id = data.pop("sensor_id", None)
+    if sensor_id is None:
+        raise MissingSensorId("sensor_id is required")
+    if not isinstance(sensor_id, str):
+        raise ValueError("sensor_id must be a string")
+
+    status = data.pop("status", "active")
+    if status is not None and not isinstance(status, str):
+        raise ValueError("status must be a string")
+
+    readings = {}
+    for field in SCALAR_FIELDS:
+        if field in data:
+            readings[field] = data.pop(field)
+
+    for field in VECTOR_FIELDS:
+        if field in data:
+            vector_data = data.pop(field)
+            if isinstance(vector_data, dict):
+                readings[field] = {
+                    "x": vector_data.get("x"),
+                    "y": vector_data.get("y"),
+                    "z": vector_data.get("z")
+                }
+            elif isinstance(vector_data, list) and len(vector_data) >= 3:
+                readings[field] = {
+                    "x": vector_data[0],
+                    "y": vector_data[1],
+                    "z": vector_data[2]
+                }
+
+    timestamp = parse_timestamp(data.pop("timestamp")) if "timestamp" in data else datetime.now()
+
+    # Add any remaining fields to readings
+    readings.update(data)
+
+    document = {
+        "sensor_id": sensor_id,
+        "timestamp": timestamp,
+        "status": status,
+        "readings": readings
+    }
+    # Parsed once here for the 2dsphere index and classify_alert; readings
+    # keeps the position exactly as the device sent it
+    if "position" in readings:
+        document["location"] = parse_position(readings["position"])
+    return document
+
+
+def decode_sensor_payload(body: bytes) -> Dict[str, Any]:
+    """Decode a raw ingest body once with orjson into the storage dict."""
+    data = orjson.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Sensor payload must be a JSON object")
+    return build_sensor_document(data)
+
+
+def build_notifications(sensor: Dict[str, Any], sensor_data: Dict[str, Any], alerts: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Notification documents for every warning/danger/invalid alert.
+
+    Builds the same fields as models.notification_model.Notification as plain
+    dicts so they can go to insert_many without a model round trip."""
+    notifications = []
+    now = datetime.now()
+
+    def notification(alert_type, label, extra):
+        return {
+            "notification_id": str(uuid.uuid4()),
+            "user_id": sensor["owner_id"],
+            "sensor_id": sensor["sensor_id"],
+            "message": f"{alert_type.upper()}: Abnormal {label} reading for sensor {sensor['name']}",
+            "alert_type": alert_type,
+            "read": False,
+            "timestamp": now,
+            "data": dict(sensor_data=sensor_data, **extra)
+        }
+
+    for field, status in (alerts or {}).items():
+        if isinstance(status, dict):
+            # Handle nested alerts (e.g., accelerometer with x,y,z)
+            for sub_field, sub_status in status.items():
+                if sub_status in ['warning', 'danger']:
+                    notifications.append(notification(
+                        sub_status, f"{field}.{sub_field}", {"field": field, "sub_field": sub_field}
+                    ))
+        elif status in ['warning', 'danger', 'invalid']:
+            notifications.append(notification(status, field, {"field": field}))
+
+    return notifications
@@ -0,0 +1,174 @@
+# Mergeable quantile sketches per sensor field and time bucket.
+#
+# Every numeric reading field (vector axes as "accelerometer.x") gets one
+# DDSketch per SKETCH_BUCKET_MINUTES bucket in sensor_sketches. A DDSketch
+# counts values in logarithmic bins, bin k holding values in
+# (gamma^(k-1), gamma^k], so any quantile read back is within
+# SKETCH_RELATIVE_ACCURACY of the true value. Bins are plain counters, which
+# makes the sketches mergeable by adding them up: ingest $inc's them in one
+# bulk write per batch, and queries add up the buckets, sensors and assets
+# they cover instead of reading raw sensor_data.
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+from pymongo import UpdateOne
+from database import sensor_sketches_collection, sensor_sketches_reads
+
+ENABLED = os.getenv("SKETCHES_ENABLED", "1") == "1"
+RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", "0.01"))
+BUCKET_MINUTES = int(os.getenv("SKETCH_BUCKET_MINUTES", "60"))
+
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Magnitudes below this are counted as zero
+MIN_VALUE = 1e-9
+EPOCH = datetime(1970, 1, 1)
+
+def key_of(value: float) -> int:
+    """Bin of a positive magnitude."""
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+def value_of(key: int) -> float:
+    """Representative value of a bin, within RELATIVE_ACCURACY of everything in it."""
+    return 2 * GAMMA ** key / (GAMMA + 1)
+
+def bucket_of(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    seconds = BUCKET_MINUTES * 60
+    return EPOCH + timedelta(seconds=(timestamp - EPOCH).total_seconds() // seconds * seconds)
+
+def numeric_fields(readings: Dict[str, Any]) -> Iterable[Tuple[str, float]]:
+    for field, value in readings.items():
+        if isinstance(value, dict):
+            for axis, axis_value in value.items():
+                if _is_number(axis_value):
+                    yield f"{field}.{axis}", axis_value
+        elif _is_number(value):
+            yield field, value
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+class Sketch:
+    """In-memory DDSketch, built by adding values or merging stored documents."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zero = 0
+        self.pos: Dict[int, int] = defaultdict(int)
+        self.neg: Dict[int, int] = defaultdict(int)
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if abs(value) < MIN_VALUE:
+            self.zero += 1
+        elif value > 0:
+            self.pos[key_of(value)] += 1
+        else:
+            self.neg[key_of(-value)] += 1
+
+    def merge_document(self, document: Dict[str, Any]):
+        self.count += document.get("count", 0)
+        self.sum += document.get("sum", 0)
+        self.min = min(self.min, document.get("min", math.inf))
+        self.max = max(self.max, document.get("max", -math.inf))
+        self.zero += document.get("zero", 0)
+        for key, count in document.get("pos", {}).items():
+            self.pos[int(key)] += count
+        for key, count in document.get("neg", {}).items():
+            self.neg[int(key)] += count
+
+    def _bins(self) -> List[Tuple[float, int]]:
+        # (value, count) from the smallest value to the largest
+        bins = [(-value_of(key), self.neg[key]) for key in sorted(self.neg, reverse=True)]
+        if self.zero:
+            bins.append((0.0, self.zero))
+        bins.extend((value_of(key), self.pos[key]) for key in sorted(self.pos))
+        return bins
+
+    def quantiles(self, qs: List[float]) -> Dict[str, Optional[float]]:
+        if not self.count:
+            return {str(q): None for q in qs}
+        bins = self._bins()
+        result = {}
+        for q in qs:
+            rank = q * (self.count - 1)
+            seen = 0
+            for value, count in bins:
+                seen += count
+                if seen > rank:
+                    break
+            result[str(q)] = min(max(value, self.min), self.max)
+        return result
+
+    def histogram(self, buckets: int) -> List[Dict[str, Any]]:
+        """Equal-width histogram between min and max, counts from the sketch bins."""
+        if not self.count:
+            return []
+        width = (self.max - self.min) / buckets or 1
+        counts = [0] * buckets
+        for value, count in self._bins():
+            index = int((min(max(value, self.min), self.max) - self.min) / width)
+            counts[min(index, buckets - 1)] += count
+        return [
+            {"lower": self.min + index * width, "upper": self.min + (index + 1) * width, "count": count}
+            for index, count in enumerate(counts)
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "mean": self.sum / self.count if self.count else None,
+        }
+
+def record(readings: List[Dict[str, Any]]):
+    """Add a batch of stored readings to their sketches, one upsert per sensor, field and bucket."""
+    if not ENABLED or not readings:
+        return
+    batch: Dict[Tuple[str, str, datetime], Sketch] = {}
+    for reading in readings:
+        bucket = bucket_of(reading["timestamp"])
+        for field, value in numeric_fields(reading.get("readings", {})):
+            sketch = batch.get((reading["sensor_id"], field, bucket))
+            if sketch is None:
+                sketch = batch[(reading["sensor_id"], field, bucket)] = Sketch()
+            sketch.add(value)
+
+    updates = []
+    for (sensor_id, field, bucket), sketch in batch.items():
+        increments = {"count": sketch.count, "sum": sketch.sum, "zero": sketch.zero}
+        increments.update({f"pos.{key}": count for key, count in sketch.pos.items()})
+        increments.update({f"neg.{key}": count for key, count in sketch.neg.items()})
+        updates.append(UpdateOne(
+            {"sensor_id": sensor_id, "field": field, "bucket": bucket},
+            {"$inc": increments, "$min": {"min": sketch.min}, "$max": {"max": sketch.max}},
+            upsert=True
+        ))
+    sensor_sketches_collection.bulk_write(updates, ordered=False)
+
+def merged(sensor_ids: List[str], field: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Sketch:
+    """One sketch for field over every sensor and every bucket overlapping start..end."""
+    query = {"sensor_id": {"$in": sensor_ids}, "field": field}
+    if start or end:
+        query["bucket"] = {}
+        if start:
+            # The bucket holding start begins before it
+            query["bucket"]["$gte"] = bucket_of(start)
+        if end:
+            query["bucket"]["$lte"] = end.astimezone(timezone.utc).replace(tzinfo=None) if end.tzinfo else end
+    sketch = Sketch()
+    for document in sensor_sketches_reads.find(query, {"_id": 0, "sensor_id": 0, "field": 0, "bucket": 0}):
+        sketch.merge_document(document)
+    return sketch
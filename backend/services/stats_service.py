@@ -0,0 +1,118 @@
+# Fleet statistics for the admin dashboard.
+#
+# Everything comes from one aggregation ($unionWith over the collections,
+# then $facet). The result is cached for STATS_TTL_SECONDS; after that the
+# cached copy is still served while a background thread recomputes it, so
+# only the very first request ever waits for the aggregation.
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from database import users_reads
+
+STATS_TTL_SECONDS = int(os.getenv("STATS_TTL_SECONDS", "60"))
+STATS_DAYS = int(os.getenv("STATS_DAYS", "30"))
+# A sensor with no reading for this long counts as silent
+SILENT_MINUTES = int(os.getenv("SENSOR_SILENT_MINUTES", "60"))
+
+_cache: Dict[str, Any] = {"stats": None, "computed_at": 0.0}
+_refresh_lock = threading.Lock()
+
+def _count_if(kind: str) -> Dict[str, Any]:
+    return {"$sum": {"$cond": [{"$eq": ["$kind", kind]}, 1, 0]}}
+
+def compute_fleet_stats() -> Dict[str, Any]:
+    now = datetime.now()
+    since = now - timedelta(days=STATS_DAYS)
+    silent_cutoff = now - timedelta(minutes=SILENT_MINUTES)
+
+    def tagged(kind: str, owner_field: str, extra: Optional[Dict[str, Any]] = None):
+        return [{"$project": {"_id": 0, "kind": {"$literal": kind}, "owner": f"${owner_field}", **(extra or {})}}]
+
+    pipeline = [
+        *tagged("user", "email"),
+        {"$unionWith": {"coll": "projects", "pipeline": tagged("project", "owner_id")}},
+        {"$unionWith": {"coll": "assets", "pipeline": tagged("asset", "owner_id")}},
+        {"$unionWith": {"coll": "sensors", "pipeline": tagged("sensor", "owner_id", {
+            "active": {"$gte": ["$last_seen", silent_cutoff]}
+        })}},
+        {"$unionWith": {"coll": "sensor_data", "pipeline": [
+            {"$match": {"timestamp": {"$gte": since}}},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}}, "count": {"$sum": 1}}},
+            {"$project": {"_id": 0, "kind": {"$literal": "readings"}, "day": "$_id", "count": 1}},
+        ]}},
+        {"$unionWith": {"coll": "notifications", "pipeline": [
+            {"$match": {"timestamp": {"$gte": since}}},
+            {"$group": {"_id": "$alert_type", "count": {"$sum": 1}}},
+            {"$project": {"_id": 0, "kind": {"$literal": "alerts"}, "severity": "$_id", "count": 1}},
+        ]}},
+        {"$facet": {
+            "totals": [
+                {"$match": {"kind": {"$in": ["user", "project", "asset", "sensor"]}}},
+                {"$group": {"_id": None, "users": _count_if("user"), "projects": _count_if("project"),
+                            "assets": _count_if("asset"), "sensors": _count_if("sensor"),
+                            "active_sensors": {"$sum": {"$cond": ["$active", 1, 0]}}}},
+                {"$project": {"_id": 0}},
+            ],
+            "per_owner": [
+                {"$match": {"kind": {"$in": ["user", "project", "asset", "sensor"]}}},
+                {"$group": {"_id": "$owner", "projects": _count_if("project"), "assets": _count_if("asset"),
+                            "sensors": _count_if("sensor"), "active_sensors": {"$sum": {"$cond": ["$active", 1, 0]}}}},
+                {"$sort": {"_id": 1}},
+                {"$project": {"_id": 0, "owner": "$_id", "projects": 1, "assets": 1, "sensors": 1, "active_sensors": 1}},
+            ],
+            "readings_per_day": [
+                {"$match": {"kind": "readings"}},
+                {"$sort": {"day": 1}},
+                {"$project": {"_id": 0, "day": 1, "count": 1}},
+            ],
+            "alerts_by_severity": [
+                {"$match": {"kind": "alerts"}},
+                {"$project": {"_id": 0, "severity": 1, "count": 1}},
+            ],
+        }},
+    ]
+
+    result = next(users_reads.aggregate(pipeline), {})
+    totals = (result.get("totals") or [{}])[0]
+    sensors = totals.get("sensors", 0)
+    active = totals.get("active_sensors", 0)
+    return {
+        "users": totals.get("users", 0),
+        "projects": totals.get("projects", 0),
+        "assets": totals.get("assets", 0),
+        "sensors": sensors,
+        "active_sensors": active,
+        "silent_sensors": sensors - active,
+        "per_owner": result.get("per_owner", []),
+        "readings_per_day": result.get("readings_per_day", []),
+        "alerts_by_severity": {row["severity"]: row["count"] for row in result.get("alerts_by_severity", [])},
+        "window_days": STATS_DAYS,
+        "silent_after_minutes": SILENT_MINUTES,
+        "computed_at": now,
+    }
+
+def refresh():
+    # One refresh at a time, a second caller just keeps the current copy
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        stats = compute_fleet_stats()
+        _cache["stats"] = stats
+        _cache["computed_at"] = time.monotonic()
+    except Exception as e:
+        print(f"Fleet stats refresh failed: {e}")
+    finally:
+        _refresh_lock.release()
+
+def get_fleet_stats() -> Dict[str, Any]:
+    if _cache["stats"] is None:
+        with _refresh_lock:
+            if _cache["stats"] is None:
+                _cache["stats"] = compute_fleet_stats()
+                _cache["computed_at"] = time.monotonic()
+    elif time.monotonic() - _cache["computed_at"] > STATS_TTL_SECONDS:
+        threading.Thread(target=refresh, name="fleet-stats", daemon=True).start()
+    return _cache["stats"]
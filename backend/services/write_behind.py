@@ -0,0 +1,275 @@
+# Write-behind group commit for ingest.
+#
+# INGEST_DURABILITY picks the trade-off per deployment:
+#   direct        every request waits for Mongo to acknowledge its writes (default)
+#   wal-fsync     ack after the record is appended to the local log and fsynced
+#   wal-interval  ack after the append, the log is fsynced every WAL_FSYNC_MS
+#   wal-async     ack after the append, the OS decides when it reaches disk
+#
+# Every append is written through to the OS, so in all wal-* modes a crash of
+# the process keeps acknowledged records; only an OS crash or power loss can
+# lose what wasn't fsynced yet.
+#
+# In the wal-* modes records are group committed to Mongo every WAL_FLUSH_MS or
+# WAL_FLUSH_DOCS readings with insert_many/bulk_write. Log segments are deleted
+# once committed. A segment whose commit fails is retried by the flusher with
+# backoff (WAL_RETRY_MS doubling up to WAL_MAX_RETRY_MS); later segments queue
+# behind it so sensor updates land in order. Segments left over after a crash
+# or shutdown are replayed at startup. Commits are idempotent because _ids
+# are assigned before the append.
+import os
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+import bson
+from bson.errors import InvalidBSON
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines, segment locking is skipped
+    fcntl = None
+
+DURABILITY = os.getenv("INGEST_DURABILITY", "direct")
+WAL_DIR = os.getenv("WAL_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wal"))
+WAL_FLUSH_MS = int(os.getenv("WAL_FLUSH_MS", "200"))
+WAL_FLUSH_DOCS = int(os.getenv("WAL_FLUSH_DOCS", "1000"))
+WAL_FSYNC_MS = int(os.getenv("WAL_FSYNC_MS", "100"))
+WAL_RETRY_MS = int(os.getenv("WAL_RETRY_MS", "500"))
+WAL_MAX_RETRY_MS = int(os.getenv("WAL_MAX_RETRY_MS", "60000"))
+
+DURABILITY_MODES = ("direct", "wal-fsync", "wal-interval", "wal-async")
+if DURABILITY not in DURABILITY_MODES:
+    raise ValueError(f"INGEST_DURABILITY must be one of {', '.join(DURABILITY_MODES)}")
+
+DUPLICATE_KEY = 11000
+
+def _insert_new(collection, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """insert_many that skips documents already committed before a crash.
+
+    Returns the documents that were actually inserted."""
+    try:
+        collection.insert_many(documents, ordered=False)
+        return documents
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        duplicates = {error["index"] for error in errors}
+        return [document for index, document in enumerate(documents) if index not in duplicates]
+
+def commit(sensor_data: List[Dict[str, Any]], notifications: List[Dict[str, Any]], sensor_updates: Dict[str, Dict[str, Any]]):
+    """Write one group of ingest results to Mongo.
+
+    sensor_updates maps sensor_id to the fields to $set on its sensor document."""
+    from database import sensor_data_collection, sensors_collection, notification_collection
+    from services.notification_service import count_created
+    from services.response_cache import bump_many
+
+    if notifications:
+        count_created(_insert_new(notification_collection, notifications))
+    if sensor_data:
+        _insert_new(sensor_data_collection, sensor_data)
+    if sensor_updates:
+        sensors_collection.bulk_write(
+            [UpdateOne({"sensor_id": sensor_id}, {"$set": fields}) for sensor_id, fields in sensor_updates.items()],
+            ordered=False
+        )
+        # Only now are the readings visible, cached reads of these sensors are stale
+        bump_many("sensor", sensor_updates)
+
+class WriteBehindLog:
+    def __init__(self, directory: str = WAL_DIR, durability: str = DURABILITY):
+        self.directory = directory
+        self.durability = durability
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.sequence = 0
+        self.segment = None
+        self.pending = []
+        self.inflight = []
+        # Rotated segments whose commit failed, oldest first: (path, handle, groups)
+        self.failed = []
+        self.retry_delay = 0.0
+        self.retry_at = 0.0
+        self.last_fsync = time.monotonic()
+        self.stats = {"appended": 0, "committed": 0, "replayed": 0, "commit_errors": 0, "retries": 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self.replay()
+        self._open_segment()
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def _segment_path(self, sequence: int) -> str:
+        # Time first so replay walks segments in write order
+        return os.path.join(self.directory, f"{time.time_ns()}-{os.getpid()}-{sequence:08d}.wal")
+
+    def _open_segment(self):
+        self.sequence += 1
+        path = self._segment_path(self.sequence)
+        handle = open(path, "ab")
+        if fcntl:
+            # Held while we own the segment so other workers don't replay it
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.segment = (path, handle)
+
+    def append(self, sensor_data: List[Dict[str, Any]], notifications: List[Dict[str, Any]], sensor_updates: Dict[str, Dict[str, Any]]):
+        """Durably log a group of writes; returns once the chosen policy is met."""
+        record = bson.encode({"sensor_data": sensor_data, "notifications": notifications, "sensor_updates": sensor_updates})
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("Write-behind log is closed")
+            _, handle = self.segment
+            handle.write(record)
+            # Out of our buffer in every mode, only the fsync depends on it
+            handle.flush()
+            if self.durability == "wal-fsync":
+                os.fsync(handle.fileno())
+            self.pending.append((sensor_data, notifications, sensor_updates))
+            self.stats["appended"] += len(sensor_data)
+            if sum(len(group[0]) for group in self.pending) >= WAL_FLUSH_DOCS:
+                self.wake.set()
+
+    def recent_readings(self, sensor_id: str) -> List[Dict[str, Any]]:
+        """Readings of a sensor not yet visible in Mongo, newest first."""
+        with self.lock:
+            groups = [group for _, _, failed_groups in self.failed for group in failed_groups] + self.inflight + self.pending
+        readings = [reading for group in groups for reading in group[0] if reading["sensor_id"] == sensor_id]
+        readings.reverse()
+        return readings
+
+    def _run(self):
+        while not self.stopped:
+            self.wake.wait(min(WAL_FLUSH_MS, WAL_FSYNC_MS) / 1000)
+            self.wake.clear()
+            if self.durability == "wal-interval" and time.monotonic() - self.last_fsync >= WAL_FSYNC_MS / 1000:
+                self._fsync()
+            self.flush()
+
+    def _fsync(self):
+        with self.lock:
+            _, handle = self.segment
+            handle.flush()
+            os.fsync(handle.fileno())
+            self.last_fsync = time.monotonic()
+
+    def flush(self, force: bool = False):
+        """Rotate the segment and group commit it, after any failed ones.
+
+        While failed segments are backing off the new one queues behind them,
+        force retries them straight away (on close)."""
+        with self.lock:
+            retrying = len(self.failed)
+            if self.pending:
+                path, handle = self.segment
+                groups = self.inflight = self.pending
+                self.pending = []
+                if self.durability != "wal-async":
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                self._open_segment()
+                segments = self.failed + [(path, handle, groups)]
+            elif self.failed:
+                segments = list(self.failed)
+            else:
+                return
+            self.failed = []
+            if retrying and not force and time.monotonic() < self.retry_at:
+                # Still backing off, keep the order
+                self.failed = segments
+                self.inflight = []
+                return
+
+        done = 0
+        try:
+            for path, handle, groups in segments:
+                self._commit_groups(groups)
+                # Closing releases the lock that keeps other workers from replaying it
+                handle.close()
+                os.remove(path)
+                done += 1
+            self.retry_delay = 0.0
+        except Exception as e:
+            self.stats["commit_errors"] += 1
+            self.retry_delay = min(max(self.retry_delay * 2, WAL_RETRY_MS / 1000), WAL_MAX_RETRY_MS / 1000)
+            self.retry_at = time.monotonic() + self.retry_delay
+            print(f"Write-behind commit of {segments[done][0]} failed, retrying in {self.retry_delay:.1f}s: {e}")
+        finally:
+            with self.lock:
+                self.failed = segments[done:] + self.failed
+                self.inflight = []
+        if retrying:
+            self.stats["retries"] += 1
+
+    def _commit_groups(self, groups):
+        sensor_data, notifications, sensor_updates = [], [], {}
+        for group_data, group_notifications, group_updates in groups:
+            sensor_data.extend(group_data)
+            notifications.extend(group_notifications)
+            for sensor_id, fields in group_updates.items():
+                sensor_updates.setdefault(sensor_id, {}).update(fields)
+        commit(sensor_data, notifications, sensor_updates)
+        self.stats["committed"] += len(sensor_data)
+
+    def replay(self):
+        """Commit segments left behind by a previous process."""
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".wal"):
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, "rb") as handle:
+                if fcntl:
+                    try:
+                        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # Still owned by a running worker
+                groups = []
+                try:
+                    for record in bson.decode_file_iter(handle):
+                        groups.append((record["sensor_data"], record["notifications"], record["sensor_updates"]))
+                except InvalidBSON:
+                    # Torn write at the tail, everything before it was never acknowledged as lost
+                    print(f"Write-behind log {name} has a truncated record, replaying {len(groups)} complete ones")
+                if groups:
+                    self._commit_groups(groups)
+                    self.stats["replayed"] += sum(len(group[0]) for group in groups)
+            os.remove(path)
+
+    def close(self):
+        self.stopped = True
+        self.wake.set()
+        self.thread.join()
+        self.flush(force=True)
+        for failed_path, failed_handle, _ in self.failed:
+            # Replayed on the next start
+            print(f"Write-behind log {failed_path} not committed, kept for replay")
+            failed_handle.close()
+        self.failed = []
+        path, handle = self.segment
+        handle.close()
+        if os.path.getsize(path) == 0:
+            os.remove(path)
+
+_log: Optional[WriteBehindLog] = None
+_log_lock = threading.Lock()
+
+def enabled() -> bool:
+    return DURABILITY != "direct"
+
+def get_log() -> WriteBehindLog:
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = WriteBehindLog()
+        return _log
+
+def close_log():
+    global _log
+    with _log_lock:
+        if _log is not None:
+            _log.close()
+            _log = None
@@ -0,0 +1,33 @@
+# Tests for the services, no MongoDB needed. Run from the backend folder:
+#   python -m pytest tests
+# Importing the services creates the MongoClient in database.py, which only
+# connects on the first query; tests that need queries swap the module's
+# collections for the in-memory ones of the mongo fixture.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def mongo():
+    """In-memory database for the services that query MongoDB; those tests
+    are skipped without mongomock (pip install mongomock)."""
+    mongomock = pytest.importorskip("mongomock")
+    _accept_bulk_sort(mongomock.collection.BulkOperationBuilder)
+    return mongomock.MongoClient().setu
+
+def _accept_bulk_sort(builder):
+    # pymongo 4.9+ passes sort= to bulk updates and replaces, which mongomock
+    # 4.3 doesn't take; none of the services sort them
+    for name in ("add_update", "add_replace"):
+        method = getattr(builder, name)
+        if getattr(method, "accepts_sort", False):
+            continue
+
+        def without_sort(self, *args, sort=None, _method=method, **kwargs):
+            return _method(self, *args, **kwargs)
+
+        without_sort.accepts_sort = True
+        setattr(builder, name, without_sort)
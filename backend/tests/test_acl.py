@@ -0,0 +1,65 @@
+import pytest
+
+from services import acl
+
+@pytest.fixture
+def db(mongo, monkeypatch):
+    monkeypatch.setattr(acl, "acl_versions_collection", mongo.acl_versions)
+    monkeypatch.setattr(acl, "COLLECTIONS", {"project": mongo.projects, "asset": mongo.assets, "sensor": mongo.sensors})
+    monkeypatch.setattr(acl, "_entries", type(acl._entries)())
+    monkeypatch.setattr(acl, "stats", dict.fromkeys(acl.stats, 0))
+    monkeypatch.setattr(acl, "CHECK_SECONDS", 0)
+
+    def load(user):
+        # mongomock has no $unionWith, the same rows one collection at a time
+        entry = acl._Entry()
+        for kind, collection in acl.COLLECTIONS.items():
+            for row in collection.find({"owner_id": user}):
+                acl._add(entry, kind, row[f"{kind}_id"], row.get("project_id") if kind == "asset" else None)
+        acl.stats["loads"] += 1
+        return entry
+
+    monkeypatch.setattr(acl, "_load", load)
+    mongo.projects.insert_one({"project_id": "p1", "owner_id": "ann"})
+    mongo.assets.insert_one({"asset_id": "a1", "project_id": "p1", "owner_id": "ann"})
+    mongo.sensors.insert_many([{"sensor_id": "s1", "owner_id": "ann"}, {"sensor_id": "s2", "owner_id": "bob"}])
+    return mongo
+
+def test_owns_from_the_loaded_entry(db):
+    assert acl.owns("ann", "sensor", "s1")
+    assert acl.owns("ann", "project", "p1")
+    assert acl.asset_project("ann", "a1") == "p1"
+    assert not acl.owns("ann", "sensor", "s2")
+    assert not acl.owns("ann", "sensor", None)
+    assert acl.stats["loads"] == 1
+    assert acl.stats["denied"] == 1
+
+def test_objects_created_elsewhere_are_found(db):
+    assert not acl.owns("ann", "sensor", "s3")
+    # Created through another worker
+    db.sensors.insert_one({"sensor_id": "s3", "owner_id": "ann"})
+    assert acl.owns("ann", "sensor", "s3")
+    assert acl.stats["loads"] == 1
+
+def test_deletes_elsewhere_reload_the_entry(db):
+    assert acl.owns("ann", "sensor", "s1")
+    db.sensors.delete_one({"sensor_id": "s1"})
+    # Deleted through another worker, which bumped the user's stamp
+    db.acl_versions.update_one({"user_id": "ann"}, {"$inc": {"version": 1}}, upsert=True)
+    assert not acl.owns("ann", "sensor", "s1")
+    assert acl.stats["stale"] == 1
+    assert acl.stats["loads"] == 2
+
+def test_forget_everyone_bumps_the_shared_stamp(db):
+    assert acl.owns("ann", "sensor", "s1")
+    acl.forget()
+    assert acl._entries == {}
+    assert acl._stamp("ann") == (0, 1)
+    acl.forget("ann")
+    assert acl._stamp("ann") == (1, 1)
+
+def test_entries_are_bounded(db, monkeypatch):
+    monkeypatch.setattr(acl, "MAX_USERS", 1)
+    acl.owns("ann", "sensor", "s1")
+    acl.owns("bob", "sensor", "s2")
+    assert list(acl._entries) == ["bob"]
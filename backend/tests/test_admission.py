@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from services import admission, asset_health
+from services.admission import AdaptiveLimiter, is_priority
+
+def test_routine_requests_get_a_share_of_the_limit():
+    limiter = AdaptiveLimiter(initial=10, routine_share=0.8)
+    assert all(limiter.try_acquire(False) for _ in range(8))
+    assert not limiter.try_acquire(False)
+    # The rest is kept for priority work
+    assert limiter.try_acquire(True) and limiter.try_acquire(True)
+    assert not limiter.try_acquire(True)
+    assert limiter.stats == {"admitted": 10, "shed_routine": 1, "shed_priority": 1}
+
+def saturate(limiter, latency, rounds):
+    for _ in range(rounds):
+        while limiter.try_acquire(True):
+            pass
+        for _ in range(limiter.in_flight):
+            limiter.release(latency)
+
+def test_limit_grows_while_latency_is_steady():
+    limiter = AdaptiveLimiter(initial=10, max_limit=100)
+    saturate(limiter, 0.01, 20)
+    assert limiter.limit > 20
+    saturate(limiter, 0.01, 200)
+    assert limiter.limit == 100
+
+def test_limit_shrinks_when_latency_rises():
+    limiter = AdaptiveLimiter(initial=50, min_limit=8, max_limit=100)
+    saturate(limiter, 0.01, 20)
+    before = limiter.limit
+    saturate(limiter, 0.5, 1)
+    assert limiter.limit < before / 2
+    saturate(limiter, 5, 5)
+    assert limiter.limit == 8
+
+def test_idle_capacity_does_not_raise_the_limit():
+    limiter = AdaptiveLimiter(initial=20)
+    for _ in range(100):
+        limiter.try_acquire(True)
+        limiter.release(0.01)
+    assert limiter.limit == 20
+
+def test_is_priority(monkeypatch):
+    monkeypatch.setattr(asset_health, "_applied", {"alerting": ("warning", 0.0), "calm": ("good", 0.0)})
+    assert is_priority([{"sensor_id": "calm", "readings": {"pitch": 95}}])
+    assert is_priority([{"sensor_id": "calm", "readings": {"roll": -181}}])
+    assert is_priority([{"sensor_id": "calm", "readings": {}}, {"sensor_id": "alerting", "readings": {}}])
+    assert not is_priority([{"sensor_id": "calm", "readings": {"pitch": 10}}, {"sensor_id": "new", "readings": {}}])
+
+def test_slot_sheds_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", True)
+    monkeypatch.setattr(admission, "limiter", AdaptiveLimiter(initial=1, min_limit=1))
+
+    async def scenario():
+        async with admission.slot(True):
+            with pytest.raises(HTTPException) as error:
+                async with admission.slot(True):
+                    pass
+            return error.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "1"
+    assert admission.limiter.in_flight == 0
@@ -0,0 +1,58 @@
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services import alert_shards, sensor_service
+from services.alert_shards import _merge, _slim, shard_of
+
+START = datetime(2026, 3, 1, 12, 0, 0)
+
+def entry(minute, value):
+    return {"readings": {"temperature": value}, "timestamp": START + timedelta(minutes=minute)}
+
+def test_shard_of_is_stable():
+    assert shard_of("sensor-1", 4) == shard_of("sensor-1", 4)
+    assert {shard_of(f"sensor-{index}", 4) for index in range(100)} == {0, 1, 2, 3}
+
+def test_slim_keeps_naive_utc_time():
+    reading = {"sensor_id": "s1", "timestamp": datetime(2026, 3, 1, 14, tzinfo=timezone(timedelta(hours=2))), "readings": {"adc": 1}, "status": "active"}
+    assert _slim(reading) == {"readings": {"adc": 1}, "timestamp": datetime(2026, 3, 1, 12)}
+
+def test_merge_keeps_newest_without_duplicates():
+    seed = [entry(3, 3), entry(1, 1)]
+    own = [entry(4, 4), entry(3, 3), entry(2, 2)]
+    merged = _merge(seed, own, 3)
+    assert [item["readings"]["temperature"] for item in merged] == [4, 3, 2]
+    assert merged.maxlen == 3
+
+@pytest.fixture
+def shard(monkeypatch):
+    """A shard loop in a thread, recording the history each reading was classified against."""
+    seen = []
+
+    def classify_alert(reading, history):
+        seen.append([item["readings"]["temperature"] for item in history])
+        return {}
+
+    monkeypatch.setattr(sensor_service, "classify_alert", classify_alert)
+    requests, results = queue.Queue(), queue.Queue()
+    thread = threading.Thread(target=alert_shards._shard_main, args=(0, requests, results, 10), daemon=True)
+    thread.start()
+
+    def run(items):
+        requests.put((0, [(sensor_id, _slim(reading), seed) for sensor_id, reading, seed in items]))
+        return results.get(timeout=5)
+
+    yield run, seen
+    requests.put(None)
+    thread.join(5)
+
+def test_reseed_keeps_readings_in_flight(shard):
+    run, seen = shard
+    run([("s1", entry(0, 0), [])])
+    run([("s1", entry(1, 1), None)])
+    # Loaded before the reading at minute 1 was stored
+    run([("s1", entry(2, 2), [entry(0, 0), entry(-1, -1)])])
+    assert seen == [[], [0], [1, 0, -1]]
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from services import analysis_service
+from services.analysis_service import analyze_column
+
+def test_analyze_column_limits_and_anomalies(monkeypatch):
+    monkeypatch.setattr(analysis_service, "CHUNK_ROWS", 3)
+    monkeypatch.setattr(analysis_service, "TOLERANCE", 0.1)
+    values = np.array([10, 10, 10, 10, 12, 8, 10, 10.5, 9.5, 10])
+    result = analyze_column(values, "pressure")
+    assert result["mean"] == pytest.approx(10)
+    assert (result["lower"], result["upper"]) == (pytest.approx(9), pytest.approx(11))
+    assert (result["high"], result["low"], result["normal"]) == (1, 1, 8)
+    assert (result["min"], result["max"]) == (8, 12)
+    assert result["anomalies"] == [{"row": 4, "value": 12.0, "kind": "high"}, {"row": 5, "value": 8.0, "kind": "low"}]
+    assert not result["anomalies_truncated"]
+
+def test_analyze_column_truncates_anomalies(monkeypatch):
+    monkeypatch.setattr(analysis_service, "MAX_ANOMALIES", 2)
+    result = analyze_column(np.array([0, 100, 0, 100, 0, 100.0]), "adc")
+    assert len(result["anomalies"]) == 2
+    assert result["anomalies_truncated"]
+
+def test_analyze_empty_column():
+    result = analyze_column(np.zeros(0), "empty")
+    assert (result["rows"], result["min"], result["max"], result["anomalies"]) == (0, None, None, [])
+
+@pytest.fixture
+def jobs(mongo, monkeypatch, tmp_path):
+    monkeypatch.setattr(analysis_service, "analysis_jobs_collection", mongo.analysis_jobs)
+    monkeypatch.setattr(analysis_service, "analysis_results_collection", mongo.analysis_results)
+    monkeypatch.setattr(analysis_service, "ANALYSIS_DIR", str(tmp_path))
+    return mongo
+
+def upload_xlsx(jobs, tmp_path, rows):
+    openpyxl = pytest.importorskip("openpyxl")
+    path = tmp_path / "upload.xlsx"
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save(path)
+    jobs.analysis_jobs.insert_one({"job_id": "job", "path": str(path), "file_hash": "job", "status": "queued", "lease_until": None, "progress": {}})
+
+def test_duplicate_xlsx_headers_are_separate_columns(jobs, tmp_path):
+    pytest.importorskip("pandas")
+    upload_xlsx(jobs, tmp_path, [
+        ["Date & Time", "temp", "temp", "note"],
+        ["2024-01-01", 10, 100, "a"],
+        ["2024-01-02", 10, 100, "b"],
+        ["2024-01-03", 13, 100, None],
+    ])
+    analysis_service.run_job("job")
+    job = analysis_service.get_job("job")
+    assert job["status"] == "done", job.get("error")
+    assert job["skipped_columns"] == ["note"]
+    assert job["lease_until"] is None
+    first, second = job["results"]
+    assert (first["column"], first["mean"], first["high"]) == ("temp", 11, 1)
+    assert (second["column"], second["mean"], second["high"]) == ("temp", 100, 0)
+
+def test_jobs_leased_by_a_live_worker_are_left_alone(jobs, tmp_path, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(analysis_service, "submit", submitted.append)
+    now = datetime.now()
+    jobs.analysis_jobs.insert_many([
+        {"job_id": "queued", "status": "queued", "lease_until": None},
+        {"job_id": "running", "status": "running", "lease_until": now + timedelta(minutes=1)},
+        {"job_id": "abandoned", "status": "running", "lease_until": now - timedelta(minutes=1)},
+        {"job_id": "done", "status": "done", "lease_until": None},
+    ])
+    analysis_service.resume_jobs()
+    assert sorted(submitted) == ["abandoned", "queued"]
+    # Nor run twice when submitted anyway
+    analysis_service.run_job("running")
+    assert jobs.analysis_jobs.find_one({"job_id": "running"})["status"] == "running"
+    assert "started_at" not in jobs.analysis_jobs.find_one({"job_id": "running"})
@@ -0,0 +1,104 @@
+import pytest
+
+from services import asset_health
+from services.asset_health import severity_of, summarize, validate_rules
+
+def test_validate_rules_normalizes():
+    assert validate_rules(None) == []
+    assert validate_rules([
+        {"severity": "warning", "at_least": 2, "status": "danger", "note": "dropped"},
+        {"severity": "danger", "fraction": 1, "status": "danger"},
+    ]) == [
+        {"severity": "warning", "at_least": 2, "status": "danger"},
+        {"severity": "danger", "fraction": 1.0, "status": "danger"},
+    ]
+
+@pytest.mark.parametrize("rules", [
+    {"severity": "warning"},
+    ["warning"],
+    [{"severity": "invalid", "at_least": 1, "status": "danger"}],
+    [{"severity": "warning", "at_least": 1, "status": "critical"}],
+    [{"severity": "warning", "status": "danger"}],
+    [{"severity": "warning", "at_least": 1, "fraction": 0.5, "status": "danger"}],
+    [{"severity": "warning", "at_least": 0, "status": "danger"}],
+    [{"severity": "warning", "at_least": True, "status": "danger"}],
+    [{"severity": "warning", "at_least": 1.5, "status": "danger"}],
+    [{"severity": "warning", "fraction": 0, "status": "danger"}],
+    [{"severity": "warning", "fraction": 1.5, "status": "danger"}],
+    [{"severity": "warning", "fraction": "half", "status": "danger"}],
+])
+def test_validate_rules_rejects(rules):
+    with pytest.raises(ValueError):
+        validate_rules(rules)
+
+def test_severity_of_nested_alerts():
+    assert severity_of(None) == "good"
+    assert severity_of({"temperature": "good", "position": "invalid"}) == "warning"
+    assert severity_of({"accelerometer": {"x": "good", "y": "danger"}}) == "danger"
+    assert severity_of({"status": "unknown"}) == "good"
+
+def test_summarize_worst_and_counts():
+    summary = summarize({"a": "good", "b": "warning", "c": "good"}, [])
+    assert summary == {
+        "worst": "warning",
+        "status": "warning",
+        "alerting": 1,
+        "total": 3,
+        "counts": {"good": 2, "warning": 1, "danger": 0},
+    }
+    assert summarize({}, [{"severity": "warning", "fraction": 0.5, "status": "danger"}])["status"] == "good"
+
+@pytest.mark.parametrize("sensors, status", [
+    ({"a": "warning", "b": "good", "c": "good"}, "warning"),
+    ({"a": "warning", "b": "warning", "c": "good"}, "danger"),
+    # Danger counts towards a warning rule
+    ({"a": "warning", "b": "danger", "c": "good"}, "danger"),
+])
+def test_at_least_rule(sensors, status):
+    assert summarize(sensors, [{"severity": "warning", "at_least": 2, "status": "danger"}])["status"] == status
+
+def test_fraction_rule():
+    rules = [{"severity": "warning", "fraction": 0.5, "status": "danger"}]
+    assert summarize({"a": "warning", "b": "good", "c": "good"}, rules)["status"] == "warning"
+    assert summarize({"a": "warning", "b": "good"}, rules)["status"] == "danger"
+
+def test_rules_never_lower_the_status():
+    rules = [{"severity": "danger", "at_least": 1, "status": "warning"}]
+    assert summarize({"a": "danger"}, rules)["status"] == "danger"
+
+@pytest.fixture
+def db(mongo, monkeypatch):
+    monkeypatch.setattr(asset_health, "asset_health_collection", mongo.asset_health)
+    monkeypatch.setattr(asset_health, "asset_health_reads", mongo.asset_health)
+    monkeypatch.setattr(asset_health, "_applied", {})
+    return mongo
+
+def sensor(sensor_id, asset_id="a1"):
+    return {"sensor_id": sensor_id, "asset_ids": asset_id, "project_ids": "p1", "owner_id": "owner"}
+
+def test_set_sensor_creates_and_updates_the_asset(db):
+    asset_health.set_sensor(sensor("s1"), "good")
+    asset_health.set_sensor(sensor("s2"), "warning")
+    health = asset_health.get_health("a1")
+    assert health["sensors"] == {"s1": "good", "s2": "warning"}
+    assert (health["status"], health["alerting"], health["total"]) == ("warning", 1, 2)
+
+    asset_health.set_sensor(sensor("s2"), "good")
+    assert asset_health.get_health("a1")["status"] == "good"
+    assert asset_health.get_project_health("p1")["alerting_assets"] == 0
+
+def test_unchanged_severity_writes_nothing(db):
+    asset_health.set_sensor(sensor("s1"), "danger")
+    version = db.asset_health.find_one()["version"]
+    asset_health.set_sensor(sensor("s1"), "danger")
+    assert db.asset_health.find_one()["version"] == version
+    assert asset_health.current_severity("s1") == "danger"
+
+def test_apply_alerts_skips_recently_applied(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(asset_health, "set_sensor", lambda sensor, severity: calls.append(severity))
+    monkeypatch.setitem(asset_health._applied, "s1", ("warning", asset_health.time.monotonic()))
+    asset_health.apply_alerts([sensor("s1")], {"s1": {"temperature": "warning"}})
+    assert calls == []
+    asset_health.apply_alerts([sensor("s1")], {"s1": {"temperature": "danger"}})
+    assert calls == ["danger"]
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from services import baseline_service
+
+@pytest.fixture
+def sensors(mongo, monkeypatch):
+    monkeypatch.setattr(baseline_service, "sensors_collection", mongo.sensors)
+    now = datetime.now()
+    mongo.sensors.insert_many([
+        {"sensor_id": "new"},
+        {"sensor_id": "stale", "baseline": {"computed_at": now - timedelta(days=2)}},
+        {"sensor_id": "fresh", "baseline": {"computed_at": now - timedelta(hours=1)}},
+        {"sensor_id": "leased", "baseline_lease_until": now + timedelta(minutes=5)},
+        {"sensor_id": "expired", "baseline_lease_until": now - timedelta(minutes=5)},
+    ])
+    return mongo.sensors
+
+def test_claim_takes_stale_sensors_once(sensors):
+    stale = datetime.now() - timedelta(hours=baseline_service.FRESH_HOURS)
+    everyone = ["new", "stale", "fresh", "leased", "expired"]
+    assert sorted(baseline_service.claim_due(everyone, stale)) == ["expired", "new", "stale"]
+    # A second worker finds them claimed
+    assert baseline_service.claim_due(everyone, stale) == []
+
+def test_calibrate_due_only_computes_its_own_claims(sensors, monkeypatch):
+    computed = []
+    monkeypatch.setattr(baseline_service, "BATCH_SIZE", 2)
+    monkeypatch.setattr(baseline_service, "calibrate", lambda ids: computed.extend(ids) or len(ids))
+    # Another worker got there first
+    sensors.update_one({"sensor_id": "stale"}, {"$set": {"baseline_lease_until": datetime.now() + timedelta(minutes=5)}})
+    assert baseline_service.calibrate_due() == 2
+    assert sorted(computed) == ["expired", "new"]
+    assert baseline_service.calibrate_due() == 0
+
+def test_calibrate_route_404s_for_a_sensor_deleted_meanwhile(mongo, monkeypatch):
+    from routes import sensor_routes
+    monkeypatch.setattr(sensor_routes, "sensors_collection", mongo.sensors)
+    monkeypatch.setattr(sensor_routes.acl, "owns", lambda user, kind, key: True)
+    monkeypatch.setattr(baseline_service, "calibrate", lambda ids, days: 0)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(sensor_routes.calibrate_sensor("gone", days=30, current_user="someone"))
+    assert error.value.status_code == 404
@@ -0,0 +1,100 @@
+import math
+import struct
+import uuid
+from datetime import datetime, timezone
+
+import msgpack
+import pytest
+
+from services.binary_protocol import (
+    FRAME_CONTENT_TYPE,
+    FRAME_HEADER,
+    MSGPACK_CONTENT_TYPE,
+    decode_binary_payload,
+    decode_frame,
+    encode_frame,
+)
+
+SENSOR_A = str(uuid.uuid4())
+SENSOR_B = str(uuid.uuid4())
+
+def test_frame_round_trip():
+    sent = [
+        {
+            "sensor_id": SENSOR_A,
+            "timestamp": "2026-01-02T03:04:05.250Z",
+            "temperature": 21.5,
+            "pitch": 3.0,
+            "position": "45.5, -73.25",
+            "accelerometer": {"x": 0.5, "y": -1.0, "z": 9.75},
+        },
+        {"sensor_id": SENSOR_B, "timestamp": "2026-01-02T03:04:06Z", "adc": 512},
+        {"sensor_id": SENSOR_A, "timestamp": "2026-01-02T03:04:07Z", "roll": -12.5},
+    ]
+    readings = decode_frame(encode_frame(sent))
+
+    assert [reading["sensor_id"] for reading in readings] == [SENSOR_A, SENSOR_B, SENSOR_A]
+    first = readings[0]
+    assert first["timestamp"] == datetime(2026, 1, 2, 3, 4, 5, 250000, tzinfo=timezone.utc)
+    assert first["readings"]["temperature"] == 21.5
+    assert first["readings"]["accelerometer"] == {"x": 0.5, "y": -1.0, "z": 9.75}
+    assert first["readings"]["position"] == "45.5, -73.25"
+    # NaN fields are "not reported", not zero
+    assert set(readings[1]["readings"]) == {"adc"}
+    assert readings[2]["readings"] == {"roll": -12.5}
+
+def test_frame_length_must_match_header():
+    frame = encode_frame([{"sensor_id": SENSOR_A, "timestamp": "2026-01-02T03:04:05Z", "adc": 1}])
+    with pytest.raises(ValueError, match="does not match header"):
+        decode_frame(frame[:-1])
+
+def test_frame_rejects_bad_magic_and_version():
+    with pytest.raises(ValueError, match="Not a sensor frame"):
+        decode_frame(FRAME_HEADER.pack(b"XX", 1, 0, 0))
+    with pytest.raises(ValueError, match="Unsupported frame version"):
+        decode_frame(FRAME_HEADER.pack(b"SF", 9, 0, 0))
+
+def test_frame_rejects_sensor_index_out_of_range():
+    frame = bytearray(encode_frame([{"sensor_id": SENSOR_A, "timestamp": "2026-01-02T03:04:05Z", "adc": 1}]))
+    # The record's first byte is its sensor index, right after the header and the one UUID
+    frame[FRAME_HEADER.size + 16] = 1
+    with pytest.raises(ValueError, match="out of range"):
+        decode_frame(bytes(frame))
+
+def test_msgpack_compact_keys_and_binary_sensor_id():
+    sensor = uuid.uuid4()
+    body = msgpack.packb([
+        {"id": sensor.bytes, "ts": "2026-01-02T03:04:05", "t": 20.0, "st": "idle"},
+        {"sensor_id": str(sensor), "pitch": 1.5},
+    ])
+    readings = decode_binary_payload(MSGPACK_CONTENT_TYPE, body)
+
+    assert [reading["sensor_id"] for reading in readings] == [str(sensor), str(sensor)]
+    assert readings[0]["readings"] == {"temperature": 20.0}
+    assert readings[0]["status"] == "idle"
+    assert readings[1]["readings"] == {"pitch": 1.5}
+
+def test_msgpack_errors_are_value_errors():
+    with pytest.raises(ValueError):
+        decode_binary_payload(MSGPACK_CONTENT_TYPE, b"\xc1")
+    with pytest.raises(ValueError, match="must be a map"):
+        decode_binary_payload(MSGPACK_CONTENT_TYPE, msgpack.packb([1, 2]))
+    with pytest.raises(ValueError, match="16 bytes"):
+        decode_binary_payload(MSGPACK_CONTENT_TYPE, msgpack.packb({"id": b"short"}))
+
+def test_content_type_dispatch():
+    frame = encode_frame([{"sensor_id": SENSOR_A, "timestamp": "2026-01-02T03:04:05Z", "adc": 1}])
+    assert len(decode_binary_payload(f"{FRAME_CONTENT_TYPE}; charset=binary", frame)) == 1
+    with pytest.raises(LookupError):
+        decode_binary_payload("application/json", b"{}")
+    with pytest.raises(LookupError):
+        decode_binary_payload(None, b"")
+
+def test_truncated_header_is_rejected():
+    with pytest.raises((ValueError, struct.error)):
+        decode_frame(b"SF")
+
+def test_encode_leaves_missing_fields_nan():
+    frame = encode_frame([{"sensor_id": SENSOR_A, "timestamp": "2026-01-02T03:04:05Z"}])
+    values = struct.unpack_from("<15f", frame, len(frame) - 60)
+    assert all(math.isnan(value) for value in values)
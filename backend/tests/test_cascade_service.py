@@ -0,0 +1,106 @@
+import pytest
+
+from services import cascade_service
+
+@pytest.fixture
+def db(mongo, monkeypatch):
+    names = {
+        "users_collection": "users",
+        "sensors_collection": "sensors",
+        "sensor_data_collection": "sensor_data",
+        "projects_collection": "projects",
+        "assets_collection": "assets",
+        "notification_collection": "notifications",
+        "delete_jobs_collection": "delete_jobs",
+        "delete_job_ids_collection": "delete_job_ids",
+        "asset_health_collection": "asset_health",
+        "sensor_sketches_collection": "sensor_sketches",
+    }
+    for attribute, name in names.items():
+        monkeypatch.setattr(cascade_service, attribute, mongo[name])
+    monkeypatch.setattr(cascade_service, "COLLECTIONS", {name: mongo[name] for name in cascade_service.COLLECTIONS})
+    monkeypatch.setattr(cascade_service, "BATCH_SIZE", 2)
+    monkeypatch.setattr(cascade_service, "BATCH_PAUSE_MS", 0)
+    monkeypatch.setattr(cascade_service, "start_job", lambda job_id: None)
+    monkeypatch.setattr(cascade_service, "rebuild_counters", lambda user_id=None: 0)
+    monkeypatch.setattr(cascade_service.acl, "forget", lambda user=None: None)
+
+    mongo.users.insert_one({"email": "owner", "sensors": ["s1", "s2", "s3"], "assets": ["a1", "a2"]})
+    mongo.projects.insert_one({"project_id": "p1", "asset_ids": ["a1", "a2"], "sensors": ["s1", "s2", "s3"]})
+    mongo.assets.insert_many([{"asset_id": "a2", "project_id": "p1"}])
+    mongo.sensors.insert_many([
+        {"sensor_id": "s1", "asset_ids": "a1", "project_ids": "p1"},
+        {"sensor_id": "s2", "asset_ids": "a1", "project_ids": "p1"},
+        {"sensor_id": "s3", "asset_ids": "a2", "project_ids": "p1"},
+    ])
+    mongo.sensor_data.insert_many([{"sensor_id": sensor_id, "n": n} for sensor_id in ("s1", "s2", "s3") for n in range(5)])
+    mongo.notifications.insert_many([{"sensor_id": "s1"}, {"sensor_id": "s3"}])
+    mongo.sensor_sketches.insert_many([{"sensor_id": "s2"}, {"sensor_id": "s3"}])
+    mongo.asset_health.insert_many([{"asset_id": "a1"}, {"asset_id": "a2"}])
+    return mongo
+
+def run_asset_delete(db):
+    # The route has already deleted the asset document
+    job = cascade_service.queue_asset_delete({"asset_id": "a1", "owner_id": "owner", "project_id": "p1"})
+    cascade_service._run_job(job["job_id"])
+    return cascade_service.get_job(job["job_id"])
+
+def test_asset_delete_removes_everything_under_it(db):
+    job = run_asset_delete(db)
+    assert job["status"] == "done"
+    assert job["deleted"] == {"sensors": 2, "assets": 0, "sensor_data": 10, "notifications": 1, "sensor_sketches": 1, "asset_health": 1}
+    assert [sensor["sensor_id"] for sensor in db.sensors.find()] == ["s3"]
+    assert {reading["sensor_id"] for reading in db.sensor_data.find()} == {"s3"}
+    assert [health["asset_id"] for health in db.asset_health.find()] == ["a2"]
+    assert db.users.find_one()["sensors"] == ["s3"]
+    assert db.projects.find_one()["sensors"] == ["s3"]
+    assert db.delete_job_ids.count_documents({}) == 0
+
+def test_sensors_are_deleted_before_their_children(db, monkeypatch):
+    order = []
+    delete_batch = cascade_service._delete_batch
+
+    def recording(step, values):
+        order.append(step["collection"])
+        return delete_batch(step, values)
+
+    monkeypatch.setattr(cascade_service, "_delete_batch", recording)
+    run_asset_delete(db)
+    assert order.index("sensor_data") > max(index for index, name in enumerate(order) if name == "sensors")
+    assert order[-1] == "asset_health"
+
+def test_interrupted_job_resumes(db, monkeypatch):
+    delete_batch = cascade_service._delete_batch
+    calls = []
+
+    def failing_once(step, values):
+        calls.append(step["collection"])
+        if step["collection"] == "sensor_data" and calls.count("sensor_data") == 2:
+            raise RuntimeError("mongo down")
+        return delete_batch(step, values)
+
+    monkeypatch.setattr(cascade_service, "_delete_batch", failing_once)
+    job = cascade_service.queue_asset_delete({"asset_id": "a1", "owner_id": "owner", "project_id": "p1"})
+    cascade_service._run_job(job["job_id"])
+    failed = cascade_service.get_job(job["job_id"])
+    assert failed["status"] == "queued"
+    assert failed["attempts"] == 1
+
+    cascade_service._run_job(job["job_id"])
+    done = cascade_service.get_job(job["job_id"])
+    assert done["status"] == "done"
+    assert done["deleted"]["sensor_data"] == 10
+    assert db.sensor_data.count_documents({"sensor_id": {"$in": ["s1", "s2"]}}) == 0
+
+def test_orphan_sweep(db):
+    db.sensor_data.insert_one({"sensor_id": "gone"})
+    db.asset_health.insert_one({"asset_id": "gone"})
+    job = cascade_service.queue_orphan_sweep("admin")
+    cascade_service._run_job(job["job_id"])
+    done = cascade_service.get_job(job["job_id"])
+    assert done["status"] == "done"
+    # s1 and s2 belong to a1, which no longer exists
+    assert done["targets"]["sensor_ids"] == 2
+    assert db.sensor_data.count_documents({"sensor_id": "gone"}) == 0
+    assert db.asset_health.count_documents({"asset_id": {"$in": ["a1", "gone"]}}) == 0
+    assert db.sensors.count_documents({}) == 1
@@ -0,0 +1,199 @@
+# Webhook and email delivery against the local stand-ins in mock_delivery.py.
+import hashlib
+import hmac
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import mock_delivery
+from services import delivery_service
+from services.delivery_service import DeliveryError, SmtpPool, WebhookPool, check_webhook_url, validate_settings
+
+@pytest.fixture(autouse=True)
+def stand_in_counts(monkeypatch):
+    monkeypatch.setattr(mock_delivery, "counts", dict.fromkeys(mock_delivery.counts, 0))
+    monkeypatch.setattr(mock_delivery, "fail_rate", 0.0)
+    return mock_delivery.counts
+
+@pytest.fixture
+def webhook_server(monkeypatch):
+    server = ThreadingHTTPServer(("localhost", 0), mock_delivery.WebhookHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # The stand-in listens on loopback, which check_webhook_url refuses otherwise
+    monkeypatch.setattr(delivery_service, "WEBHOOK_ALLOWED_HOSTS", {"localhost"})
+    yield f"http://localhost:{server.server_address[1]}/alerts"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = mock_delivery.SmtpServer(("localhost", 0), mock_delivery.SmtpHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(delivery_service, "SMTP_HOST", "localhost")
+    monkeypatch.setattr(delivery_service, "SMTP_PORT", server.server_address[1])
+    monkeypatch.setattr(delivery_service, "SMTP_SECURITY", "none")
+    monkeypatch.setattr(delivery_service, "SMTP_USER", None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_webhooks_reuse_one_connection(webhook_server, stand_in_counts):
+    pool = WebhookPool(size=1)
+    for index in range(5):
+        pool.send(webhook_server, {"alert": index}, secret="shh")
+    assert stand_in_counts["webhooks"] == 5
+    assert stand_in_counts["http_connections"] == 1
+
+def test_webhook_failure_is_retryable(webhook_server, stand_in_counts, monkeypatch):
+    monkeypatch.setattr(mock_delivery, "fail_rate", 1.0)
+    with pytest.raises(DeliveryError) as error:
+        WebhookPool().send(webhook_server, {"alert": 1})
+    assert not error.value.permanent
+    assert error.value.retry_after == 1.0
+
+def test_webhook_signature_is_hmac_of_body():
+    captured = {}
+
+    class Recorder:
+        def connection_from_host(self, host, port, scheme, pool_kwargs):
+            return self
+
+        def request(self, method, url, body, headers, redirect):
+            captured.update(body=body, headers=headers)
+            return type("Response", (), {"status": 200, "headers": {}})()
+
+    pool = WebhookPool()
+    pool.http = Recorder()
+    pool.send("http://93.184.216.34/alerts", {"alert": 1}, secret="shh")
+    expected = "sha256=" + hmac.new(b"shh", captured["body"], hashlib.sha256).hexdigest()
+    assert captured["headers"]["X-Setu-Signature"] == expected
+
+def test_emails_reuse_the_logged_in_connection(smtp_server, stand_in_counts):
+    pool = SmtpPool(size=1)
+    try:
+        for index in range(3):
+            pool.send("user@example.com", f"Alert {index}", "body")
+    finally:
+        pool.close()
+    assert stand_in_counts["emails"] == 3
+    assert stand_in_counts["smtp_connections"] == 1
+    assert pool.stats == {"connections": 1, "reused": 2}
+
+def test_email_temporary_failure_keeps_the_connection(smtp_server, stand_in_counts, monkeypatch):
+    pool = SmtpPool(size=1)
+    try:
+        monkeypatch.setattr(mock_delivery, "fail_rate", 1.0)
+        with pytest.raises(DeliveryError) as error:
+            pool.send("user@example.com", "Alert", "body")
+        assert not error.value.permanent
+
+        monkeypatch.setattr(mock_delivery, "fail_rate", 0.0)
+        pool.send("user@example.com", "Alert", "body")
+    finally:
+        pool.close()
+    assert stand_in_counts["smtp_connections"] == 1
+    assert stand_in_counts["emails"] == 1
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.0.0.5/hook",
+    "http://[::1]/hook",
+    "ftp://93.184.216.34/hook",
+    "http:///hook",
+])
+def test_webhook_urls_to_private_addresses_are_refused(url):
+    with pytest.raises(ValueError):
+        check_webhook_url(url)
+
+def test_public_address_is_accepted():
+    check_webhook_url("https://93.184.216.34/hook")
+
+@pytest.mark.parametrize("settings", [
+    {"webhook_url": 5},
+    {"email": ["a@b.c"]},
+    {"email": "not-an-address"},
+    {"email": "a@b.c\nBcc: victim@example.com"},
+    {"email": "a@b.c\r"},
+    {"email": "a@b.c, c@d.e"},
+    {"email": "Someone <a@b.c>"},
+    {"email": " a@b.c"},
+    {"email": "a@b@c"},
+    {"digest_minutes": True},
+    {"digest_minutes": 2000},
+    {"min_severity": "info"},
+    {"webhook_secret": {"a": 1}},
+])
+def test_validate_settings_rejects(settings):
+    with pytest.raises(ValueError):
+        validate_settings(settings)
+
+def test_validate_settings_defaults():
+    assert validate_settings({"email": "user@example.com"}) == {
+        "webhook_url": None,
+        "webhook_secret": None,
+        "email": "user@example.com",
+        "digest_minutes": 0,
+        "min_severity": "warning",
+    }
+
+def test_webhooks_connect_to_the_checked_address(monkeypatch, stand_in_counts):
+    hosts = []
+
+    class Handler(mock_delivery.WebhookHandler):
+        def do_POST(self):
+            hosts.append(self.headers["Host"])
+            super().do_POST()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    # As if alerts.example resolved to a public address that was checked, then to loopback
+    monkeypatch.setattr(delivery_service, "check_webhook_url", lambda url: ["127.0.0.1"])
+    try:
+        WebhookPool().send(f"http://alerts.example:{port}/alerts?team=1", {"alert": 1})
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert stand_in_counts["webhooks"] == 1
+    assert hosts == [f"alerts.example:{port}"]
+
+def test_email_header_line_breaks(smtp_server, stand_in_counts):
+    pool = SmtpPool(size=1)
+    try:
+        pool.send("user@example.com", "DANGER: sensor\nBcc: victim@example.com", "body")
+        # Queued before addresses were checked
+        with pytest.raises(DeliveryError) as error:
+            pool.send("user@example.com\nBcc: victim@example.com", "Alert", "body")
+        assert error.value.permanent
+    finally:
+        pool.close()
+    assert stand_in_counts["emails"] == 1
+
+def test_unexpected_errors_fail_the_delivery_not_the_worker(mongo, monkeypatch):
+    monkeypatch.setattr(delivery_service, "deliveries_collection", mongo.deliveries)
+    monkeypatch.setattr(delivery_service, "stats", dict.fromkeys(delivery_service.stats, 0))
+    deliverer = delivery_service.Deliverer(workers=1)
+    mongo.deliveries.insert_many([
+        delivery_service._delivery("user", "webhook", "broken", {}, "first"),
+        delivery_service._delivery("user", "webhook", "fine", {}, "second"),
+    ])
+    mongo.deliveries.update_one({"delivery_id": "second"}, {"$set": {"next_attempt_at": datetime.now()}})
+
+    def send(delivery):
+        if delivery["target"] == "broken":
+            raise KeyError("webhook_secret")
+        deliverer.stopping.set()
+
+    monkeypatch.setattr(deliverer, "send", send)
+    worker = threading.Thread(target=deliverer._run)
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive()
+    statuses = {delivery["delivery_id"]: delivery for delivery in mongo.deliveries.find()}
+    assert statuses["first"]["status"] == "failed"
+    assert statuses["first"]["last_error"] == "KeyError: 'webhook_secret'"
+    assert statuses["second"]["status"] == "sent"
+    assert delivery_service.stats["failed"] == 1
@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+from models.edge_model import EdgeSync
+from services import edge_sync
+import database
+
+def test_bucket_starts_are_stored_in_local_time(mongo, monkeypatch):
+    monkeypatch.setattr(database, "sensors_collection", mongo.sensors)
+    monkeypatch.setattr(database, "sensor_data_collection", mongo.sensor_data)
+    mongo.sensors.insert_one({"sensor_id": "s1"})
+    start = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+    sync = EdgeSync.model_validate({"gateway": "gw", "buckets": [
+        {"sensor_id": "s1", "start": start.isoformat(), "seconds": 60, "count": 2, "fields": {
+            "temperature": {"count": 2, "sum": 30, "min": 10, "max": 20},
+            "accelerometer.x": {"count": 2, "sum": 4, "min": 1, "max": 3},
+        }},
+        {"sensor_id": "unknown", "start": start.isoformat(), "seconds": 60, "count": 1},
+    ]})
+    assert edge_sync.store_aggregates(sync) == {"stored": 1, "unknown_sensors": ["unknown"]}
+    # Sent again, replaces the first
+    edge_sync.store_aggregates(sync)
+
+    [document] = mongo.sensor_data.find({}, {"_id": 0})
+    assert document["timestamp"] == start.astimezone().replace(tzinfo=None)
+    assert document["readings"] == {"temperature": 15, "accelerometer": {"x": 2}}
+    assert document["edge"]["gateway"] == "gw"
+    assert document["edge"]["count"] == 2
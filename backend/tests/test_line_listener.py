@@ -0,0 +1,58 @@
+import asyncio
+import socket
+from datetime import datetime, timezone
+
+import pytest
+
+from services import line_listener
+from services.line_listener import LineListener, parse_line
+
+def test_parse_line():
+    document = parse_line('s1 1700000000 temperature=21.5,adc=3,accelerometer.x=0.1,lat=45.5,lon=-73.2,status_note="idle"\n')
+    assert document["sensor_id"] == "s1"
+    assert document["timestamp"] == datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc)
+    assert document["readings"] == {
+        "temperature": 21.5,
+        "adc": 3,
+        "accelerometer": {"x": 0.1, "y": None, "z": None},
+        "position": "45.5, -73.2",
+        "status_note": "idle",
+    }
+    assert document["location"] == {"type": "Point", "coordinates": [-73.2, 45.5]}
+
+def test_parse_line_timestamps():
+    assert parse_line("s1 - adc=1")["timestamp"].tzinfo is None
+    assert parse_line("s1 2023-11-14T22:13:20Z adc=1")["timestamp"] == datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc)
+
+@pytest.mark.parametrize("line", ["s1 1700000000", "s1 - adc", "s1 - =1", "s1 - adc=abc", "s1 yesterday adc=1", "s1 1e300 adc=1", "s1 inf adc=1"])
+def test_parse_line_rejects(line):
+    with pytest.raises(ValueError):
+        parse_line(line)
+
+def test_bad_lines_are_counted_not_raised(monkeypatch):
+    monkeypatch.setitem(line_listener.stats, "invalid", 0)
+    listener = LineListener()
+    assert listener._parse(b"s1 1e300 adc=1") is None
+    assert listener._parse(b"\xff\xfe adc=1") is None
+    assert line_listener.stats["invalid"] == 2
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def test_stop_closes_idle_connections(monkeypatch):
+    monkeypatch.setattr(line_listener, "STOP_SECONDS", 2)
+
+    async def scenario():
+        listener = await LineListener("127.0.0.1", tcp_port=free_port()).start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", listener.tcp_port)
+        # Let the server accept it
+        while not listener.writers:
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(listener.stop(), 5)
+        # The device sees the connection closed
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+        writer.close()
+
+    asyncio.run(scenario())
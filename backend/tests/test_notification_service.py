@@ -0,0 +1,40 @@
+import pytest
+
+from services import notification_service
+from services.notification_service import count_created, count_removed, get_summary, rebuild_counters
+
+@pytest.fixture
+def db(mongo, monkeypatch):
+    monkeypatch.setattr(notification_service, "notification_collection", mongo.notifications)
+    monkeypatch.setattr(notification_service, "notification_counters_collection", mongo.notification_counters)
+    monkeypatch.setattr(notification_service, "notification_counters_reads", mongo.notification_counters)
+    return mongo
+
+def notification(user_id="u1", sensor_id="s1", alert_type="warning", read=False):
+    return {"user_id": user_id, "sensor_id": sensor_id, "alert_type": alert_type, "read": read}
+
+def test_counters_follow_inserts_and_removals(db):
+    created = [notification(), notification(alert_type="danger"), notification(sensor_id="s2"), notification(read=True)]
+    count_created(created)
+    assert get_summary("u1") == {"unread": 3, "by_severity": {"warning": 2, "danger": 1}, "by_sensor": {"s1": 2, "s2": 1}}
+
+    count_removed(created[1])
+    count_removed(None)
+    # Zeroed entries are hidden
+    assert get_summary("u1") == {"unread": 2, "by_severity": {"warning": 2}, "by_sensor": {"s1": 1, "s2": 1}}
+    assert get_summary("nobody") == {"unread": 0, "by_severity": {}, "by_sensor": {}}
+
+def test_rebuild_repairs_drift(db):
+    db.notifications.insert_many([notification(), notification(alert_type="danger"), notification("u2", read=True)])
+    # Counted twice and a user with nothing unread
+    count_created([notification()] * 5)
+    count_created([notification("u2")])
+
+    assert rebuild_counters() == 1
+    assert get_summary("u1") == {"unread": 2, "by_severity": {"warning": 1, "danger": 1}, "by_sensor": {"s1": 2}}
+    assert get_summary("u2")["unread"] == 0
+
+def test_rebuild_one_user_zeroes_it(db):
+    count_created([notification("u2")])
+    assert rebuild_counters("u2") == 1
+    assert db.notification_counters.find_one({"user_id": "u2"})["unread"] == 0
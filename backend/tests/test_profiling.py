@@ -0,0 +1,44 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from routes import profiling_routes
+from services.profiling import collapsed, stats_collapsed
+
+def func(name):
+    return ("~", 0, name)
+
+def test_stats_collapsed_splits_time_over_the_callers():
+    # main calls a and b, both call c: c's 6 ms are 4 ms under a and 2 ms under b
+    stats = SimpleNamespace(stats={
+        func("main"): (1, 1, 0.001, 0.010, {}),
+        func("a"): (1, 1, 0.002, 0.006, {func("main"): (1, 1, 0.002, 0.006)}),
+        func("b"): (1, 1, 0.001, 0.003, {func("main"): (1, 1, 0.001, 0.003)}),
+        func("c"): (2, 2, 0.006, 0.006, {func("a"): (1, 1, 0.004, 0.004), func("b"): (1, 1, 0.002, 0.002)}),
+    })
+    result = {stack: round(us) for stack, us in stats_collapsed(stats).items()}
+    assert result == {"main": 1000, "main;a": 2000, "main;a;c": 4000, "main;b": 1000, "main;b;c": 2000}
+
+def test_stats_collapsed_stops_at_recursion():
+    stats = SimpleNamespace(stats={
+        func("main"): (1, 1, 0.001, 0.003, {}),
+        func("walk"): (2, 1, 0.002, 0.002, {func("main"): (1, 1, 0.001, 0.002), func("walk"): (1, 1, 0.001, 0.001)}),
+    })
+    assert set(stats_collapsed(stats)) == {"main", "main;walk"}
+
+def test_collapsed_lines_biggest_first():
+    assert collapsed({"main;a": 2.4, "main": 10, "main;b": 0.4}) == "main 10\nmain;a 2\n"
+
+@pytest.mark.parametrize("call", [
+    lambda: profiling_routes.start_tracemalloc(frames=0, current_user="admin"),
+    lambda: profiling_routes.start_tracemalloc(frames=70000, current_user="admin"),
+    lambda: profiling_routes.tracemalloc_snapshot(limit=0, current_user="admin"),
+    lambda: profiling_routes.tracemalloc_snapshot(limit=10 ** 9, current_user="admin"),
+    lambda: profiling_routes.get_request_profile("any", limit=-1, current_user="admin"),
+])
+def test_out_of_range_arguments_are_400s(call):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(call())
+    assert error.value.status_code == 400
@@ -0,0 +1,131 @@
+import pytest
+
+from services import rate_limiter
+from services.rate_limiter import RateLimiter, TokenBucket, validate_rate_limit
+
+def sensor(sensor_id="s1", **rate_limit):
+    return {"sensor_id": sensor_id, "owner_id": "owner", "rate_limit": rate_limit}
+
+def reading(value, sensor_id="s1", **extra):
+    return {"sensor_id": sensor_id, "readings": {"temperature": value, **extra}}
+
+@pytest.fixture(autouse=True)
+def no_owner_limit(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "OWNER_RATE", 0)
+    for key in rate_limiter.stats:
+        monkeypatch.setitem(rate_limiter.stats, key, 0)
+
+def test_validate_rate_limit():
+    assert validate_rate_limit(None) is None
+    assert validate_rate_limit({"rate": 5, "burst": 10, "policy": "aggregate"}) == {"rate": 5.0, "burst": 10.0, "policy": "aggregate"}
+    # 0 is "no limit"
+    assert validate_rate_limit({"rate": 0}) == {"rate": 0.0}
+
+@pytest.mark.parametrize("config", [
+    "fast",
+    {"burst": 0},
+    {"burst": 0.5},
+    {"rate": -1},
+    {"rate": True},
+    {"rate": "10"},
+    {"policy": "drop"},
+])
+def test_validate_rate_limit_rejects(config):
+    with pytest.raises(ValueError):
+        validate_rate_limit(config)
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.available(now)
+        bucket.take()
+    assert not bucket.available(now)
+    assert bucket.retry_after() == pytest.approx(0.5)
+    assert bucket.available(now + 0.5)
+    bucket.available(now + 100)
+    assert bucket.tokens == 3
+
+def test_reject_policy_counts_rejected_readings():
+    limiter = RateLimiter()
+    limited = sensor(rate=1, burst=1)
+    assert limiter.admit(limited, reading(1)) is None
+    verdict = limiter.admit(limited, reading(2))
+    assert verdict["rate_limited"] == "rejected"
+    assert verdict["retry_after"] > 0
+    assert limiter.snapshot()["sensors"]["s1"] == {"dropped": 1, "coalesced": 0}
+
+def test_batch_is_charged_per_reading_in_one_take():
+    limiter = RateLimiter()
+    limited = sensor(rate=1, burst=5)
+    assert limiter.admit_many(limited, [reading(value) for value in range(3)]) == (3, None)
+    admitted, verdict = limiter.admit_many(limited, [reading(value) for value in range(3)])
+    # Only the oldest two fit in what is left of the bucket
+    assert admitted == 2
+    assert verdict["rate_limited"] == "rejected"
+    assert rate_limiter.stats["admitted"] == 5
+    assert rate_limiter.stats["dropped"] == 1
+
+def test_large_batch_against_a_small_burst():
+    limiter = RateLimiter()
+    limited = sensor(rate=1, burst=20)
+    admitted, verdict = limiter.admit_many(limited, [reading(value) for value in range(65535)])
+    assert admitted == 20
+    assert verdict["rate_limited"] == "rejected"
+    assert 0 < verdict["retry_after"] <= 1
+    assert limiter.snapshot()["sensors"]["s1"]["dropped"] == 65515
+    assert limiter.admit_many(limited, [reading(1)])[0] == 0
+
+def test_owner_bucket_limits_the_batch_too(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "OWNER_RATE", 1)
+    monkeypatch.setattr(rate_limiter, "OWNER_BURST", 3)
+    limiter = RateLimiter()
+    assert limiter.admit_many(sensor("s1", rate=0), [reading(value) for value in range(2)])[0] == 2
+    assert limiter.admit_many(sensor("s2", rate=0), [reading(value, "s2") for value in range(2)])[0] == 1
+
+def test_keep_latest_holds_newest_reading():
+    limiter = RateLimiter()
+    limited = sensor(rate=1, burst=1, policy="keep_latest")
+    limiter.admit(limited, reading(1))
+    assert limiter.admit_many(limited, [reading(2), reading(3)]) == (0, {"rate_limited": "coalesced"})
+    assert limiter.held["s1"][1]["readings"] == {"temperature": 3}
+
+def test_aggregate_averages_held_readings():
+    limiter = RateLimiter()
+    limited = sensor(rate=1, burst=1, policy="aggregate")
+    limiter.admit(limited, reading(0))
+    limiter.admit(limited, reading(10, accelerometer={"x": 1.0}))
+    limiter.admit_many(limited, [reading(20, accelerometer={"x": 3.0}), reading(30, accelerometer={"x": 5.0})])
+    held = limiter.held["s1"][1]
+    assert held["readings"]["temperature"] == pytest.approx(20)
+    assert held["readings"]["accelerometer"]["x"] == pytest.approx(3.0)
+    assert held["coalesced_count"] == 3
+
+def test_release_held_once_tokens_return(monkeypatch):
+    limiter = RateLimiter()
+    limited = sensor(rate=1, burst=1, policy="keep_latest")
+    limiter.admit(limited, reading(1))
+    limiter.admit(limited, reading(2))
+    assert limiter.release_held() == []
+
+    bucket = limiter.sensor_buckets["s1"]
+    bucket.updated -= 1
+    released = limiter.release_held()
+    assert [held["readings"]["temperature"] for held in released] == [2]
+    assert limiter.held == {}
+
+def test_idle_sensors_are_forgotten():
+    limiter = RateLimiter()
+    limited = sensor(rate=1, burst=1)
+    limiter.admit(limited, reading(1))
+    limiter.admit(limited, reading(2))
+    limiter.sensor_buckets["s1"].updated -= rate_limiter.IDLE_SECONDS + 1
+    limiter.limited_at["s1"] -= rate_limiter.IDLE_SECONDS + 1
+    limiter.release_held()
+    assert limiter.sensor_buckets == {}
+    assert limiter.snapshot()["sensors"] == {}
+
+def test_zero_rate_means_unlimited():
+    limiter = RateLimiter()
+    unlimited = sensor(rate=0)
+    assert all(limiter.admit(unlimited, reading(value)) is None for value in range(100))
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.readings_store import ReadingStore, SqliteReadingStore
+
+START = datetime(2026, 3, 1, 12, 0, 0)
+# Bucket starts are sent upstream in UTC
+UTC_START = START.astimezone(timezone.utc)
+
+def reading(sensor_id, seconds, **values):
+    return {
+        "sensor_id": sensor_id,
+        "timestamp": START + timedelta(seconds=seconds),
+        "status": "active",
+        "readings": values,
+    }
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteReadingStore(str(tmp_path / "edge.db"))
+    yield store
+    store.close()
+
+def test_reading_store_is_abstract():
+    with pytest.raises(TypeError):
+        ReadingStore()
+
+def test_recent_is_newest_first_in_naive_local_time(store):
+    assert store.insert_many([reading("a", seconds, temperature=seconds) for seconds in range(5)]) == 5
+    store.insert_many([reading("b", 0, temperature=99)])
+
+    recent = store.recent("a", 3)
+    assert [document["readings"]["temperature"] for document in recent] == [4, 3, 2]
+    assert recent[0]["timestamp"] == START + timedelta(seconds=4)
+    assert recent[0]["timestamp"].tzinfo is None
+    assert recent[0]["sensor_id"] == "a"
+    assert isinstance(recent[0]["_id"], str)
+
+def test_recent_between_start_and_end(store):
+    store.insert_many([reading("a", seconds, temperature=seconds) for seconds in range(10)])
+    window = store.recent("a", 100, START + timedelta(seconds=3), START + timedelta(seconds=5))
+    assert [document["readings"]["temperature"] for document in window] == [5, 4, 3]
+
+def test_latest_many_has_every_sensor(store):
+    store.insert_many([reading("a", seconds, temperature=seconds) for seconds in range(3)])
+    latest = store.latest_many(["a", "missing"], 2)
+    assert [document["readings"]["temperature"] for document in latest["a"]] == [2, 1]
+    assert latest["missing"] == []
+
+def test_location_round_trips(store):
+    location = {"type": "Point", "coordinates": [-73.2, 45.5]}
+    store.insert_many([{**reading("a", 0, adc=1), "location": location}])
+    assert store.recent("a", 1)[0]["location"] == location
+
+def test_failed_batch_is_rolled_back(store):
+    with pytest.raises(KeyError):
+        store.insert_many([reading("a", 0, adc=1), {"sensor_id": "a"}])
+    assert store.count() == 0
+
+def test_minute_aggregates(store):
+    store.insert_many([
+        reading("a", 0, temperature=10, accelerometer={"x": 1.0}),
+        reading("a", 30, temperature=20, accelerometer={"x": 3.0}, status="text"),
+        reading("a", 61, temperature=5),
+        reading("b", 10, temperature=7),
+    ])
+    buckets = {(bucket["sensor_id"], bucket["start"]): bucket for bucket in store.minute_aggregates(0, store.last_id(), 60)}
+    assert set(buckets) == {("a", UTC_START), ("a", UTC_START + timedelta(minutes=1)), ("b", UTC_START)}
+
+    first = buckets[("a", UTC_START)]
+    assert first["count"] == 2
+    assert first["seconds"] == 60
+    assert first["fields"]["temperature"] == {"count": 2, "sum": 30, "min": 10, "max": 20}
+    assert first["fields"]["accelerometer.x"] == {"count": 2, "sum": 4.0, "min": 1.0, "max": 3.0}
+    # Strings are not aggregated
+    assert "status" not in first["fields"]
+
+def test_minute_aggregates_field_names_are_unquoted(store):
+    store.insert_many([reading("a", 0, **{"my field": 1, "say \"hi\"": 2, "vector": {"sp ace": 3}, "list": [4]})])
+    [bucket] = store.minute_aggregates(0, store.last_id(), 60)
+    assert set(bucket["fields"]) == {"my field", 'say "hi"', "vector.sp ace", "list[0]"}
+
+def test_minute_aggregates_recompute_touched_buckets(store):
+    store.insert_many([reading("a", 0, temperature=10)])
+    synced = store.last_id()
+    store.insert_many([reading("a", 20, temperature=30)])
+
+    # Only the new reading is after the synced id, but its whole bucket is sent again
+    [bucket] = store.minute_aggregates(synced, store.last_id(), 60)
+    assert bucket["count"] == 2
+    assert bucket["fields"]["temperature"]["sum"] == 40
+
+def test_prune_keeps_unsynced_readings(store):
+    store.insert_many([reading("a", seconds, adc=seconds) for seconds in range(4)])
+    synced = store.last_id() - 1
+    assert store.prune(START + timedelta(hours=1), synced) == 3
+    assert [document["readings"]["adc"] for document in store.recent("a", 10)] == [3]
+
+def test_sync_state(store):
+    assert store.get_state("synced_id", 0) == 0
+    store.set_state("synced_id", 42)
+    store.set_state("synced_id", 43)
+    assert store.get_state("synced_id") == 43
+
+def test_sensor_ids(store):
+    store.insert_many([reading("a", 0, adc=1), reading("b", 0, adc=1), reading("a", 1, adc=1)])
+    assert sorted(store.sensor_ids()) == ["a", "b"]
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from services import replay_service
+from services.replay_service import Pacer, replay_history, validate_options
+
+START = datetime(2026, 3, 1, 12, 0, 0)
+
+@pytest.fixture
+def db(mongo, monkeypatch):
+    monkeypatch.setattr(replay_service, "sensors_collection", mongo.sensors)
+    monkeypatch.setattr(replay_service, "sensor_data_collection", mongo.sensor_data)
+    monkeypatch.setattr(replay_service, "notification_collection", mongo.notifications)
+    mongo.sensors.insert_one({"sensor_id": "s1", "owner_id": "owner", "name": "Pump", "last_seen": START + timedelta(minutes=5)})
+    # Steady readings, then a jump the stored alerts missed
+    temperatures = [20, 20, 20, 20, 20, 40]
+    mongo.sensor_data.insert_many([
+        {"sensor_id": "s1", "timestamp": START + timedelta(minutes=minute), "status": "active",
+         "readings": {"temperature": temperature}, "alerts": {}}
+        for minute, temperature in enumerate(temperatures)
+    ])
+    return mongo
+
+@pytest.mark.parametrize("options", [{"notifications": "email"}, {"speed": -1}])
+def test_validate_options(options):
+    with pytest.raises(ValueError):
+        validate_options(**options)
+
+def test_pacer_sleeps_the_scaled_gap(monkeypatch):
+    slept = []
+    monkeypatch.setattr(replay_service.time, "sleep", slept.append)
+    pacer = Pacer(speed=60)
+    for minute in (0, 1, 3):
+        pacer.wait(START + timedelta(minutes=minute))
+    assert slept == [1.0, 2.0]
+    Pacer().wait(START)
+    assert slept == [1.0, 2.0]
+
+def test_replay_rewrites_changed_alerts(db):
+    summary = replay_history("s1")
+    assert summary["readings"] == 6
+    assert summary["changed"] == 3
+    latest = db.sensor_data.find_one({"timestamp": START + timedelta(minutes=5)})
+    assert latest["alerts"] == {"temperature": "danger"}
+    # Still the sensor's latest reading, so its alerts are mirrored
+    assert db.sensors.find_one()["alerts"] == {"temperature": "danger"}
+    assert db.notifications.count_documents({}) == 0
+
+def test_dry_run_writes_nothing(db):
+    summary = replay_history("s1", notifications="regenerate", dry_run=True)
+    assert summary["changed"] == 3
+    assert summary["notifications"] == 1
+    assert db.sensor_data.count_documents({"alerts": {}}) == 6
+    assert "alerts" not in db.sensors.find_one()
+
+def test_regenerated_notifications_are_dated_by_the_reading(db):
+    db.notifications.insert_one({"sensor_id": "s1", "data": {"sensor_data": {"timestamp": START + timedelta(minutes=4)}}})
+    summary = replay_history("s1", start=START + timedelta(minutes=4), notifications="regenerate")
+    assert summary["removed_notifications"] == 1
+    [notification] = db.notifications.find()
+    assert notification["timestamp"] == START + timedelta(minutes=5)
+    assert notification["alert_type"] == "danger"
+
+def test_unknown_sensor(db):
+    assert replay_history("missing")["error"] == "Sensor not registered"
@@ -0,0 +1,82 @@
+import pytest
+from starlette.requests import Request
+
+from services import response_cache
+from services.response_cache import ResponseCache
+
+def request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(response_cache, "cache", cache)
+    monkeypatch.setattr(response_cache, "ENABLED", True)
+    return cache
+
+def test_entry_is_valid_until_a_scope_is_bumped(cache):
+    entry = cache.store(("key",), ["sensor:a"], b"[]", cache.clock)
+    assert cache.lookup(("key",)) is entry
+    cache.bump("sensor:b")
+    assert cache.lookup(("key",)) is entry
+    cache.bump("sensor:a")
+    assert cache.lookup(("key",)) is None
+
+def test_write_during_build_invalidates_entry(cache):
+    built_at = cache.clock
+    cache.bump("sensor:a")
+    cache.store(("key",), ["sensor:a"], b"[]", built_at)
+    assert cache.lookup(("key",)) is None
+
+def test_etag_differs_per_body_at_the_same_clock(cache):
+    # Two users on the same URL, built at the same clock
+    first = cache.store(("list", "alice"), ["projects:alice"], b'["alice"]', cache.clock)
+    second = cache.store(("list", "bob"), ["projects:bob"], b'["bob"]', cache.clock)
+    assert first.etag != second.etag
+    same = cache.store(("list", "carol"), ["projects:carol"], b'["alice"]', cache.clock)
+    assert same.etag == first.etag
+
+def test_entries_expire(cache, monkeypatch):
+    cache.store(("key",), [], b"[]", cache.clock, max_age=0)
+    assert cache.lookup(("key",)) is None
+    monkeypatch.setattr(response_cache, "TTL_SECONDS", 0)
+    cache.store(("other",), [], b"[]", cache.clock)
+    assert cache.lookup(("other",)) is None
+
+def test_least_recently_used_entries_are_evicted(cache, monkeypatch):
+    monkeypatch.setattr(response_cache, "MAX_ENTRIES", 2)
+    for key in ("a", "b"):
+        cache.store((key,), [], b"[]", cache.clock)
+    cache.lookup(("a",))
+    cache.store(("c",), [], b"[]", cache.clock)
+    assert list(cache.entries) == [("a",), ("c",)]
+
+def test_cached_json_answers_if_none_match(cache):
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"value": 1}, ["sensor:a"]
+
+    first = response_cache.cached_json(request(), ("key",), build)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    assert response_cache.cached_json(request(etag), ("key",), build).status_code == 304
+    assert response_cache.cached_json(request(f'W/"other", {etag}'), ("key",), build).status_code == 304
+    assert len(builds) == 1
+
+    response_cache.bump("sensor:a")
+    rebuilt = response_cache.cached_json(request(etag), ("key",), build)
+    # Same content, same tag: still a 304, but it was rebuilt
+    assert rebuilt.status_code == 304
+    assert len(builds) == 2
+
+def test_build_errors_are_not_cached(cache):
+    def build():
+        raise RuntimeError("mongo down")
+
+    with pytest.raises(RuntimeError):
+        response_cache.cached_json(request(), ("key",), build)
+    assert cache.lookup(("key",)) is None
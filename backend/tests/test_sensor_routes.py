@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routes import sensor_routes
+from services import response_cache
+from services.auth_service import get_current_user
+
+class Store:
+    def __init__(self):
+        self.calls = []
+
+    def latest_many(self, sensor_ids, limit, since, end):
+        self.calls.append((sensor_ids, limit, since, end))
+        return {sensor: [] for sensor in sensor_ids}
+
+@pytest.fixture
+def store(mongo, monkeypatch):
+    monkeypatch.setattr(sensor_routes, "sensors_reads", mongo.sensors)
+    monkeypatch.setattr(sensor_routes, "assets_reads", mongo.assets)
+    monkeypatch.setattr(sensor_routes.acl, "owns", lambda user, kind, key: key == "p1")
+    monkeypatch.setattr(response_cache, "ENABLED", False)
+    store = Store()
+    monkeypatch.setattr(sensor_routes.readings_store, "get_store", lambda reads=False: store)
+    mongo.assets.insert_many([{"asset_id": "a1", "project_id": "p1", "owner_id": "ann"}, {"asset_id": "a2", "project_id": "p1", "owner_id": "ann"}])
+    mongo.sensors.insert_many([
+        {"sensor_id": "s2", "owner_id": "ann", "asset_ids": ["a1"]},
+        {"sensor_id": "s1", "owner_id": "ann", "asset_ids": ["a1"]},
+        {"sensor_id": "s3", "owner_id": "ann", "asset_ids": ["a2"]},
+        {"sensor_id": "other", "owner_id": "bob", "asset_ids": ["a1"]},
+    ])
+    return store
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(sensor_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: "ann"
+    return TestClient(app)
+
+def test_sensor_ids_are_checked_and_searched_in_a_window(client, store):
+    response = client.get("/api/sensor-data", params={"sensor_id": ["s2", "s1"], "limit": 5})
+    assert response.status_code == 200
+    assert response.json() == {"s1": [], "s2": []}
+    [(sensor_ids, limit, since, end)] = store.calls
+    assert (sensor_ids, limit, end) == (["s1", "s2"], 5, None)
+    expected = datetime.now() - timedelta(hours=sensor_routes.BATCH_WINDOW_HOURS)
+    assert abs(since - expected) < timedelta(seconds=5)
+
+def test_start_replaces_the_window(client, store):
+    client.get("/api/sensor-data", params={"asset_id": "a1", "start": "2024-01-01T00:00:00", "end": "2024-01-02T00:00:00"})
+    [(sensor_ids, _, since, end)] = store.calls
+    assert sensor_ids == ["s1", "s2"]
+    assert (since, end) == (datetime(2024, 1, 1), datetime(2024, 1, 2))
+
+def test_project_covers_its_assets(client, store):
+    assert client.get("/api/sensor-data", params={"project_id": "p1"}).json() == {"s1": [], "s2": [], "s3": []}
+    assert client.get("/api/sensor-data", params={"project_id": "p2"}).status_code == 404
+
+@pytest.mark.parametrize("params, status", [
+    ({"sensor_id": ["s1", "other"]}, 404),
+    ({"sensor_id": ["s1"], "limit": 0}, 400),
+    ({"sensor_id": ["s1"], "limit": 1001}, 400),
+    ({}, 400),
+    ({"sensor_id": [f"s{index}" for index in range(sensor_routes.MAX_BATCH_SENSORS + 1)]}, 400),
+])
+def test_refused(client, store, params, status):
+    assert client.get("/api/sensor-data", params=params).status_code == status
+    assert store.calls == []
+
+def test_too_many_sensors_in_an_asset(client, store, monkeypatch):
+    monkeypatch.setattr(sensor_routes, "MAX_BATCH_SENSORS", 1)
+    assert client.get("/api/sensor-data", params={"asset_id": "a1"}).status_code == 400
@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+
+import orjson
+import pytest
+
+from services.sensor_service import MissingSensorId, classify_alert, decode_sensor_payload, parse_position, parse_timestamp
+
+EPOCH = datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc)
+
+@pytest.mark.parametrize("value", [1700000000, 1700000000.0, 1700000000000, "1700000000", "1700000000000"])
+def test_unix_seconds_and_milliseconds(value):
+    assert parse_timestamp(value) == EPOCH
+
+def test_iso_strings():
+    assert parse_timestamp("2023-11-14T22:13:20Z") == EPOCH
+    assert parse_timestamp("2023-11-14T22:13:20") == datetime(2023, 11, 14, 22, 13, 20)
+
+@pytest.mark.parametrize("value", [None, True, [1], "yesterday", 1e20, 1e300, float("inf"), float("nan"), "inf", 10 ** 400])
+def test_invalid_timestamps_are_value_errors(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+def test_decode_normalises_vectors_and_keeps_other_fields():
+    document = decode_sensor_payload(orjson.dumps({
+        "sensor_id": "s1",
+        "timestamp": 1700000000,
+        "temperature": 21.5,
+        "accelerometer": [1, 2, 3],
+        "magnetometer": {"x": 4, "w": 9},
+        "custom": "value",
+    }))
+    assert document == {
+        "sensor_id": "s1",
+        "timestamp": EPOCH,
+        "status": "active",
+        "readings": {
+            "temperature": 21.5,
+            "accelerometer": {"x": 1, "y": 2, "z": 3},
+            "magnetometer": {"x": 4, "y": None, "z": None},
+            "custom": "value",
+        },
+    }
+
+def test_decode_parses_position_into_location():
+    document = decode_sensor_payload(b'{"sensor_id": "s1", "position": "45.5, -73.2"}')
+    assert document["readings"]["position"] == "45.5, -73.2"
+    assert document["location"] == {"type": "Point", "coordinates": [-73.2, 45.5]}
+    assert document["timestamp"].tzinfo is None
+
+@pytest.mark.parametrize("body", [b"[]", b'{"sensor_id": 5}', b'{"sensor_id": "s1", "timestamp": null}', b'{"sensor_id": "s1", "status": 1}', b"{"])
+def test_decode_rejects(body):
+    with pytest.raises(ValueError):
+        decode_sensor_payload(body)
+
+def test_missing_sensor_id():
+    with pytest.raises(MissingSensorId):
+        decode_sensor_payload(b'{"temperature": 1}')
+
+@pytest.mark.parametrize("value, coordinates", [
+    ("45.5, -73.2", [-73.2, 45.5]),
+    ([45.5, -73.2], [-73.2, 45.5]),
+    ("-90,180", [180.0, -90.0]),
+])
+def test_parse_position_is_longitude_first(value, coordinates):
+    assert parse_position(value) == {"type": "Point", "coordinates": coordinates}
+
+@pytest.mark.parametrize("value", ["45.5", "a, b", "91, 0", "0, 181", "nan, 0", [1, 2, 3], None, 45.5])
+def test_invalid_positions(value):
+    assert parse_position(value) is None
+
+def test_classify_alert_uses_the_parsed_location():
+    history = [{"readings": {"adc": 1}}] * 3
+    reading = {"readings": {"position": "not, parsed"}, "location": {"type": "Point", "coordinates": [0.0, 0.0]}}
+    # Ingest already parsed it, the string is not split again
+    assert "position" not in classify_alert(reading, history)
+    assert classify_alert({"readings": {"position": "95, 0"}}, history)["position"] == "invalid"
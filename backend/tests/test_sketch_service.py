@@ -0,0 +1,89 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services import sketch_service
+from services.sketch_service import RELATIVE_ACCURACY, Sketch, bucket_of, numeric_fields
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+def as_document(sketch):
+    # The shape record() upserts into sensor_sketches
+    return {
+        "count": sketch.count,
+        "sum": sketch.sum,
+        "min": sketch.min,
+        "max": sketch.max,
+        "zero": sketch.zero,
+        "pos": {str(key): count for key, count in sketch.pos.items()},
+        "neg": {str(key): count for key, count in sketch.neg.items()},
+    }
+
+def test_quantiles_within_relative_accuracy():
+    generator = random.Random(7)
+    values = [generator.lognormvariate(3, 1) for _ in range(5000)] + [-generator.uniform(1, 50) for _ in range(500)]
+    sketch = Sketch()
+    for value in values:
+        sketch.add(value)
+
+    quantiles = sketch.quantiles([0.01, 0.25, 0.5, 0.9, 0.99])
+    for q, estimate in quantiles.items():
+        exact = exact_quantile(values, float(q))
+        assert abs(estimate - exact) <= RELATIVE_ACCURACY * abs(exact) + 1e-9
+
+def test_zero_and_empty():
+    assert Sketch().quantiles([0.5]) == {"0.5": None}
+    assert Sketch().histogram(4) == []
+
+    sketch = Sketch()
+    for value in (0.0, 0.0, 0.0, 5.0):
+        sketch.add(value)
+    assert sketch.quantiles([0.5])["0.5"] == 0.0
+    assert sketch.summary() == {"count": 4, "min": 0.0, "max": 5.0, "mean": 1.25}
+
+def test_merging_documents_matches_one_sketch():
+    generator = random.Random(3)
+    first, second, both = Sketch(), Sketch(), Sketch()
+    for index in range(2000):
+        value = generator.gauss(20, 5)
+        (first if index % 2 else second).add(value)
+        both.add(value)
+
+    merged = Sketch()
+    merged.merge_document(as_document(first))
+    merged.merge_document(as_document(second))
+
+    assert merged.count == both.count
+    assert merged.sum == pytest.approx(both.sum)
+    assert (merged.min, merged.max) == (both.min, both.max)
+    assert merged.quantiles([0.1, 0.5, 0.9]) == both.quantiles([0.1, 0.5, 0.9])
+
+def test_histogram_counts_every_value():
+    sketch = Sketch()
+    for value in range(1, 101):
+        sketch.add(float(value))
+    histogram = sketch.histogram(10)
+    assert len(histogram) == 10
+    assert sum(bucket["count"] for bucket in histogram) == 100
+    assert histogram[0]["lower"] == 1.0
+    assert histogram[-1]["upper"] == pytest.approx(100.0)
+
+def test_numeric_fields_flattens_vectors_and_skips_the_rest():
+    readings = {
+        "temperature": 21.5,
+        "adc": 3,
+        "accelerometer": {"x": 1.0, "y": None, "z": float("nan")},
+        "position": "45.5, -73.2",
+        "flag": True,
+    }
+    assert dict(numeric_fields(readings)) == {"temperature": 21.5, "adc": 3, "accelerometer.x": 1.0}
+
+def test_bucket_of_aligns_to_bucket_minutes(monkeypatch):
+    monkeypatch.setattr(sketch_service, "BUCKET_MINUTES", 60)
+    assert bucket_of(datetime(2026, 1, 2, 3, 59, 59)) == datetime(2026, 1, 2, 3)
+    # Aware timestamps are bucketed in UTC
+    aware = datetime(2026, 1, 2, 3, 30, tzinfo=timezone(timedelta(hours=2)))
+    assert bucket_of(aware) == datetime(2026, 1, 2, 1)
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from services import stats_service
+
+@pytest.fixture
+def computed(monkeypatch):
+    """Calls to compute_fleet_stats, which returns how many there were."""
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"computations": len(calls)}
+
+    monkeypatch.setattr(stats_service, "compute_fleet_stats", compute)
+    monkeypatch.setattr(stats_service, "_cache", {"stats": None, "computed_at": 0.0})
+    return calls
+
+def test_first_request_computes_then_serves_the_copy(computed):
+    assert stats_service.get_fleet_stats() == {"computations": 1}
+    assert stats_service.get_fleet_stats() == {"computations": 1}
+    assert len(computed) == 1
+
+def test_stale_copy_is_served_while_it_refreshes(computed, monkeypatch):
+    release, refreshed = threading.Event(), threading.Event()
+    refresh = stats_service.refresh
+
+    def refresh_and_signal():
+        release.wait(5)
+        refresh()
+        refreshed.set()
+
+    monkeypatch.setattr(stats_service, "refresh", refresh_and_signal)
+    stats_service.get_fleet_stats()
+    stats_service._cache["computed_at"] -= stats_service.STATS_TTL_SECONDS + 1
+
+    assert stats_service.get_fleet_stats() == {"computations": 1}
+    release.set()
+    assert refreshed.wait(5)
+    assert stats_service.get_fleet_stats() == {"computations": 2}
+
+def test_one_refresh_at_a_time(computed):
+    with stats_service._refresh_lock:
+        stats_service.refresh()
+    assert computed == []
+
+def test_failed_refresh_keeps_the_copy(computed, monkeypatch):
+    stats_service.get_fleet_stats()
+
+    def failing():
+        raise RuntimeError("mongo down")
+
+    monkeypatch.setattr(stats_service, "compute_fleet_stats", failing)
+    stats_service.refresh()
+    assert stats_service.get_fleet_stats() == {"computations": 1}
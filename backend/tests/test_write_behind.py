@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+import signal
+import time
+
+import bson
+import pytest
+
+from services import write_behind
+from services.write_behind import WriteBehindLog
+
+@pytest.fixture
+def commits(monkeypatch):
+    """Commits the log makes, instead of writing to MongoDB."""
+    committed = []
+    monkeypatch.setattr(write_behind, "commit", lambda sensor_data, notifications, sensor_updates: committed.append((sensor_data, notifications, sensor_updates)))
+    return committed
+
+def record(reading_id, sensor_id="s1"):
+    return bson.encode({
+        "sensor_data": [{"_id": reading_id, "sensor_id": sensor_id}],
+        "notifications": [{"notification_id": f"n{reading_id}"}],
+        "sensor_updates": {sensor_id: {"alerts": {"temperature": "good"}, "last_seen": reading_id}},
+    })
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_replay_commits_segments_left_behind(tmp_path, commits):
+    (tmp_path / "1-100-00000001.wal").write_bytes(record(1) + record(2))
+    (tmp_path / "2-100-00000001.wal").write_bytes(record(3, "s2"))
+
+    log = WriteBehindLog(str(tmp_path), "wal-fsync")
+    try:
+        assert len(commits) == 2
+        sensor_data, notifications, sensor_updates = commits[0]
+        assert [reading["_id"] for reading in sensor_data] == [1, 2]
+        assert len(notifications) == 2
+        # Later groups of the same sensor win
+        assert sensor_updates == {"s1": {"alerts": {"temperature": "good"}, "last_seen": 2}}
+        assert commits[1][2] == {"s2": {"alerts": {"temperature": "good"}, "last_seen": 3}}
+        assert log.stats["replayed"] == 3
+        assert not [name for name in os.listdir(tmp_path) if name.startswith(("1-", "2-"))]
+    finally:
+        log.close()
+
+def test_replay_stops_at_a_torn_record(tmp_path, commits):
+    (tmp_path / "1-100-00000001.wal").write_bytes(record(1) + record(2)[:-5])
+
+    log = WriteBehindLog(str(tmp_path), "wal-fsync")
+    log.close()
+    assert [reading["_id"] for reading in commits[0][0]] == [1]
+    assert os.listdir(tmp_path) == []
+
+def test_appended_groups_are_committed_and_visible_until_then(tmp_path, commits, monkeypatch):
+    monkeypatch.setattr(write_behind, "WAL_FLUSH_MS", 60_000)
+    monkeypatch.setattr(write_behind, "WAL_FSYNC_MS", 60_000)
+    log = WriteBehindLog(str(tmp_path), "wal-fsync")
+    log.append([{"_id": 1, "sensor_id": "s1"}], [], {"s1": {"last_seen": 1}})
+    log.append([{"_id": 2, "sensor_id": "s1"}, {"_id": 3, "sensor_id": "s2"}], [], {})
+    assert [reading["_id"] for reading in log.recent_readings("s1")] == [2, 1]
+
+    log.flush()
+    assert log.recent_readings("s1") == []
+    assert [reading["_id"] for reading in commits[0][0]] == [1, 2, 3]
+    log.close()
+    assert os.listdir(tmp_path) == []
+
+def test_failed_commit_is_retried_at_runtime(tmp_path, monkeypatch):
+    attempts = []
+
+    def flaky_commit(sensor_data, notifications, sensor_updates):
+        attempts.append([reading["_id"] for reading in sensor_data])
+        if len(attempts) <= 2:
+            raise RuntimeError("mongo down")
+
+    monkeypatch.setattr(write_behind, "commit", flaky_commit)
+    monkeypatch.setattr(write_behind, "WAL_FLUSH_MS", 10)
+    monkeypatch.setattr(write_behind, "WAL_FSYNC_MS", 10)
+    monkeypatch.setattr(write_behind, "WAL_RETRY_MS", 20)
+    log = WriteBehindLog(str(tmp_path), "wal-fsync")
+    try:
+        log.append([{"_id": 1, "sensor_id": "s1"}], [], {})
+        wait_for(lambda: log.stats["commit_errors"] >= 1)
+        # Still readable while it waits for its retry
+        assert [reading["_id"] for reading in log.recent_readings("s1")] == [1]
+
+        log.append([{"_id": 2, "sensor_id": "s1"}], [], {})
+        wait_for(lambda: not log.failed and log.stats["committed"] == 2)
+        # The newer segment queued behind the failed one, in order
+        assert attempts[-2:] == [[1], [2]]
+        assert log.stats["commit_errors"] == 2
+        assert log.recent_readings("s1") == []
+    finally:
+        log.close()
+    assert os.listdir(tmp_path) == []
+
+def test_uncommitted_segment_is_kept_for_replay_on_close(tmp_path, monkeypatch):
+    def failing_commit(sensor_data, notifications, sensor_updates):
+        raise RuntimeError("mongo down")
+
+    monkeypatch.setattr(write_behind, "commit", failing_commit)
+    monkeypatch.setattr(write_behind, "WAL_FLUSH_MS", 60_000)
+    monkeypatch.setattr(write_behind, "WAL_FSYNC_MS", 60_000)
+    log = WriteBehindLog(str(tmp_path), "wal-fsync")
+    log.append([{"_id": 1, "sensor_id": "s1"}], [], {"s1": {"last_seen": 1}})
+    log.close()
+    segments = os.listdir(tmp_path)
+    assert len(segments) == 1
+
+    replayed = []
+    monkeypatch.setattr(write_behind, "commit", lambda sensor_data, notifications, sensor_updates: replayed.append(sensor_data))
+    WriteBehindLog(str(tmp_path), "wal-fsync").close()
+    assert replayed == [[{"_id": 1, "sensor_id": "s1"}]]
+    assert os.listdir(tmp_path) == []
+
+def test_closed_log_refuses_appends(tmp_path, commits):
+    log = WriteBehindLog(str(tmp_path), "wal-async")
+    log.close()
+    with pytest.raises(RuntimeError):
+        log.append([], [], {})
+
+@pytest.mark.parametrize("durability", ["wal-interval", "wal-async"])
+def test_acknowledged_append_survives_a_process_crash(tmp_path, monkeypatch, durability):
+    monkeypatch.setattr(write_behind, "WAL_FLUSH_MS", 60_000)
+    monkeypatch.setattr(write_behind, "WAL_FSYNC_MS", 60_000)
+
+    def crash_after_append():
+        log = WriteBehindLog(str(tmp_path), durability)
+        log.append([{"_id": 1, "sensor_id": "s1"}], [], {"s1": {"last_seen": 1}})
+        # Killed before any fsync, flush or close
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    child = multiprocessing.get_context("fork").Process(target=crash_after_append)
+    child.start()
+    child.join(10)
+    assert child.exitcode == -signal.SIGKILL
+
+    replayed = []
+    monkeypatch.setattr(write_behind, "commit", lambda sensor_data, notifications, sensor_updates: replayed.append(sensor_data))
+    WriteBehindLog(str(tmp_path), durability).close()
+    assert replayed == [[{"_id": 1, "sensor_id": "s1"}]]
@@ -26,12 +26,12 @@ const NotificationBell = ({ auth }) => {
 
   const fetchUnreadCount = async () => {
     try {
-      const response = await axios.get('http://localhost:8000/api/notifications?unread_only=true', {
+      const response = await axios.get('http://localhost:8000/api/notifications/summary', {
         headers: {
           'Authorization': `Bearer ${auth.token}`
         }
       });
-      setUnreadCount(response.data.length);
+      setUnreadCount(response.data.unread);
     } catch (error) {
       console.error('Error fetching unread count:', error);
     }